@@ -0,0 +1,320 @@
+import argparse
+import contextlib
+import glob
+import io
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from types import SimpleNamespace
+
+from scripts.bench.fakevc import FakeVCenter
+from scripts.bench.hclserver import HclServer, build_all_json
+from scripts.bench.vsanserver import VsanServer
+
+# Default benchmark sizes
+VM_SIZES = [100, 1000, 10000, 50000]
+HCL_SIZES_MB = [1, 10, 50]
+PROFILE_COUNTS = [10, 100, 1000]
+DEFAULT_LATENCY_MS = 5
+DEFAULT_TAG_COUNT = 200
+BENCHMARKS = ("vms", "stats", "hcl", "upload", "merge")
+# Credential templates merged into the generated profile trees
+MERGE_TEMPLATES = ["scripts/manageVMs/manageVMs-cred.json", "scripts/hclupdate/hclupdate-cred.json"]
+# A change in seconds beyond this ratio is flagged by --compare
+REGRESSION_RATIO = 1.10
+
+BENCH_VCENTER = "bench.local"
+# Session handed to the vSAN endpoint by the upload benchmark
+BENCH_COOKIE = 'vmware_soap_session="bench"'
+BENCH_SOAP_VERSION = "vim.version.v8_0_3_0"
+
+
+# Set by --no-memory; tracemalloc slows allocation-heavy code, so wall times are lower without it
+trace_memory = True
+
+
+@contextlib.contextmanager
+def measure(result):
+    """
+    Records wall time and peak traced memory of the block into a result dictionary.
+
+    :param result: Dictionary receiving "seconds" and "peak_bytes" (None when memory tracing is off)
+    """
+    if trace_memory:
+        tracemalloc.start()
+        tracemalloc.reset_peak()
+    start = time.perf_counter()
+    try:
+        yield result
+    finally:
+        result["seconds"] = round(time.perf_counter() - start, 4)
+        result["peak_bytes"] = None
+        if trace_memory:
+            result["peak_bytes"] = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+
+
+def bench_vms(sizes, tag_count, latency, page_size, tag_batch_size, work_dir):
+    """
+    Times manageVMs._get_vms_with_tags against a FakeVCenter of each size.
+
+    :return: List of result dictionaries
+    """
+    from scripts.manageVMs import manageVMs, output, tagging
+
+    results = []
+    for size in sizes:
+        vcenter = FakeVCenter(size, tag_count, latency=latency)
+        result = {"bench": "vms", "case": "full", "size": size}
+        service_instance = vcenter.service_instance()
+        tag_cache = tagging.TagCache(vcenter.rest_session(), BENCH_VCENTER, ttl=0)
+        writer = output.InventoryWriter(os.path.join(work_dir, f"vms-{size}.json"))
+        with measure(result), contextlib.redirect_stdout(io.StringIO()), writer:
+            manageVMs._get_vms_with_tags(service_instance, BENCH_VCENTER, writer, None, page_size,
+                                         tag_cache, tag_batch_size)
+        result["round_trips"] = dict(vcenter.round_trips)
+        result["bytes"] = vcenter.bytes
+        result["records"] = writer.count
+        results.append(result)
+    return results
+
+
+def bench_stats(sizes, latency, batch_size, query_workers, work_dir):
+    """
+    Times perf.collect_stats against a FakeVCenter of each size (a third of the VMs are powered on).
+
+    :return: List of result dictionaries
+    """
+    from scripts.manageVMs import output, perf
+
+    results = []
+    for size in sizes:
+        vcenter = FakeVCenter(size, latency=latency)
+        result = {"bench": "stats", "case": "realtime", "size": size}
+        service_instance = vcenter.service_instance()
+        writer = output.InventoryWriter(os.path.join(work_dir, f"vmstats-{size}.json"), "ndjson")
+        with measure(result), writer:
+            perf.collect_stats(service_instance, BENCH_VCENTER, writer, batch_size=batch_size, workers=query_workers)
+        result["round_trips"] = dict(vcenter.round_trips)
+        result["bytes"] = vcenter.bytes
+        result["records"] = writer.count
+        results.append(result)
+    return results
+
+
+def bench_hcl(sizes_mb, latency, work_dir):
+    """
+    Times hclupdate.fetch_remote_data against a local HclServer, cold and with a warm cache.
+
+    :return: List of result dictionaries
+    """
+    from scripts.hclupdate import hclfetch, hclupdate
+
+    # Import requests and build the pooled session before anything is timed
+    hclfetch.get_session()
+    results = []
+    with HclServer(latency) as server:
+        for size_mb in sizes_mb:
+            server.set_payload(build_all_json(size_mb * 1024 * 1024))
+            cache_dir = os.path.join(work_dir, f"hcl-{size_mb}")
+            for case in ("cold", "warm"):
+                server.reset_counters()
+                result = {"bench": "hcl", "case": case, "size": size_mb}
+                with measure(result), contextlib.redirect_stdout(io.StringIO()):
+                    fields = hclupdate.fetch_remote_data(server.url, cache_dir)
+                if not fields:
+                    raise RuntimeError(f"fetch_remote_data failed for the {size_mb} MB document.")
+                result["round_trips"] = {"http": server.requests}
+                result["bytes"] = server.bytes
+                results.append(result)
+    return results
+
+
+def bench_upload(sizes_mb, latency, work_dir):
+    """
+    Times hclupload.upload_hcl of a customhcl.json through VsanVcUploadHclDb against a local VsanServer.
+
+    Each upload must arrive intact with the session cookie, and a rejecting endpoint must be reported as failed.
+
+    :return: List of result dictionaries
+    """
+    from scripts.hclupdate import hclupload
+
+    service_instance = SimpleNamespace(_stub=SimpleNamespace(host=BENCH_VCENTER, cookie=BENCH_COOKIE, version=BENCH_SOAP_VERSION))
+    results = []
+    with VsanServer(latency=latency) as server:
+        # Import pyVmomi and load the vSAN types before anything is timed
+        hclupload.get_health_system("127.0.0.1", BENCH_COOKIE, BENCH_SOAP_VERSION, -server.port).VsanVcUploadHclDb
+        for size_mb in sizes_mb:
+            path_customhcl = os.path.join(work_dir, f"customhcl-{size_mb}.json")
+            with open(path_customhcl, "wb") as hcl_file:
+                hcl_file.write(build_all_json(size_mb * 1024 * 1024))
+            server.reset_counters()
+            result = {"bench": "upload", "case": "python", "size": size_mb}
+            with measure(result):
+                upload = hclupload.upload_hcl(service_instance, path_customhcl, host="127.0.0.1", port=-server.port)
+            with open(path_customhcl, "rb") as hcl_file:
+                intact = server.db == hcl_file.read()
+            if upload["status"] != "updated" or not intact or server.cookie != BENCH_COOKIE:
+                raise RuntimeError(f"upload_hcl of the {size_mb} MB file did not reach the vSAN endpoint intact: {upload}")
+            result["round_trips"] = {"soap": server.requests}
+            result["bytes"] = server.bytes
+            results.append(result)
+
+        server.accept = False
+        upload = hclupload.upload_hcl(service_instance, path_customhcl, host="127.0.0.1", port=-server.port)
+        if upload["status"] != "failed":
+            raise RuntimeError(f"upload_hcl did not report a rejected upload as failed: {upload}")
+    return results
+
+
+def build_profile_tree(base_dir, count):
+    """
+    Creates count profiles under base_dir, each with a partial cred.json for the templates to fill in.
+
+    :return: Glob pattern matching the generated cred.json files
+    """
+    for index in range(count):
+        profile_dir = os.path.join(base_dir, f"lab{index:05d}")
+        os.makedirs(profile_dir, exist_ok=True)
+        with open(os.path.join(profile_dir, "cred.json"), "w") as cred_file:
+            json.dump({"vcenter": {"VCENTER_SERVER": f"vc{index}.lab.local", "VCENTER_USER": "administrator@vsphere.local"}},
+                      cred_file, indent=4)
+    return os.path.join(base_dir, "*", "cred.json")
+
+
+def bench_merge(counts, work_dir):
+    """
+    Times setcred.batch_merge of the repo's credential templates into generated profile trees.
+
+    :return: List of result dictionaries
+    """
+    from scripts import setcred
+
+    results = []
+    for count in counts:
+        pattern = build_profile_tree(os.path.join(work_dir, f"profiles-{count}"), count)
+        result = {"bench": "merge", "case": "batch", "size": count}
+        with measure(result), contextlib.redirect_stdout(io.StringIO()):
+            changes = setcred.batch_merge(MERGE_TEMPLATES, [pattern])
+        result["round_trips"] = {}
+        result["bytes"] = sum(os.path.getsize(path) for path in glob.glob(pattern))
+        result["records"] = len(changes)
+        results.append(result)
+    return results
+
+
+def _megabytes(value):
+    return "-" if value is None else f"{value / 1048576:.1f}"
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def compare(baseline_path, report):
+    """
+    Prints the change in seconds and peak memory of every case against a baseline report.
+
+    :param baseline_path: Path to an earlier bench JSON report
+    :param report: Current report dictionary
+    :return: True if any case got slower than REGRESSION_RATIO allows
+    """
+    with open(baseline_path, "r") as baseline_file:
+        baseline = json.load(baseline_file)
+    previous = {(r["bench"], r["case"], r["size"]): r for r in baseline.get("results", [])}
+    regressed = False
+    print(f"Compared with {baseline.get('commit', 'unknown')}:")
+    print(f"{'BENCH':<6} {'CASE':<6} {'SIZE':>7} {'SECONDS':>9} {'BEFORE':>9} {'RATIO':>6} {'PEAK MB':>8}")
+    for result in report["results"]:
+        before = previous.get((result["bench"], result["case"], result["size"]))
+        if not before:
+            continue
+        ratio = result["seconds"] / before["seconds"] if before["seconds"] else 1.0
+        flag = "  slower" if ratio > REGRESSION_RATIO else ""
+        regressed = regressed or bool(flag)
+        print(f"{result['bench']:<6} {result['case']:<6} {result['size']:>7} {result['seconds']:>9.3f} "
+              f"{before['seconds']:>9.3f} {ratio:>6.2f} {_megabytes(result['peak_bytes']):>8}{flag}")
+    return regressed
+
+
+def main(argv=None):
+    """
+    Runs the offline benchmarks and writes the results as JSON.
+
+    :param argv: Command-line arguments (defaults to sys.argv[1:])
+    :return: Exit code, 1 if --compare found a regression
+    """
+    parser = argparse.ArgumentParser(description="Offline benchmarks against a synthetic vCenter, HCL server and vSAN endpoint.")
+    parser.add_argument("--bench", nargs="+", choices=BENCHMARKS, default=list(BENCHMARKS), help="Benchmarks to run.")
+    parser.add_argument("--vms", type=int, nargs="+", default=VM_SIZES, help="Inventory sizes for the vms benchmark.")
+    parser.add_argument("--tags", type=int, default=DEFAULT_TAG_COUNT, help="Distinct tags in the synthetic inventory.")
+    parser.add_argument("--hcl-mb", type=int, nargs="+", default=HCL_SIZES_MB, help="all.json sizes in MB for the hcl and upload benchmarks.")
+    parser.add_argument("--profiles", type=int, nargs="+", default=PROFILE_COUNTS, help="Profile counts for the merge benchmark.")
+    parser.add_argument("--latency-ms", type=float, default=DEFAULT_LATENCY_MS, help="Simulated latency per round trip.")
+    parser.add_argument("--page-size", type=int, default=1000, help="PropertyCollector page size.")
+    parser.add_argument("--tag-batch-size", type=int, default=500, help="VMs per bulk tag lookup.")
+    parser.add_argument("--query-batch-size", type=int, default=250, help="VMs per QueryPerf call in the stats benchmark.")
+    parser.add_argument("--query-workers", type=int, default=8, help="QueryPerf calls in flight in the stats benchmark.")
+    parser.add_argument("--no-memory", action="store_true", help="Skip peak-memory tracing for undistorted wall times.")
+    parser.add_argument("--output", type=str, help="Results file (defaults to json/bench/bench-<commit>.json).")
+    parser.add_argument("--compare", type=str, help="Earlier results file to compare against.")
+    args = parser.parse_args(argv)
+
+    global trace_memory
+    trace_memory = not args.no_memory
+    latency = args.latency_ms / 1000
+    commit = git_commit()
+    report = {
+        "commit": commit,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "settings": {"latency_ms": args.latency_ms, "trace_memory": trace_memory, "tags": args.tags, "page_size": args.page_size,
+                     "tag_batch_size": args.tag_batch_size, "query_batch_size": args.query_batch_size,
+                     "query_workers": args.query_workers},
+        "results": [],
+    }
+    work_dir = tempfile.mkdtemp(prefix="vmlab-bench-")
+    try:
+        if "vms" in args.bench:
+            report["results"] += bench_vms(args.vms, args.tags, latency, args.page_size, args.tag_batch_size, work_dir)
+        if "stats" in args.bench:
+            report["results"] += bench_stats(args.vms, latency, args.query_batch_size, args.query_workers, work_dir)
+        if "hcl" in args.bench:
+            report["results"] += bench_hcl(args.hcl_mb, latency, work_dir)
+        if "upload" in args.bench:
+            report["results"] += bench_upload(args.hcl_mb, latency, work_dir)
+        if "merge" in args.bench:
+            report["results"] += bench_merge(args.profiles, work_dir)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    print(f"{'BENCH':<6} {'CASE':<6} {'SIZE':>7} {'SECONDS':>9} {'TRIPS':>7} {'BYTES':>12} {'PEAK MB':>8}")
+    for result in report["results"]:
+        print(f"{result['bench']:<6} {result['case']:<6} {result['size']:>7} {result['seconds']:>9.3f} "
+              f"{sum(result['round_trips'].values()):>7} {result['bytes']:>12} {_megabytes(result['peak_bytes']):>8}")
+
+    output_path = args.output or os.path.join("json", "bench", f"bench-{commit}.json")
+    os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+    with open(output_path, "w") as output_file:
+        json.dump(report, output_file, indent=4)
+    print(f"Results saved to {output_path}.")
+
+    if args.compare and compare(args.compare, report):
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,205 @@
+import datetime
+import json
+import threading
+import time
+from types import SimpleNamespace
+
+# Power states handed out round-robin to synthetic VMs
+POWER_STATES = ("poweredOn", "poweredOff", "suspended")
+# Tags per category in the synthetic tagging inventory
+TAGS_PER_CATEGORY = 10
+# Performance counters exposed by the synthetic PerformanceManager, as (group, counter, rollup)
+PERF_COUNTERS = [("cpu", "usage", "average"), ("cpu", "ready", "summation"), ("mem", "usage", "average"),
+                 ("disk", "usage", "average"), ("net", "usage", "average")]
+
+
+class FakeVCenter:
+    """
+    In-process stand-in for a vCenter holding N VMs and M tags.
+
+    It answers the PropertyCollector calls made by inventory.retrieve_pages, the PerformanceManager calls
+    made by perf.collect_stats and the tagging REST calls made by tagging.TagCache, sleeping for a fixed
+    latency on each call and counting round trips and bytes, so the collection code can be timed without
+    a live vCenter.
+    """
+
+    def __init__(self, vm_count, tag_count=50, tags_per_vm=2, latency=0.0):
+        """
+        :param vm_count: Number of VMs in the inventory
+        :param tag_count: Number of distinct tags
+        :param tags_per_vm: Tags attached to each VM
+        :param latency: Seconds slept per round trip
+        """
+        self.vm_count = vm_count
+        self.tag_count = max(1, tag_count)
+        self.tags_per_vm = min(tags_per_vm, self.tag_count)
+        self.latency = latency
+        self.round_trips = {"soap": 0, "rest": 0}
+        self.bytes = 0
+        self._lock = threading.Lock()
+        self._pages = {}
+
+    def _round_trip(self, kind, payload=None):
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            self.round_trips[kind] += 1
+            if payload is not None:
+                self.bytes += len(payload)
+
+    @staticmethod
+    def moid(index):
+        return f"vm-{index + 1}"
+
+    def _tag_ids(self, index):
+        return [f"urn:vmomi:InventoryServiceTag:{(index + offset) % self.tag_count}:GLOBAL"
+                for offset in range(self.tags_per_vm)]
+
+    @staticmethod
+    def _value(path, index):
+        if path == "name":
+            return f"bench-vm-{index:06d}"
+        if path == "runtime.powerState":
+            return POWER_STATES[index % len(POWER_STATES)]
+        return f"{path}-{index}"
+
+    # PropertyCollector
+
+    def service_instance(self):
+        """
+        Builds a service instance exposing RetrieveContent().
+
+        :return: Object usable in place of a connected vim.ServiceInstance for inventory.retrieve_pages
+        """
+        # The view ends up in a real ObjectSpec, so it has to be a managed object; calls on it are ignored
+        from pyVmomi import vim
+
+        view = vim.view.ContainerView("session[bench]view-1", _NullStub())
+        content = SimpleNamespace(
+            rootFolder=None,
+            viewManager=SimpleNamespace(CreateContainerView=lambda container, types, recursive: view),
+            propertyCollector=SimpleNamespace(RetrievePropertiesEx=self.RetrievePropertiesEx,
+                                              ContinueRetrievePropertiesEx=self.ContinueRetrievePropertiesEx),
+            perfManager=_FakePerfManager(self),
+        )
+        return SimpleNamespace(RetrieveContent=lambda: content, _stub=view._stub)
+
+    def _page(self, token):
+        start, paths, page_size = self._pages.pop(token)
+        end = min(start + page_size, self.vm_count)
+        objects = [
+            SimpleNamespace(obj=SimpleNamespace(_moId=self.moid(index)),
+                            propSet=[SimpleNamespace(name=path, val=self._value(path, index)) for path in paths])
+            for index in range(start, end)
+        ]
+        next_token = None
+        if end < self.vm_count:
+            next_token = str(end)
+            self._pages[next_token] = (end, paths, page_size)
+        self._round_trip("soap")
+        return SimpleNamespace(objects=objects, token=next_token)
+
+    def RetrievePropertiesEx(self, specs, options):
+        paths = list(specs[0].propSet[0].pathSet)
+        self._pages["0"] = (0, paths, options.maxObjects or self.vm_count)
+        return self._page("0")
+
+    def ContinueRetrievePropertiesEx(self, token):
+        return self._page(token)
+
+    # PerformanceManager
+
+    def query_perf(self, specs):
+        self._round_trip("soap")
+        results = []
+        for spec in specs:
+            index = int(spec.entity._moId.split("-", 1)[1]) - 1
+            end = datetime.datetime.now(datetime.timezone.utc).replace(microsecond=0)
+            samples = spec.maxSample or 1
+            results.append(SimpleNamespace(
+                entity=SimpleNamespace(_moId=spec.entity._moId),
+                sampleInfo=[SimpleNamespace(timestamp=end - datetime.timedelta(seconds=20 * (samples - 1 - offset)), interval=20)
+                            for offset in range(samples)],
+                value=[SimpleNamespace(id=SimpleNamespace(counterId=metric.counterId, instance=""),
+                                       value=[(index * 37 + metric.counterId * 11 + offset) % 10000 for offset in range(samples)])
+                       for metric in spec.metricId],
+            ))
+        with self._lock:
+            self.bytes += 64 * sum(len(spec.metricId) * (spec.maxSample or 1) for spec in specs)
+        return results
+
+    # vSphere Automation REST
+
+    def rest_session(self):
+        """
+        Builds a requests-like session answering the tagging endpoints used by tagging.TagCache.
+
+        :return: Object with get() and post() returning JSON responses
+        """
+        return _FakeRestSession(self)
+
+    def _respond(self, data):
+        body = json.dumps(data).encode("utf-8")
+        self._round_trip("rest", body)
+        return _FakeResponse(body)
+
+    def list_attached(self, body):
+        return self._respond([
+            {"object_id": object_id, "tag_ids": self._tag_ids(int(object_id["id"].split("-", 1)[1]) - 1)}
+            for object_id in body["object_ids"]
+        ])
+
+    def get_object(self, kind, object_id):
+        if kind == "tag":
+            index = int(object_id.split(":")[3])
+            return self._respond({"id": object_id, "name": f"tag-{index}",
+                                  "category_id": f"urn:vmomi:InventoryServiceCategory:{index // TAGS_PER_CATEGORY}:GLOBAL"})
+        return self._respond({"id": object_id, "name": f"category-{object_id.split(':')[3]}"})
+
+
+class _FakePerfManager:
+    def __init__(self, vcenter):
+        self.vcenter = vcenter
+
+    @property
+    def perfCounter(self):
+        self.vcenter._round_trip("soap")
+        return [SimpleNamespace(key=key, groupInfo=SimpleNamespace(key=group), nameInfo=SimpleNamespace(key=name), rollupType=rollup)
+                for key, (group, name, rollup) in enumerate(PERF_COUNTERS, start=1)]
+
+    def QueryPerf(self, querySpec):
+        return self.vcenter.query_perf(querySpec)
+
+
+class _NullStub:
+    def InvokeMethod(self, mo, info, args):
+        return None
+
+
+class _FakeResponse:
+    status_code = 200
+
+    def __init__(self, body):
+        self._body = body
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return json.loads(self._body)
+
+
+class _FakeRestSession:
+    def __init__(self, vcenter):
+        self.vcenter = vcenter
+        self.headers = {}
+
+    def post(self, url, json=None, timeout=None):
+        return self.vcenter.list_attached(json)
+
+    def get(self, url, timeout=None):
+        kind, object_id = url.split("/api/cis/tagging/", 1)[1].split("/", 1)
+        return self.vcenter.get_object(kind, object_id)
+
+    def close(self):
+        pass
@@ -0,0 +1,123 @@
+import json
+import threading
+import time
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Approximate size of one synthetic controller entry in all.json
+ENTRY_BYTES = 320
+
+
+def build_all_json(size_bytes, timestamp=None):
+    """
+    Builds a synthetic vSAN HCL all.json of roughly the requested size.
+
+    The header fields come first, as in the published file, followed by a large controller list.
+
+    :param size_bytes: Approximate document size in bytes
+    :param timestamp: Value of the timestamp / jsonUpdatedTime header fields (defaults to now)
+    :return: Document as bytes
+    """
+    timestamp = timestamp or int(time.time())
+    controllers = [
+        {
+            "vid": f"{0x1000 + index % 64:04x}", "did": f"{index % 4096:04x}",
+            "svid": f"{0x1000 + index % 128:04x}", "ssid": f"{index % 65536:04x}",
+            "model": f"Bench RAID Controller {index}", "vendor": f"Vendor {index % 64}",
+            "releases": [{"release": "ESXi 8.0 U2", "firmware": f"{index % 50}.0.{index % 7}",
+                          "driver": "lsi_mr3", "driverVersion": f"7.{index % 30}.0.1"}],
+        }
+        for index in range(max(1, size_bytes // ENTRY_BYTES))
+    ]
+    document = {"timestamp": timestamp, "jsonUpdatedTime": timestamp, "data": {"controller": controllers}}
+    return json.dumps(document).encode("utf-8")
+
+
+class HclServer:
+    """
+    Local HTTP server standing in for partnerweb.vmware.com.
+
+    It serves one synthetic all.json with an ETag and Last-Modified, answers conditional GETs with 304,
+    and counts requests and body bytes sent. Use it as a context manager.
+    """
+
+    def __init__(self, latency=0.0):
+        """
+        :param latency: Seconds slept before answering each request
+        """
+        self.latency = latency
+        self.requests = 0
+        self.bytes = 0
+        self._body = b""
+        self._etag = None
+        self._last_modified = None
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/service/vsan/all.json"
+
+    def set_payload(self, body):
+        """
+        Replaces the served document, giving it a new ETag.
+
+        :param body: Document bytes
+        """
+        with self._lock:
+            self._body = body
+            self._etag = f'"{len(body):x}-{time.monotonic_ns():x}"'
+            self._last_modified = formatdate(usegmt=True)
+
+    def reset_counters(self):
+        with self._lock:
+            self.requests = 0
+            self.bytes = 0
+
+    def start(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if server.latency:
+                    time.sleep(server.latency)
+                with server._lock:
+                    body, etag, last_modified = server._body, server._etag, server._last_modified
+                    not_modified = self.headers.get("If-None-Match") == etag
+                    server.requests += 1
+                    server.bytes += 0 if not_modified else len(body)
+                if not_modified:
+                    self.send_response(304)
+                    self.send_header("ETag", etag)
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.send_header("ETag", etag)
+                self.send_header("Last-Modified", last_modified)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+        return False
@@ -0,0 +1,114 @@
+import base64
+import binascii
+import gzip
+import threading
+import time
+import xml.etree.ElementTree as ElementTree
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+SOAP_NS = "http://schemas.xmlsoap.org/soap/envelope/"
+VIM_NS = "urn:vim25"
+RESPONSE = ('<?xml version="1.0" encoding="UTF-8"?>\n'
+            f'<soapenv:Envelope xmlns:soapenv="{SOAP_NS}"><soapenv:Body>'
+            f'<{{method}}Response xmlns="{VIM_NS}"><returnval>{{value}}</returnval></{{method}}Response>'
+            '</soapenv:Body></soapenv:Envelope>')
+
+
+def decode_db(payload):
+    """
+    Decodes a VsanVcUploadHclDb db argument (base64 of the gzip-compressed database).
+
+    :param payload: db argument as received
+    :return: Database bytes, or None if the payload is not base64-encoded gzip
+    """
+    try:
+        return gzip.decompress(base64.b64decode(payload, validate=True))
+    except (binascii.Error, OSError, EOFError):
+        return None
+
+
+class VsanServer:
+    """
+    Local SOAP endpoint standing in for the vSAN management service of a vCenter (/vsanHealth).
+
+    It answers VsanVcUploadHclDb with the configured result, records the uploaded database (decoded from
+    base64 and gzip, None when the payload is not encoded that way) and the session cookie it was sent with,
+    and counts requests and body bytes received. Use it as a context manager.
+    """
+
+    def __init__(self, accept=True, latency=0.0):
+        """
+        :param accept: Value returned by VsanVcUploadHclDb
+        :param latency: Seconds slept before answering each request
+        """
+        self.accept = accept
+        self.latency = latency
+        self.requests = 0
+        self.bytes = 0
+        self.calls = []
+        self.db = None
+        self.cookie = None
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+
+    @property
+    def port(self):
+        return self._server.server_address[1]
+
+    def reset_counters(self):
+        with self._lock:
+            self.requests = 0
+            self.bytes = 0
+            self.calls = []
+            self.db = None
+            self.cookie = None
+
+    def start(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                if server.latency:
+                    time.sleep(server.latency)
+                call = next(iter(ElementTree.fromstring(body).find(f"{{{SOAP_NS}}}Body")))
+                method = call.tag.split("}")[-1]
+                with server._lock:
+                    server.requests += 1
+                    server.bytes += len(body)
+                    server.calls.append(method)
+                    server.cookie = self.headers.get("Cookie")
+                    if method == "VsanVcUploadHclDb":
+                        server.db = decode_db(call.findtext(f"{{{VIM_NS}}}db") or "")
+                if method != "VsanVcUploadHclDb":
+                    self.send_response(500)
+                    self.end_headers()
+                    return
+                answer = RESPONSE.format(method=method, value=str(server.accept).lower()).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/xml; charset=utf-8")
+                self.send_header("Content-Length", str(len(answer)))
+                self.end_headers()
+                self.wfile.write(answer)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+        return False
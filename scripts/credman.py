@@ -0,0 +1,156 @@
+import json
+import os
+import threading
+from dataclasses import dataclass, field
+
+# Configuration Parameters
+CRED_PATH = "~/.pgvm/"  # Base directory holding the profiles
+CRED_FILE = "cred.json"  # Credentials file name inside each profile directory
+
+# Where each template schema keeps the vCenter details, in lookup order
+VCENTER_SECTIONS = (("vcenter",), ("lab", "vcenter"))
+# Scripts whose own template uses another schema look there first
+SCRIPT_SECTIONS = {"hclupdate": (("lab", "vcenter"), ("vcenter",))}
+VCENTER_FIELDS = ("vcenter_server", "vcenter_user", "vcenter_password")
+
+_cache = {}
+_cache_lock = threading.Lock()
+
+
+class CredentialError(ValueError):
+    """Raised when a profile's cred.json is missing, unreadable or incomplete."""
+
+
+@dataclass(frozen=True)
+class Credentials:
+    """Normalized credentials for one profile, whichever template schema the cred.json follows."""
+    profile: str
+    path: str
+    vcenter_server: str
+    vcenter_user: str
+    vcenter_password: str = field(repr=False)
+    esxi_hosts: tuple = ()
+
+
+def profile_dir(profile):
+    """
+    Returns the directory of a profile under ~/.pgvm/.
+
+    :param profile: Profile name ("" for the default profile)
+    :return: Expanded directory path
+    """
+    return os.path.expanduser(f"{CRED_PATH}{profile}/" if profile else CRED_PATH)
+
+
+def cred_file_path(profile):
+    """
+    Returns the path of a profile's cred.json.
+
+    :param profile: Profile name ("" for the default ~/.pgvm/cred.json)
+    :return: Expanded file path
+    """
+    return os.path.join(profile_dir(profile), CRED_FILE)
+
+
+def list_profiles():
+    """
+    Lists every profile under ~/.pgvm/ that has a cred.json.
+
+    :return: Sorted list of profile names ("" for the default ~/.pgvm/cred.json)
+    """
+    base_dir = profile_dir("")
+    if not os.path.isdir(base_dir):
+        return []
+    profiles = [entry for entry in os.listdir(base_dir)
+                if os.path.isfile(os.path.join(base_dir, entry, CRED_FILE))]
+    if os.path.isfile(os.path.join(base_dir, CRED_FILE)):
+        profiles.append("")
+    return sorted(profiles)
+
+
+def _section(data, keys):
+    for key in keys:
+        if not isinstance(data, dict):
+            return None
+        # Template keys differ in case between scripts (VCENTER_SERVER vs vcenter_server)
+        data = {k.lower(): v for k, v in data.items()}.get(key)
+    return data if isinstance(data, dict) else None
+
+
+def normalize(data, profile, path, script_name=None):
+    """
+    Converts a loaded cred.json of any known template schema into Credentials.
+
+    Sections are tried in the script's lookup order and the first one with every required field filled in
+    wins, so an untouched template section (empty placeholders) does not hide a completed one.
+
+    :param data: Parsed cred.json contents
+    :param profile: Profile name
+    :param path: Path the data was loaded from
+    :param script_name: Script asking for the credentials, used for its lookup order and in error messages
+    :return: Credentials
+    :raises CredentialError: If a required field is missing or empty, or esxi_hosts is not a list
+    """
+    sections = [{k.lower(): v for k, v in section.items()}
+                for section in (_section(data, keys) for keys in SCRIPT_SECTIONS.get(script_name, VCENTER_SECTIONS))
+                if section]
+    # Without a complete section, the missing fields of the first one found are reported
+    vcenter = next((section for section in sections if all(section.get(name) for name in VCENTER_FIELDS)),
+                   sections[0] if sections else {})
+    esxi = _section(data, ("esxi",)) or {}
+    esxi = {k.lower(): v for k, v in esxi.items()}
+
+    values = {name: vcenter.get(name) for name in VCENTER_FIELDS}
+    missing = [name for name, value in values.items() if not value]
+    if missing:
+        hint = f" Run setcred.py with scripts/{script_name}/{script_name}-cred.json to fill them in." if script_name else ""
+        raise CredentialError(f"Credentials in {path} are missing {', '.join(missing)}.{hint}")
+    esxi_hosts = esxi.get("esxi_hosts") or []
+    # A single host is often written as a plain string
+    if isinstance(esxi_hosts, str):
+        esxi_hosts = [esxi_hosts]
+    if not isinstance(esxi_hosts, list):
+        raise CredentialError(f"esxi_hosts in {path} must be a list of host names.")
+    return Credentials(profile=profile, path=path, esxi_hosts=tuple(esxi_hosts), **values)
+
+
+def get_creds(profile, script_name=None):
+    """
+    Resolves a profile's credentials, parsing its cred.json at most once per process.
+
+    The parsed result is memoized per file and lookup order and reused until the file's modification time changes.
+
+    :param profile: Profile name ("" for the default ~/.pgvm/cred.json)
+    :param script_name: Script asking for the credentials, used in error messages
+    :return: Credentials
+    :raises CredentialError: If the file is missing, not valid JSON, or incomplete
+    """
+    path = cred_file_path(profile)
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except OSError:
+        raise CredentialError(f"Credentials file does not exist for the profile '{profile}'. Expected at: {path}")
+
+    # Scripts with their own lookup order may resolve the same file differently
+    key = (path, SCRIPT_SECTIONS.get(script_name, VCENTER_SECTIONS))
+    with _cache_lock:
+        cached = _cache.get(key)
+        if cached and cached[0] == mtime:
+            return cached[1]
+
+    try:
+        with open(path, "r") as cred_file:
+            data = json.load(cred_file)
+    except (OSError, ValueError) as e:
+        raise CredentialError(f"Error loading credentials from {path}: {e}")
+    creds = normalize(data, profile, path, script_name)
+
+    with _cache_lock:
+        _cache[key] = (mtime, creds)
+    return creds
+
+
+def clear_cache():
+    """Forgets every memoized profile."""
+    with _cache_lock:
+        _cache.clear()
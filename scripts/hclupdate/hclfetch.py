@@ -0,0 +1,318 @@
+import os
+import re
+import json
+import time
+import codecs
+from scripts import timings
+
+## Parameters for the HCL download cache
+cache_dir_default = "json/cache"
+cache_body_file = "all.json"
+cache_meta_file = "all.meta.json"
+connect_timeout = 10
+read_timeout = 120
+retry_total = 3
+retry_backoff = 2
+chunk_size = 64 * 1024
+scan_limit_default = 4 * 1024 * 1024
+
+_session = None
+
+
+def get_session():
+    """
+    Return the pooled requests session used for HCL downloads, creating it on first use.
+
+    The session retries connection errors and 429/5xx responses with exponential backoff
+    and asks for gzip-compressed responses.
+
+    :return: requests.Session
+    """
+    global _session
+    if _session is None:
+        import requests
+        from requests.adapters import HTTPAdapter
+        from urllib3.util.retry import Retry
+
+        retry = Retry (
+            total=retry_total,
+            backoff_factor=retry_backoff,
+            status_forcelist=[ 429, 500, 502, 503, 504 ],
+            allowed_methods=[ "GET", "HEAD" ]
+        )
+        _session = timings.instrument_session ( requests.Session (), "http" )
+        _session.mount ( "https://", HTTPAdapter ( max_retries=retry ) )
+        _session.mount ( "http://", HTTPAdapter ( max_retries=retry ) )
+        _session.headers [ "Accept-Encoding" ] = "gzip, deflate"
+    return _session
+
+
+def load_meta(cache_dir):
+    """
+    Load the cached validators (ETag / Last-Modified) for the HCL download.
+
+    :param cache_dir: Directory holding the cached body and metadata.
+    :return: Metadata dictionary, empty if nothing is cached.
+    """
+    meta_path = os.path.join ( cache_dir, cache_meta_file )
+    body_path = os.path.join ( cache_dir, cache_body_file )
+    if not ( os.path.exists ( meta_path ) and os.path.exists ( body_path ) ):
+        return { }
+    try:
+        with open ( meta_path, 'r' ) as meta_file:
+            return json.load ( meta_file )
+    except (OSError, ValueError):
+        return { }
+
+
+def _save_body(response, cache_dir):
+    """
+    Stream a response body into the cache, replacing the previous copy atomically.
+
+    :return: Number of bytes written.
+    """
+    os.makedirs ( cache_dir, exist_ok=True )
+    body_path = os.path.join ( cache_dir, cache_body_file )
+    tmp_path = f"{body_path}.tmp"
+    written = 0
+    with open ( tmp_path, 'wb' ) as body_file:
+        for chunk in response.iter_content ( chunk_size=chunk_size ):
+            body_file.write ( chunk )
+            written += len ( chunk )
+    os.replace ( tmp_path, body_path )
+    return written
+
+
+def _save_meta(response, url, cache_dir):
+    meta = {
+        "url": url,
+        "etag": response.headers.get ( "ETag" ),
+        "last_modified": response.headers.get ( "Last-Modified" ),
+        "fetched": time.time ()
+    }
+    meta_path = os.path.join ( cache_dir, cache_meta_file )
+    with open ( f"{meta_path}.tmp", 'w' ) as meta_file:
+        json.dump ( meta, meta_file, indent=4 )
+    os.replace ( f"{meta_path}.tmp", meta_path )
+
+
+@timings.timed ( "fetch" )
+def fetch_cached(url, cache_dir=cache_dir_default):
+    """
+    Download a URL into the local cache using a conditional GET.
+
+    The cached ETag / Last-Modified values are sent as If-None-Match / If-Modified-Since.
+    On a 304 the cached body is kept, so an unchanged HCL costs a single small round trip.
+
+    :param url: URL of the JSON data.
+    :param cache_dir: Directory holding the cached body and metadata.
+    :return: Tuple of (path to the cached body, metrics dictionary with cache_hit, status, bytes and seconds).
+    :raises requests.exceptions.RequestException: If the download fails.
+    """
+    start = time.monotonic ()
+    meta = load_meta ( cache_dir )
+    headers = { }
+    if meta.get ( "url" ) == url:
+        if meta.get ( "etag" ):
+            headers [ "If-None-Match" ] = meta [ "etag" ]
+        if meta.get ( "last_modified" ):
+            headers [ "If-Modified-Since" ] = meta [ "last_modified" ]
+
+    with get_session ().get ( url, headers=headers, stream=True, timeout=( connect_timeout, read_timeout ) ) as response:
+        if response.status_code == 304:
+            written = 0
+        else:
+            response.raise_for_status ()
+            written = _save_body ( response, cache_dir )
+            _save_meta ( response, url, cache_dir )
+
+    metrics = {
+        "cache_hit": response.status_code == 304,
+        "status": response.status_code,
+        "bytes": written,
+        "seconds": round ( time.monotonic () - start, 3 )
+    }
+    return os.path.join ( cache_dir, cache_body_file ), metrics
+
+
+_WHITESPACE = " \t\r\n"
+_NESTED_TOKEN = re.compile ( r'[{}\[\]"]' )
+_STRING_END = re.compile ( r'(?:[^"\\]|\\.)*"', re.DOTALL )
+_SCALAR_END = re.compile ( r'[\s,}\]]' )
+
+
+class _NeedMore ( Exception ):
+    pass
+
+
+class HeaderScanner:
+    """
+    Incrementally scan a JSON document for a few top-level scalar keys.
+
+    Nested objects and arrays are skipped token by token without being decoded,
+    so memory stays flat no matter how large the controller/device lists are.
+    Feed chunks until `done` is True.
+    """
+
+    def __init__(self, keys):
+        self.keys = set ( keys )
+        self.found = { }
+        self.done = False
+        self._decoder = codecs.getincrementaldecoder ( "utf-8" ) ()
+        self._json = json.JSONDecoder ()
+        self._buf = ""
+        self._pos = 0
+        self._state = "start"
+        self._key = None
+        self._depth = 0
+        self.scanned = 0
+
+    def feed(self, chunk):
+        """
+        Feed the next chunk of bytes.
+
+        :param chunk: Bytes of the document.
+        :return: True once every key has been found or the top-level object has ended.
+        """
+        self.scanned += len ( chunk )
+        self._buf = self._buf [ self._pos: ] + self._decoder.decode ( chunk )
+        self._pos = 0
+        try:
+            while not self.done:
+                self._step ()
+        except _NeedMore:
+            pass
+        return self.done
+
+    def _skip_ws(self):
+        buf = self._buf
+        while self._pos < len ( buf ) and buf [ self._pos ] in _WHITESPACE:
+            self._pos += 1
+        if self._pos >= len ( buf ):
+            raise _NeedMore ()
+        return buf [ self._pos ]
+
+    def _step(self):
+        if self._state == "nested":
+            self._skip_nested ()
+            return
+
+        char = self._skip_ws ()
+        if self._state == "start":
+            if char != "{":
+                raise ValueError ( "Document is not a JSON object." )
+            self._pos += 1
+            self._state = "key"
+        elif self._state == "key":
+            if char == "}":
+                self.done = True
+            elif char == ",":
+                self._pos += 1
+            elif char == '"':
+                match = _STRING_END.match ( self._buf, self._pos + 1 )
+                if not match:
+                    raise _NeedMore ()
+                self._key = json.loads ( self._buf [ self._pos:match.end () ] )
+                self._pos = match.end ()
+                self._state = "colon"
+            else:
+                raise ValueError ( f"Unexpected character {char!r} while reading a key." )
+        elif self._state == "colon":
+            if char != ":":
+                raise ValueError ( f"Unexpected character {char!r} after key {self._key!r}." )
+            self._pos += 1
+            self._state = "value"
+        elif self._state == "value":
+            if char in "{[":
+                self._pos += 1
+                self._depth = 1
+                self._state = "nested"
+                return
+            if char == '"':
+                match = _STRING_END.match ( self._buf, self._pos + 1 )
+                if not match:
+                    raise _NeedMore ()
+                end = match.end ()
+            else:
+                match = _SCALAR_END.search ( self._buf, self._pos )
+                if not match:
+                    raise _NeedMore ()
+                end = match.start ()
+            value, _ = self._json.raw_decode ( self._buf [ self._pos:end ] )
+            if self._key in self.keys:
+                self.found [ self._key ] = value
+                if len ( self.found ) == len ( self.keys ):
+                    self.done = True
+            self._pos = end
+            self._state = "key"
+
+    def _skip_nested(self):
+        buf = self._buf
+        while self._depth:
+            match = _NESTED_TOKEN.search ( buf, self._pos )
+            if not match:
+                self._pos = len ( buf )
+                raise _NeedMore ()
+            token = match.group ()
+            if token == '"':
+                end = _STRING_END.match ( buf, match.end () )
+                if not end:
+                    # Resume from the opening quote once more data arrives
+                    self._pos = match.start ()
+                    raise _NeedMore ()
+                self._pos = end.end ()
+            else:
+                self._depth += 1 if token in "{[" else -1
+                self._pos = match.end ()
+        self._state = "key"
+
+
+def extract_fields(chunks, keys, scan_limit=scan_limit_default):
+    """
+    Read top-level scalar fields from a JSON document delivered as byte chunks.
+
+    Scanning stops as soon as every key has been seen, so the rest of the stream is never read.
+
+    :param chunks: Iterable of bytes (e.g. response.iter_content() or a file read in blocks).
+    :param keys: Top-level keys to extract.
+    :param scan_limit: Stop scanning after this many bytes.
+    :return: Dictionary of the keys found, or None if they were not all found within the scan limit.
+    """
+    scanner = HeaderScanner ( keys )
+    for chunk in chunks:
+        if scanner.feed ( chunk ) or scanner.scanned >= scan_limit:
+            break
+    if len ( scanner.found ) == len ( scanner.keys ):
+        return scanner.found
+    return None
+
+
+def _read_chunks(path):
+    with open ( path, 'rb' ) as body_file:
+        while True:
+            chunk = body_file.read ( chunk_size )
+            if not chunk:
+                return
+            yield chunk
+
+
+def extract_fields_from_file(path, keys, scan_limit=scan_limit_default):
+    """
+    Read top-level scalar fields from a JSON file without loading the whole document.
+
+    Falls back to a full parse when the keys are not found near the start of the file.
+
+    :param path: Path to the JSON file.
+    :param keys: Top-level keys to extract.
+    :param scan_limit: Bytes scanned before falling back to a full parse.
+    :return: Dictionary mapping each key to its value (None if missing).
+    """
+    try:
+        found = extract_fields ( _read_chunks ( path ), keys, scan_limit )
+    except ValueError:
+        found = None
+    if found is not None:
+        return found
+    with open ( path, 'r' ) as body_file:
+        data = json.load ( body_file )
+    return { key: data.get ( key ) for key in keys }
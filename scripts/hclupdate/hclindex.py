@@ -0,0 +1,360 @@
+import os
+import json
+import mmap
+import struct
+import hashlib
+from scripts import timings
+from scripts.hclupdate import hclfetch
+
+## Parameters for the HCL index
+index_file = "all.idx"
+index_magic = b"HCLIDX02"
+# magic, header JSON length, PCI table rows, model table rows
+_HEADER = struct.Struct ( "<8sIII" )
+# Both tables hold sorted 8-byte keys pointing at an entry in the blob: key, offset, length
+_ROW = struct.Struct ( "<QII" )
+# Keys holding each field of a (release, firmware, driver, driver version) combination
+combination_keys = (
+    ( "release", "releaseName", "esxiRelease" ),
+    ( "firmware", "firmwareVersion" ),
+    ( "driver", "driverName" ),
+    ( "driverVersion", )
+)
+combination_labels = ( "release", "firmware", "driver", "driver version" )
+
+
+def pci_key(entry):
+    """
+    Pack an entry's vid/did/svid/ssid into one sortable integer.
+
+    :param entry: HCL entry dictionary.
+    :return: Integer key, or None if the entry has no complete, valid set of PCI IDs.
+    """
+    key = 0
+    for field in ( "vid", "did", "svid", "ssid" ):
+        value = str ( entry.get ( field ) or "" ).strip ().lower ()
+        value = value [ 2: ] if value.startswith ( "0x" ) else value
+        try:
+            number = int ( value, 16 )
+        except ValueError:
+            return None
+        if not 0 <= number <= 0xffff:
+            return None
+        key = key << 16 | number
+    return key
+
+
+def format_pci_key(key):
+    return ":".join ( f"{key >> shift & 0xffff:04x}" for shift in ( 48, 32, 16, 0 ) )
+
+
+def model_key(model):
+    """
+    Hash a device model name (case and surrounding whitespace ignored) to a sortable integer.
+
+    :param model: Model name.
+    :return: Integer key, or None if there is no model.
+    """
+    model = str ( model or "" ).strip ().casefold ()
+    if not model:
+        return None
+    return int.from_bytes ( hashlib.blake2b ( model.encode ( "utf-8" ), digest_size=8 ).digest (), "big" )
+
+
+def _combination_field(key):
+    for field, keys in enumerate ( combination_keys ):
+        if key in keys:
+            return field
+    return None
+
+
+def combinations(node, context=( None, None, None, None )):
+    """
+    Collect the (release, firmware, driver, driverVersion) combinations listed under an HCL entry.
+
+    Fields are read from release/firmware/driver keys at any depth and inherited by the objects below
+    them; a "releases" object contributes its keys as releases and a "drivers" object its keys as driver
+    names and the keys below them as driver versions. Only the most specific combinations are kept, and
+    fields an entry does not list are None.
+
+    :param node: HCL entry dictionary (or any object below one).
+    :param context: Combination inherited from the enclosing objects.
+    :return: List of 4-tuples.
+    """
+    if isinstance ( node, list ):
+        return [ combination for item in node for combination in combinations ( item, context ) ]
+    if not isinstance ( node, dict ):
+        return [ ]
+    context = list ( context )
+    own = False
+    for key, value in node.items ():
+        field = _combination_field ( key )
+        if field is not None and isinstance ( value, ( str, int, float ) ) and not isinstance ( value, bool ):
+            context [ field ] = str ( value )
+            own = True
+    context = tuple ( context )
+
+    found = [ ]
+    for key, value in node.items ():
+        if key == "releases" and isinstance ( value, dict ):
+            for release, detail in value.items ():
+                released = ( release, ) + context [ 1: ]
+                found += combinations ( detail, released ) or [ released ]
+        elif key == "drivers" and isinstance ( value, dict ):
+            for name, by_version in value.items ():
+                named = context [ :2 ] + ( name, context [ 3 ] )
+                if isinstance ( by_version, dict ) and by_version:
+                    for version, detail in by_version.items ():
+                        found += combinations ( detail, named [ :3 ] + ( version, ) ) or [ named [ :3 ] + ( version, ) ]
+                else:
+                    found.append ( named )
+        elif isinstance ( value, ( dict, list ) ):
+            found += combinations ( value, context )
+    if not found and own:
+        return [ context ]
+    return found
+
+
+def covers(official, custom):
+    """
+    :param official: Combination of an official release.
+    :param custom: Combination of a custom entry.
+    :return: True if the official combination has every field the custom one lists, with the same value.
+    """
+    return all ( value is None or value == known for value, known in zip ( custom, official ) )
+
+
+def format_combination(combination):
+    return ", ".join ( f"{label} {value}" for label, value in zip ( combination_labels, combination ) if value is not None )
+
+
+def iter_entries(document):
+    """
+    Yield every device entry of an HCL document with its category (e.g. "controller", "ssd").
+
+    :param document: Parsed all.json or customhcl.json.
+    :return: Generator of (category, entry dictionary) tuples.
+    """
+    data = document.get ( "data" )
+    for category, entries in ( data.items () if isinstance ( data, dict ) else [ ] ):
+        if isinstance ( entries, list ):
+            for entry in entries:
+                if isinstance ( entry, dict ):
+                    yield category, entry
+
+
+def summarize(category, entry):
+    """
+    Reduce an HCL entry to the fields the index keeps.
+    """
+    summary = { "category": category }
+    for field in ( "vendor", "model", "vid", "did", "svid", "ssid" ):
+        if entry.get ( field ) is not None:
+            summary [ field ] = entry [ field ]
+    summary [ "combinations" ] = sorted ( set ( combinations ( entry ) ), key=lambda combination: [ value or "" for value in combination ] )
+    return summary
+
+
+@timings.timed ( "index" )
+def build_index(all_json_path, index_path):
+    """
+    Build the on-disk index of a cached all.json.
+
+    The file holds a JSON header (jsonUpdatedTime, timestamp, entry count), two sorted tables of
+    fixed-size rows keyed by packed vid/did/svid/ssid and by model hash, and a blob with a compact JSON
+    summary of each entry. It is written to a temporary file and renamed into place.
+
+    :param all_json_path: Path to the cached all.json.
+    :param index_path: Path of the index to write.
+    :return: Header dictionary of the new index.
+    """
+    with open ( all_json_path, 'r', encoding="utf-8" ) as all_json_file:
+        document = json.load ( all_json_file )
+
+    blob = bytearray ()
+    pci_rows = [ ]
+    model_rows = [ ]
+    entries = 0
+    for category, entry in iter_entries ( document ):
+        entries += 1
+        encoded = json.dumps ( summarize ( category, entry ), separators=( ",", ":" ) ).encode ( "utf-8" )
+        offset = len ( blob )
+        blob += encoded
+        key = pci_key ( entry )
+        if key is not None:
+            pci_rows.append ( ( key, offset, len ( encoded ) ) )
+        key = model_key ( entry.get ( "model" ) )
+        if key is not None:
+            model_rows.append ( ( key, offset, len ( encoded ) ) )
+    pci_rows.sort ()
+    model_rows.sort ()
+
+    header = {
+        "jsonUpdatedTime": document.get ( "jsonUpdatedTime" ),
+        "timestamp": document.get ( "timestamp" ),
+        "entries": entries,
+        "pci": len ( pci_rows ),
+        "models": len ( model_rows )
+    }
+    header_bytes = json.dumps ( header ).encode ( "utf-8" )
+    tmp_path = f"{index_path}.tmp"
+    with open ( tmp_path, 'wb' ) as index_output:
+        index_output.write ( _HEADER.pack ( index_magic, len ( header_bytes ), len ( pci_rows ), len ( model_rows ) ) )
+        index_output.write ( header_bytes )
+        for row in pci_rows + model_rows:
+            index_output.write ( _ROW.pack ( *row ) )
+        index_output.write ( blob )
+    os.replace ( tmp_path, index_path )
+    return header
+
+
+class HclIndex:
+    """
+    Read-only, memory-mapped view of an index written by build_index.
+
+    Lookups binary-search the fixed-size key tables in place and decode only the matching entries,
+    so opening the index and checking a custom HCL costs milliseconds regardless of the HCL size.
+    """
+
+    def __init__(self, index_path):
+        self.path = index_path
+        with open ( index_path, 'rb' ) as index_input:
+            self._map = mmap.mmap ( index_input.fileno (), 0, access=mmap.ACCESS_READ )
+        magic, header_length, pci_count, model_count = _HEADER.unpack_from ( self._map, 0 )
+        if magic != index_magic:
+            self._map.close ()
+            raise ValueError ( f"{index_path} is not an HCL index." )
+        start = _HEADER.size
+        self.header = json.loads ( self._map [ start:start + header_length ] )
+        self._pci = ( start + header_length, pci_count )
+        self._models = ( self._pci [ 0 ] + pci_count * _ROW.size, model_count )
+        self._blob = self._models [ 0 ] + model_count * _ROW.size
+
+    def close(self):
+        self._map.close ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close ()
+
+    def _lookup(self, table, key):
+        base, count = table
+        low, high = 0, count
+        while low < high:
+            middle = ( low + high ) // 2
+            if _ROW.unpack_from ( self._map, base + middle * _ROW.size ) [ 0 ] < key:
+                low = middle + 1
+            else:
+                high = middle
+        entries = [ ]
+        while low < count:
+            row_key, offset, length = _ROW.unpack_from ( self._map, base + low * _ROW.size )
+            if row_key != key:
+                break
+            start = self._blob + offset
+            entries.append ( json.loads ( self._map [ start:start + length ] ) )
+            low += 1
+        return entries
+
+    def by_pci(self, entry):
+        """
+        :param entry: Entry with vid/did/svid/ssid.
+        :return: List of official entries with the same PCI IDs.
+        """
+        key = pci_key ( entry )
+        return self._lookup ( self._pci, key ) if key is not None else [ ]
+
+    def by_model(self, model):
+        """
+        :param model: Device model name.
+        :return: List of official entries with that model (case-insensitive).
+        """
+        key = model_key ( model )
+        if key is None:
+            return [ ]
+        wanted = str ( model ).strip ().casefold ()
+        # The hash may collide, so confirm the name
+        return [ entry for entry in self._lookup ( self._models, key )
+                 if str ( entry.get ( "model" ) or "" ).strip ().casefold () == wanted ]
+
+
+def index_json_updated_time(index_path):
+    """
+    Read the jsonUpdatedTime recorded in an index without mapping the tables.
+
+    :return: The recorded value, or None if the index is missing or unreadable.
+    """
+    try:
+        with open ( index_path, 'rb' ) as index_input:
+            magic, header_length, _, _ = _HEADER.unpack ( index_input.read ( _HEADER.size ) )
+            if magic != index_magic:
+                return None
+            return json.loads ( index_input.read ( header_length ) ).get ( "jsonUpdatedTime" )
+    except (OSError, ValueError, struct.error):
+        return None
+
+
+def open_index(cache_dir=hclfetch.cache_dir_default, rebuild=False):
+    """
+    Open the index of the cached all.json, rebuilding it only when its jsonUpdatedTime changed.
+
+    :param cache_dir: Directory holding the cached all.json.
+    :param rebuild: Rebuild even if the index looks current.
+    :return: Tuple of (HclIndex, True if the index was rebuilt).
+    :raises FileNotFoundError: If there is no cached all.json.
+    """
+    all_json_path = os.path.join ( cache_dir, hclfetch.cache_body_file )
+    index_path = os.path.join ( cache_dir, index_file )
+    if not os.path.exists ( all_json_path ):
+        raise FileNotFoundError ( f"No cached HCL at {all_json_path}." )
+    current = hclfetch.extract_fields_from_file ( all_json_path, [ "jsonUpdatedTime" ] ).get ( "jsonUpdatedTime" )
+    rebuilt = rebuild or current is None or index_json_updated_time ( index_path ) != current
+    if rebuilt:
+        build_index ( all_json_path, index_path )
+    return HclIndex ( index_path ), rebuilt
+
+
+def check_entries(document, index):
+    """
+    Validate every entry of a custom HCL against the official index.
+
+    An entry is "unknown" when no official entry has its PCI IDs (or, without PCI IDs, its model),
+    "duplicate" when the same category and PCI IDs/model appear earlier in the file, and "mismatch"
+    when one of its (release, firmware, driver, driver version) combinations is not listed together by a
+    single official release of the matching entries.
+
+    :param document: Parsed customhcl.json.
+    :param index: HclIndex of the official HCL.
+    :return: Tuple of (number of entries checked, list of finding dictionaries).
+    """
+    findings = [ ]
+    seen = { }
+    checked = 0
+    for position, ( category, entry ) in enumerate ( iter_entries ( document ) ):
+        checked += 1
+        key = pci_key ( entry )
+        label = format_pci_key ( key ) if key is not None else str ( entry.get ( "model" ) or "" ).strip ()
+        finding = { "category": category, "index": position, "key": label or "-", "model": entry.get ( "model" ) }
+
+        identity = ( category, key if key is not None else label.casefold () )
+        if identity in seen:
+            findings.append ( dict ( finding, status="duplicate", detail=f"Same as entry {seen [ identity ]}." ) )
+            continue
+        seen [ identity ] = position
+
+        official = index.by_pci ( entry ) if key is not None else index.by_model ( entry.get ( "model" ) )
+        if not official:
+            detail = "No official entry with these PCI IDs." if key is not None else "No official entry with this model."
+            findings.append ( dict ( finding, status="unknown", detail=detail ) )
+            continue
+
+        known = [ tuple ( combination ) for match in official for combination in match [ "combinations" ] ]
+        unlisted = sorted ( { combination for combination in combinations ( entry )
+                              if not any ( covers ( official_combination, combination ) for official_combination in known ) },
+                            key=lambda combination: [ value or "" for value in combination ] )
+        if unlisted:
+            detail = "; ".join ( format_combination ( combination ) for combination in unlisted )
+            findings.append ( dict ( finding, status="mismatch", detail=f"No official release lists {detail}." ) )
+    return checked, findings
@@ -1,17 +1,32 @@
 import os
+import sys
 import json
+import time
 import shutil
+import hashlib
 import argparse
-import requests
 import subprocess
+from concurrent.futures import ThreadPoolExecutor
 from colorama import Fore, Style
+from scripts import credman, timings, vcsession
+from scripts.hclupdate import hclfetch, hclindex, hclupload
 
 ## Parameters for Script
 customhcl_path = None
 customhcl_default_path = "json/customhcl.json"
 remote_json_url = "https://partnerweb.vmware.com/service/vsan/all.json"
 backup_path = "json/backup/customhcl_backup.json"
-cred_path = "~/.pgvm/"
+state_path = "json/hclupdate-state.json"
+hcl_header_fields = [ "timestamp", "jsonUpdatedTime" ]
+fetch_metrics = { }
+upload_backends = [ "python", "pwsh" ]
+upload_backend_default = "python"
+fan_out_workers_default = 4
+retry_backoff_seconds = 5
+powershell_script_path = os.path.join ( os.path.dirname ( os.path.abspath ( __file__ ) ), "hclvcenter.ps1" )
+# Environment variables hclvcenter.ps1 reads its secrets from, so they never appear in its command line
+powershell_password_env = "HCLUPDATE_VCENTER_PASSWORD"
+powershell_session_env = "HCLUPDATE_VCENTER_SESSION"
 
 
 def info_msg(message):
@@ -26,23 +41,37 @@ def prompt_msg(message, txt: bool = True):
     else:
         return f"{Fore.YELLOW}{message}{Style.RESET_ALL}"
 
-def fetch_remote_data(url):
+def fetch_remote_data(url, cache_dir=hclfetch.cache_dir_default):
     """
-    Fetch JSON data from the provided URL.
+    Fetch the HCL header fields (`timestamp` and `jsonUpdatedTime`) from the provided URL.
+
+    The download goes through a local cache with a conditional GET, so an unchanged file
+    is served from the cached copy. The outcome is recorded in `fetch_metrics`.
+    Only the start of the document is scanned for the header fields; the controller and
+    device lists are never parsed unless the fields are not near the top.
 
     :param url: URL of the JSON data.
-    :return: Parsed JSON data.
+    :param cache_dir: Directory holding the cached download.
+    :return: Dictionary with the header fields.
     """
+    import requests
+
     try:
         print ( prompt_msg( f"Fetching data from {url}..." ) )
-        response = requests.get ( url )
-        response.raise_for_status ()
-        return response.json ()
+        body_path, metrics = hclfetch.fetch_cached ( url, cache_dir )
+        fetch_metrics.update ( metrics )
+        print ( info_msg( f"Fetch complete: cache_hit={str ( metrics['cache_hit'] ).lower ()} status={metrics['status']} "
+                          f"bytes={metrics['bytes']} seconds={metrics['seconds']}" ) )
+        return hclfetch.extract_fields_from_file ( body_path, hcl_header_fields )
     except requests.exceptions.RequestException as e:
         print ( error_msg( f"Error fetching data: {e}") )
         return None
+    except (OSError, ValueError) as e:
+        print ( error_msg( f"Error reading cached data: {e}") )
+        return None
 
 
+@timings.timed ( "backup" )
 def backup_file(filepath, int_backup_path):
     """
     Create a backup of the provided JSON file.
@@ -73,10 +102,11 @@ def update_json_file(filepath, timestamp, json_updated_time, test_mode=False):
     :param timestamp: New timestamp to replace in the file.
     :param json_updated_time: New jsonUpdatedTime to replace in the file.
     :param test_mode: If True, outputs changes without modifying the file.
+    :return: True if the file was updated (or would be, in test mode).
     """
     if not os.path.exists ( filepath ):
         print ( error_msg( "File {filepath} not found. Aborting..." ) )
-        return
+        return False
 
     try:
         # Load the existing data
@@ -99,52 +129,90 @@ def update_json_file(filepath, timestamp, json_updated_time, test_mode=False):
             with open ( filepath, 'w' ) as outfile:
                 json.dump ( updated_data, outfile, indent=4 )
             print ( info_msg( f"File {filepath} successfully updated." ) )
+        return True
     except Exception as e:
         print ( error_msg( f"Error updating JSON file: {e}" ) )
+        return False
 
 
-def apply_to_vcenter(profile, path_customhcl):
+def apply_to_vcenter(profile, path_customhcl, reuse_session=True, backend=upload_backend_default,
+                     timeout=hclupload.upload_timeout_default):
     """
-    Apply the customhcl.json to the vCenter via REST API.
+    Apply the customhcl.json to the vCenter.
+
+    The default "python" backend uploads the file through the vSAN management API over a pyVmomi session.
+    The "pwsh" backend runs hclvcenter.ps1 (PowerCLI Update-VsanHclDatabase) instead.
+    When session reuse is enabled the profile's cached vCenter session is used by either backend,
+    so repeated runs skip the SSO login.
 
     :param profile: Name of the profile to use for vCenter credentials.
 
     :param path_customhcl: Path to the customhcl.json file to apply.
+    :param reuse_session: If True, reuse and keep the cached vCenter session for the profile.
+    :param backend: Upload backend, "python" or "pwsh".
+    :param timeout: Seconds allowed for the upload.
+    :return: Result dictionary with status ("updated" or "failed") and error.
     """
-    # Path to credentials
-    if profile:
-        credentials_path = os.path.expanduser ( f"{cred_path}{profile}/cred.json" )
-    else:
-        credentials_path = os.path.expanduser ( f"{cred_path}cred.json" )
+    # Load and validate the profile's credentials
+    try:
+        creds = credman.get_creds ( profile, "hclupdate" )
+    except credman.CredentialError as e:
+        print ( error_msg ( str ( e ) ) )
+        return { "status": "failed", "error": str ( e ) }
+    vcenter_host = creds.vcenter_server
+    vcenter_user = creds.vcenter_user
+    vcenter_password = creds.vcenter_password
+    print ( prompt_msg( f"Connecting to {vcenter_host}..." ) )
+
+    # Path to the customhcl.json file
+    if not os.path.exists ( path_customhcl ):
+        print ( error_msg ( f"The HCL file '{path_customhcl}' does not exist." ) )
+        return { "status": "failed", "error": f"The HCL file '{path_customhcl}' does not exist." }
+
+    if backend == "pwsh":
+        return _apply_with_pwsh ( profile, vcenter_host, vcenter_user, vcenter_password, path_customhcl, reuse_session, timeout )
+    return _apply_with_python ( profile, vcenter_host, vcenter_user, vcenter_password, path_customhcl, reuse_session, timeout )
 
-    # Verify that the credentials file exists
-    if not os.path.exists ( credentials_path ):
-        print ( prompt_msg( f"Credentials file does not exist for the profile '{profile}'. Expected at: {credentials_path}" ) )
-        exit ( 1 )
 
-    # Load credentials
+def _apply_with_python(profile, vcenter_host, vcenter_user, vcenter_password, path_customhcl, reuse_session, timeout):
+    """
+    Upload the customhcl.json through the vSAN management API.
+
+    :return: Result dictionary with status and error.
+    """
     try:
-        with open ( credentials_path, 'r' ) as file:
-            creds = json.load ( file )
-        vcenter_host = creds["lab"]["vcenter"]["vcenter_server"]
-        vcenter_user = creds["lab"]["vcenter"]["vcenter_user"]
-        vcenter_password = creds["lab"]["vcenter"]["vcenter_password"]
-        print ( prompt_msg( f"Connecting to {vcenter_host}..." ) )
+        service_instance = vcsession.connect ( profile, vcenter_host, vcenter_user, vcenter_password, timeout, reuse_session )
     except Exception as e:
-        print ( error_msg ( f"Error loading credentials: {e}" ) )
-        exit ( 1 )
+        print ( error_msg ( f"Unable to connect to {vcenter_host}: {e}" ) )
+        return { "status": "failed", "error": f"Unable to connect to {vcenter_host}: {e}" }
 
-    # Ensure all required credentials are available
-    if not (vcenter_host and vcenter_user and vcenter_password):
-        print ( error_msg ( "Incomplete credentials. Ensure the 'vcenter_host', 'username', and 'password' fields are defined." ) )
-        exit ( 1 )
+    try:
+        result = hclupload.upload_hcl ( service_instance, path_customhcl, timeout=timeout )
+    finally:
+        if not reuse_session:
+            # A failed logout must not hide the upload result
+            try:
+                service_instance.content.sessionManager.Logout ()
+            except Exception as e:
+                print ( error_msg ( f"Error logging out of {vcenter_host}: {e}" ) )
+
+    if result [ "status" ] == "updated":
+        print ( info_msg( f"HCL uploaded to {vcenter_host} in {result['seconds']}s." ) )
+    else:
+        print ( error_msg ( f"HCL upload to {vcenter_host} failed: {result['error']}" ) )
+    return result
 
-    # Path to the customhcl.json file
-    if not os.path.exists ( path_customhcl ):
-        print ( error_msg ( f"The HCL file '{path_customhcl}' does not exist." ) )
-        exit ( 1 )
 
-    powershell_script_path = "hclvcenter.ps1"  # Replace with the path to your PowerShell script
+@timings.timed ( "pwsh" )
+def _apply_with_pwsh(profile, vcenter_host, vcenter_user, vcenter_password, path_customhcl, reuse_session, timeout):
+    """
+    Upload the customhcl.json by running hclvcenter.ps1 with PowerCLI.
+
+    The cached session ID or the password is handed to the script through its environment rather than
+    its arguments, which any local user can read from the process list.
+
+    :return: Result dictionary with status and error.
+    """
     try:
         # Build the PowerShell command
         command = [
@@ -154,26 +222,201 @@ def apply_to_vcenter(profile, path_customhcl):
             "Bypass",
             "-File",
             powershell_script_path,
+            "-vCenterServer",
             vcenter_host,
-            vcenter_user,
-            vcenter_password,
+            "-JsonFilePath",
             path_customhcl
         ]
+        session_id = None
+        if reuse_session:
+            try:
+                service_instance = vcsession.connect ( profile, vcenter_host, vcenter_user, vcenter_password )
+                session_id = vcsession.session_id ( service_instance )
+            except Exception as e:
+                print ( prompt_msg( f"Unable to reuse a cached session, PowerCLI will log in: {e}" ) )
+        env = { key: value for key, value in os.environ.items () if key not in ( powershell_password_env, powershell_session_env ) }
+        if session_id:
+            env [ powershell_session_env ] = session_id
+        else:
+            command += [ "-Username", vcenter_user ]
+            env [ powershell_password_env ] = vcenter_password
         # Run the command and capture output
-        result = subprocess.run ( command, capture_output=True, text=True )
+        result = subprocess.run ( command, capture_output=True, text=True, timeout=timeout, env=env )
 
         # Check the result
         if result.returncode == 0:
             print ( info_msg( "PowerShell script executed successfully." ) )
             print ( info_msg(result.stdout) )
+            return { "status": "updated", "error": None }
         else:
             print ( error_msg ( "PowerShell script execution failed." ) )
             print ( error_msg ( "Error Output:" ) )
             print ( error_msg ( result.stderr ) )
+            return { "status": "failed", "error": result.stderr.strip () or f"pwsh exited with {result.returncode}" }
 
+    except subprocess.TimeoutExpired:
+        print ( error_msg ( f"The PowerShell script did not finish within {timeout} seconds." ) )
+        return { "status": "failed", "error": f"Timed out after {timeout} seconds." }
     except Exception as e:
         print ( error_msg ( f"An error occurred while running the PowerShell script: {e}" ) )
-        exit ( 1 )
+        return { "status": "failed", "error": str ( e ) }
+
+
+def updated_file_hash(filepath, timestamp, json_updated_time):
+    """
+    Return the SHA-256 a JSON file would have after update_json_file, without writing it.
+
+    :param filepath: Path to the JSON file.
+    :param timestamp: New timestamp.
+    :param json_updated_time: New jsonUpdatedTime.
+    """
+    with open ( filepath, 'r' ) as hcl_file:
+        data = json.load ( hcl_file )
+    data [ "timestamp" ] = timestamp
+    data [ "jsonUpdatedTime" ] = json_updated_time
+    # Serialized exactly as update_json_file writes it
+    return hashlib.sha256 ( json.dumps ( data, indent=4 ).encode ( "utf-8" ) ).hexdigest ()
+
+
+def file_hash(filepath):
+    """
+    Return the SHA-256 of a file, or None if it does not exist.
+
+    :param filepath: Path to the file.
+    """
+    if not os.path.exists ( filepath ):
+        return None
+    digest = hashlib.sha256 ()
+    with open ( filepath, 'rb' ) as hash_file:
+        for block in iter ( lambda: hash_file.read ( 1024 * 1024 ), b"" ):
+            digest.update ( block )
+    return digest.hexdigest ()
+
+
+def load_state(int_state_path):
+    """
+    Load the state of the last run (content hashes, timestamps and per-vCenter applied hashes).
+
+    :param int_state_path: Path to the state file.
+    :return: State dictionary, empty if there is no usable state.
+    """
+    if not os.path.exists ( int_state_path ):
+        return { }
+    try:
+        with open ( int_state_path, 'r' ) as state_file:
+            return json.load ( state_file )
+    except (OSError, ValueError) as e:
+        print ( prompt_msg( f"Ignoring unreadable state file {int_state_path}: {e}" ) )
+        return { }
+
+
+def save_state(int_state_path, state):
+    """
+    Save the run state atomically.
+
+    :param int_state_path: Path to the state file.
+    :param state: State dictionary.
+    """
+    state_dir = os.path.dirname ( int_state_path )
+    if state_dir:
+        os.makedirs ( state_dir, exist_ok=True )
+    with open ( f"{int_state_path}.tmp", 'w' ) as state_file:
+        json.dump ( state, state_file, indent=4 )
+    os.replace ( f"{int_state_path}.tmp", int_state_path )
+
+
+def local_is_current(state, source_hash, destination_path, timestamp, json_updated_time):
+    """
+    Check whether the destination customhcl.json already matches the source file and remote timestamps.
+
+    :return: True if copying, backing up and rewriting the file can be skipped.
+    """
+    return ( source_hash is not None
+             and state.get ( "source_hash" ) == source_hash
+             and state.get ( "timestamp" ) == timestamp
+             and state.get ( "jsonUpdatedTime" ) == json_updated_time
+             and state.get ( "output_hash" ) is not None
+             and state.get ( "output_hash" ) == file_hash ( destination_path ) )
+
+
+def apply_with_retries(profile, path_customhcl, args):
+    """
+    Apply the customhcl.json to one vCenter, retrying failed attempts with a linear backoff.
+
+    :param profile: Name of the profile to use for vCenter credentials.
+    :param path_customhcl: Path to the customhcl.json file to apply.
+    :param args: Parsed command-line arguments (backend, upload_timeout, retries, no_session_cache).
+    :return: Result dictionary with profile, status, attempts, seconds and error.
+    """
+    start = time.monotonic ()
+    attempts = 0
+    result = { }
+    for attempts in range ( 1, args.retries + 2 ):
+        result = apply_to_vcenter ( profile, path_customhcl, not args.no_session_cache, args.backend, args.upload_timeout )
+        if result [ "status" ] == "updated":
+            break
+        if attempts <= args.retries:
+            print ( prompt_msg( f"Retrying profile '{profile or 'default'}' (attempt {attempts + 1})..." ) )
+            time.sleep ( retry_backoff_seconds * attempts )
+    return { "profile": profile or "default", "status": result [ "status" ], "attempts": attempts,
+             "seconds": round ( time.monotonic () - start, 2 ), "error": result.get ( "error" ) }
+
+
+def fan_out(profiles, path_customhcl, args, state, output_hash, test_mode=False):
+    """
+    Upload the customhcl.json to every stale vCenter concurrently.
+
+    Targets whose recorded hash already matches the file being pushed are skipped. The rest run in a
+    bounded thread pool, each with its own timeout and retries, and successful uploads are recorded in the state.
+
+    :param profiles: List of profile names, one per vCenter.
+    :param path_customhcl: Path to the customhcl.json file to apply.
+    :param args: Parsed command-line arguments.
+    :param state: Run state, updated in place with successful uploads.
+    :param output_hash: SHA-256 of the file pushed in this run (in test mode, of the file as it would be written).
+    :param test_mode: If True, report what would be uploaded without uploading.
+    :return: List of per-target result dictionaries.
+    """
+    applied = state.setdefault ( "vcenters", { } )
+    results = [ ]
+    stale = [ ]
+    for profile in profiles:
+        target = profile or "default"
+        if not args.force and output_hash and applied.get ( target, { } ).get ( "hash" ) == output_hash:
+            results.append ( { "profile": target, "status": "skipped", "attempts": 0, "seconds": 0.0, "error": None } )
+            continue
+        # Broken credentials fail up front instead of burning retries
+        try:
+            credman.get_creds ( profile, "hclupdate" )
+        except credman.CredentialError as e:
+            print ( error_msg ( str ( e ) ) )
+            results.append ( { "profile": target, "status": "failed", "attempts": 0, "seconds": 0.0, "error": str ( e ) } )
+            continue
+        if test_mode:
+            results.append ( { "profile": target, "status": "would-update", "attempts": 0, "seconds": 0.0, "error": None } )
+        else:
+            stale.append ( profile )
+
+    if stale:
+        with ThreadPoolExecutor ( max_workers=max ( 1, min ( args.workers, len ( stale ) ) ) ) as executor:
+            for result in executor.map ( lambda profile: apply_with_retries ( profile, path_customhcl, args ), stale ):
+                if result [ "status" ] == "updated":
+                    applied [ result [ "profile" ] ] = { "hash": output_hash, "applied": time.time () }
+                results.append ( result )
+    return sorted ( results, key=lambda result: result [ "profile" ] )
+
+
+def print_target_summary(results):
+    """
+    Print a per-vCenter table of upload status, attempts, latency and errors.
+
+    :param results: List of result dictionaries from fan_out.
+    """
+    print ( prompt_msg( f"{'PROFILE':<20} {'STATUS':<13} {'ATTEMPTS':>8} {'SECONDS':>9}  ERROR", txt=False ) )
+    for result in results:
+        line = ( f"{result['profile']:<20} {result['status']:<13} {result['attempts']:>8} "
+                 f"{result['seconds']:>9.2f}  {result['error'] or ''}" )
+        print ( error_msg ( line ) if result [ "status" ] == "failed" else info_msg ( line ) )
 
 
 def prepare_file(source_path, destination_path):
@@ -196,31 +439,110 @@ def prepare_file(source_path, destination_path):
     shutil.copy ( source_path, destination_path )
 
 
-def main():
+def check_main(argv):
+    """
+    Validate the entries of a customhcl.json against the official vSAN HCL.
+
+    The cached all.json is refreshed with a conditional GET (skipped with --offline) and its on-disk
+    index is only rebuilt when jsonUpdatedTime changed, so a check usually costs a few milliseconds.
+
+    :param argv: Command-line arguments following "check".
+    """
+    parser = argparse.ArgumentParser ( prog=f"{os.path.basename ( sys.argv [ 0 ] )} check",
+                                       description="Check customhcl.json entries against the official vSAN HCL." )
+    parser.add_argument ( "--hcl-path", type=str, default=customhcl_default_path,
+                          help=f"Path to the customhcl file to check (defaults to {customhcl_default_path})." )
+    parser.add_argument ( "--cache-dir", type=str, default=hclfetch.cache_dir_default, help="Directory holding the cached HCL and its index." )
+    parser.add_argument ( "--offline", action="store_true", help="Use the cached HCL as is, without checking for a newer one." )
+    parser.add_argument ( "--rebuild", action="store_true", help="Rebuild the index even if the HCL has not changed." )
+    parser.add_argument ( "--format", type=str, choices=[ "table", "json" ], default="table", help="Print a table or JSON." )
+    timings.add_arguments ( parser )
+    args = parser.parse_args ( argv )
+
+    with timings.run ( "hclupdate check", args ):
+        if not args.offline and not fetch_remote_data ( remote_json_url, args.cache_dir ):
+            print ( error_msg ( "Failed to refresh the official HCL. Use --offline to check against the cached copy." ) )
+            exit ( 1 )
+        try:
+            with open ( args.hcl_path, 'r', encoding="utf-8" ) as custom_file:
+                document = json.load ( custom_file )
+            index, rebuilt = hclindex.open_index ( args.cache_dir, args.rebuild )
+        except (OSError, ValueError) as e:
+            print ( error_msg ( f"Unable to check {args.hcl_path}: {e}" ) )
+            exit ( 1 )
+        with index:
+            start = time.perf_counter ()
+            checked, findings = hclindex.check_entries ( document, index )
+            elapsed_ms = ( time.perf_counter () - start ) * 1000
+            official_time = index.header.get ( "jsonUpdatedTime" )
+
+    if args.format == "json":
+        print ( json.dumps ( { "hcl": args.hcl_path, "jsonUpdatedTime": official_time, "index_rebuilt": rebuilt,
+                               "checked": checked, "findings": findings }, indent=4 ) )
+    else:
+        print ( info_msg ( f"Official HCL jsonUpdatedTime {official_time} (index {'rebuilt' if rebuilt else 'reused'})." ) )
+        if findings:
+            print ( f"{'STATUS':<10} {'CATEGORY':<12} {'ENTRY':>5}  {'KEY':<20} {'MODEL':<40} DETAIL" )
+            for finding in findings:
+                print ( f"{finding [ 'status' ]:<10} {finding [ 'category' ]:<12} {finding [ 'index' ]:>5}  {finding [ 'key' ]:<20} "
+                        f"{str ( finding [ 'model' ] or '-' ):<40} {finding [ 'detail' ]}" )
+        message = f"{checked} entries checked in {elapsed_ms:.1f} ms, {len ( findings )} problems found."
+        print ( error_msg ( message ) if findings else info_msg ( message ) )
+    if findings:
+        exit ( 1 )
+
+
+def main(argv=None):
+    argv = sys.argv [ 1: ] if argv is None else list ( argv )
+    # "check" validates the custom HCL instead of refreshing it
+    if argv and argv [ 0 ] == "check":
+        return check_main ( argv [ 1: ] )
+
     # Parse command-line arguments
     parser = argparse.ArgumentParser ( description="Update customhcl.json with remote timestamp and jsonUpdatedTime." )
     parser.add_argument ( "--hcl-path", type=str, default=None, help="Path to the customhcl file." )
     parser.add_argument ( "--test", action="store_true", help="Run the script in test mode (no changes will be made)." )
     parser.add_argument ( "--update-vcenter", action="store_true", help="Apply the custom.hcl to the vCenter." )
-    parser.add_argument ( "--profile", type=str, help="Profile to use for vCenter credentials (defaults to ~/.pgvm/cred.json)." )
+    parser.add_argument ( "--profile", type=str, nargs="+",
+                          help="One or more profiles to use for vCenter credentials (defaults to ~/.pgvm/cred.json)." )
+    parser.add_argument ( "--workers", type=int, default=fan_out_workers_default, help="Number of vCenters updated in parallel." )
+    parser.add_argument ( "--retries", type=int, default=1, help="Number of times a failed vCenter upload is retried." )
+    parser.add_argument ( "--cache-dir", type=str, default=hclfetch.cache_dir_default, help="Directory used to cache the remote HCL download." )
+    parser.add_argument ( "--backend", type=str, choices=upload_backends, default=upload_backend_default,
+                          help="Upload the HCL natively through the vSAN API (python) or with PowerCLI (pwsh)." )
+    parser.add_argument ( "--upload-timeout", type=int, default=hclupload.upload_timeout_default, help="Seconds allowed for the HCL upload." )
+    parser.add_argument ( "--force", action="store_true", help="Copy, rewrite and upload even if nothing has changed since the last run." )
+    parser.add_argument ( "--no-session-cache", action="store_true", help="Log in to vCenter from scratch instead of reusing the cached session." )
+    parser.add_argument ( "--logout", action="store_true", help="End and remove the cached vCenter session for the profile, then exit." )
+
+    timings.add_arguments ( parser )
+    args = parser.parse_args ( argv )
+    with timings.run ( "hclupdate", args ):
+        return run ( args )
+
+
+def run(args):
+    """
+    Refresh the custom HCL and push it to vCenter as requested by the command-line arguments.
 
-    args = parser.parse_args ()
+    :param args: Parsed command-line arguments
+    """
     source_hcl_path = args.hcl_path or "customhcl"
     destination_hcl_path = "json/customhcl.json"
     test_mode = args.test
     update_vcenter = args.update_vcenter
-    profile = args.profile or ""
-
-    # Ensure profile is provided if --update-vcenter is used
-
-    # Copy customhcl to destination path
-    prepare_file ( source_hcl_path, destination_hcl_path )
-
-    # Continue using the destination path for updates
-    path_customhcl = destination_hcl_path
+    profiles = args.profile or [ "" ]
+
+    if args.logout:
+        for profile in profiles:
+            if vcsession.logout ( profile ):
+                print ( info_msg( f"Logged out cached session for profile '{profile or 'default'}'." ) )
+            else:
+                print ( info_msg( f"No cached session for profile '{profile or 'default'}'." ) )
+        return
 
     # Fetch data from remote URL
-    remote_data = fetch_remote_data ( remote_json_url )
+    remote_data = fetch_remote_data ( remote_json_url, args.cache_dir )
     if not remote_data:
         print ( error_msg( "Failed to fetch remote data. Exiting..." ) )
         return
@@ -233,16 +555,57 @@ def main():
         return
     print ( info_msg( f"Retrieved jsonUpdatedTime: {json_updated_time}" ) )
 
-    # If not in test mode, back up the existing customhcl.json
-    if not test_mode:
-        backup_file ( path_customhcl, backup_path )
+    # Continue using the destination path for updates
+    path_customhcl = destination_hcl_path
+    state = load_state ( state_path )
+    source_hash = file_hash ( source_hcl_path )
+    decision = { "timestamp": timestamp, "jsonUpdatedTime": json_updated_time, "cache_hit": fetch_metrics.get ( "cache_hit" ),
+                 "forced": args.force, "test": test_mode, "local": None, "vcenters": { } }
+
+    if not args.force and local_is_current ( state, source_hash, path_customhcl, timestamp, json_updated_time ):
+        print ( info_msg( f"{path_customhcl} is already up to date. Skipping copy, backup and rewrite." ) )
+        decision [ "local" ] = "unchanged"
+    else:
+        # Copy customhcl to destination path
+        prepare_file ( source_hcl_path, destination_hcl_path )
+
+        # If not in test mode, back up the existing customhcl.json
+        if not test_mode:
+            backup_file ( path_customhcl, backup_path )
+
+        # Update customhcl.json with new values
+        updated = update_json_file ( path_customhcl, timestamp, json_updated_time, test_mode )
+        if not updated:
+            decision [ "local" ] = "failed"
+        elif test_mode:
+            decision [ "local" ] = "would-update"
+        else:
+            decision [ "local" ] = "updated"
+            state.update ( { "source_hash": source_hash, "output_hash": file_hash ( path_customhcl ),
+                             "timestamp": timestamp, "jsonUpdatedTime": json_updated_time } )
+
+    # If the --update-vcenter flag is set, apply the JSON to every vCenter that does not already have this content
+    results = [ ]
+    if update_vcenter and decision [ "local" ] != "failed":
+        # Compare the targets against the file this run pushes, not the one recorded by an earlier run
+        if decision [ "local" ] == "would-update":
+            output_hash = updated_file_hash ( path_customhcl, timestamp, json_updated_time )
+        else:
+            output_hash = file_hash ( path_customhcl )
+        results = fan_out ( profiles, path_customhcl, args, state, output_hash, test_mode )
+        decision [ "vcenters" ] = { result [ "profile" ]: result [ "status" ] for result in results }
+        print_target_summary ( results )
 
-    # Update customhcl.json with new values
-    update_json_file ( path_customhcl, timestamp, json_updated_time, test_mode )
+    if not test_mode:
+        save_state ( state_path, state )
+    print ( json.dumps ( decision ) )
 
-    # If the --update-vcenter flag is set, apply the JSON to vCenter
-    if update_vcenter:
-        apply_to_vcenter ( profile, path_customhcl )
+    # Exit 1 when nothing could be applied, 2 when only some vCenters failed
+    failed = [ result for result in results if result [ "status" ] == "failed" ]
+    if decision [ "local" ] == "failed" or ( failed and len ( failed ) == len ( results ) ):
+        exit ( 1 )
+    if failed:
+        exit ( 2 )
 
 
 if __name__ == "__main__":
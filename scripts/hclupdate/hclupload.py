@@ -0,0 +1,83 @@
+import base64
+import gzip
+import ssl
+import time
+from scripts import timings
+
+## Parameters for the vSAN management API
+vsan_endpoint = "/vsanHealth"
+vsan_health_moid = "vsan-cluster-health-system"
+upload_timeout_default = 300
+
+
+def get_health_system(host, cookie, version, port=443, path=vsan_endpoint, timeout=upload_timeout_default):
+    """
+    Build a VsanVcClusterHealthSystem bound to the vSAN management endpoint of a vCenter.
+
+    The vSAN API is served on its own SOAP endpoint but accepts the vCenter session cookie,
+    so an existing pyVmomi session is reused rather than logging in again.
+
+    :param host: vCenter host name (or a local stub endpoint).
+    :param cookie: Session cookie of an authenticated vCenter SOAP stub.
+    :param version: vmodl version of that stub (e.g. service_instance._stub.version).
+    :param port: HTTPS port; a negative port selects plain HTTP, as in pyVmomi.
+    :param path: SOAP path of the vSAN management service.
+    :param timeout: Socket timeout in seconds.
+    :return: vim.cluster.VsanVcClusterHealthSystem managed object.
+    """
+    from pyVmomi import SoapStubAdapter, vim
+
+    stub = SoapStubAdapter (
+        host=host,
+        port=port,
+        path=path,
+        version=version,
+        sslContext=ssl._create_unverified_context (),
+        httpConnectionTimeout=timeout
+    )
+    stub.cookie = cookie
+    return vim.cluster.VsanVcClusterHealthSystem ( vsan_health_moid, timings.instrument_stub ( stub ) )
+
+
+def encode_db(content):
+    """
+    Encode an HCL database the way VsanVcUploadHclDb expects it: gzip-compressed, then base64.
+
+    :param content: customhcl.json contents as bytes.
+    :return: ASCII string for the db argument.
+    """
+    return base64.b64encode ( gzip.compress ( content ) ).decode ( "ascii" )
+
+
+@timings.timed ( "upload" )
+def upload_hcl(service_instance, path_customhcl, host=None, port=443, path=vsan_endpoint, timeout=upload_timeout_default):
+    """
+    Upload a custom HCL database to vCenter through the vSAN management API.
+
+    This is the call Update-VsanHclDatabase makes, without starting PowerShell or PowerCLI; the file is
+    sent gzip-compressed and base64-encoded (see encode_db).
+
+    :param service_instance: Connected vCenter service instance.
+    :param path_customhcl: Path to the customhcl.json file to upload.
+    :param host: Host of the vSAN management endpoint (defaults to the vCenter host).
+    :param port: Port of the vSAN management endpoint (negative for plain HTTP).
+    :param path: SOAP path of the vSAN management service.
+    :param timeout: Socket timeout in seconds for the upload.
+    :return: Result dictionary with status ("updated" or "failed"), seconds and error.
+    """
+    start = time.monotonic ()
+    result = { "status": "failed", "seconds": 0.0, "error": None }
+    try:
+        with open ( path_customhcl, 'rb' ) as hcl_file:
+            db = encode_db ( hcl_file.read () )
+        stub = service_instance._stub
+        host = host or stub.host.rsplit ( ":", 1 ) [ 0 ]
+        health_system = get_health_system ( host, stub.cookie, stub.version, port, path, timeout )
+        if health_system.VsanVcUploadHclDb ( db=db ):
+            result [ "status" ] = "updated"
+        else:
+            result [ "error" ] = "vCenter rejected the HCL database."
+    except Exception as e:
+        result [ "error" ] = f"{type ( e ).__name__}: {e}"
+    result [ "seconds" ] = round ( time.monotonic () - start, 3 )
+    return result
@@ -1,18 +1,26 @@
 param(
     [string]$vCenterServer,
     [string]$Username,
-    [string]$Password,
     [string]$JsonFilePath
 )
+# The password and the session ID come from the environment so they do not show up in the process list
+$Password = $env:HCLUPDATE_VCENTER_PASSWORD
+$SessionId = $env:HCLUPDATE_VCENTER_SESSION
 Import-Module VMware.VimAutomation.Core
 
-# Connect to vCenter
-$viserver = Connect-VIServer -Server $vCenterServer -User $Username -Password $Password
+# Connect to vCenter, reusing an existing session when one is provided
+if ($SessionId) {
+    $viserver = Connect-VIServer -Server $vCenterServer -Session $SessionId
+} else {
+    $viserver = Connect-VIServer -Server $vCenterServer -User $Username -Password $Password
+}
 
 Write-Host "=== Connected to " $viserver " ==="
 
 Write-Host "=== Updating HCL ===" -ForegroundColor green
 Update-VsanHclDatabase -FilePath $JsonFilePath
 
-# Disconnect from vCenter and remove the session
-Disconnect-VIServer -Server $viserver -Confirm:$false
\ No newline at end of file
+# Disconnect from vCenter and remove the session, unless it is a shared session kept for later runs
+if (-not $SessionId) {
+    Disconnect-VIServer -Server $viserver -Confirm:$false
+}
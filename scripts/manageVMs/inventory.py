@@ -0,0 +1,224 @@
+from scripts import timings
+
+# Properties collected for every VM unless the caller asks for something else
+DEFAULT_VM_PROPERTIES = [ "name" ]
+# Number of objects vCenter returns per RetrievePropertiesEx / ContinueRetrievePropertiesEx page
+DEFAULT_PAGE_SIZE = 1000
+
+
+def build_filter_spec(view, obj_type, properties):
+    """
+    Builds a PropertyCollector filter spec that walks a ContainerView.
+
+    :param view: ContainerView listing the objects to collect
+    :param obj_type: Managed object type to collect (e.g. vim.VirtualMachine)
+    :param properties: List of property paths to collect for each object
+    :return: vmodl.query.PropertyCollector.FilterSpec
+    """
+    from pyVmomi import vim, vmodl
+
+    traversal_spec = vmodl.query.PropertyCollector.TraversalSpec (
+        name="traverseEntities",
+        path="view",
+        skip=False,
+        type=vim.view.ContainerView
+    )
+    object_spec = vmodl.query.PropertyCollector.ObjectSpec (
+        obj=view,
+        skip=True,
+        selectSet=[ traversal_spec ]
+    )
+    property_spec = vmodl.query.PropertyCollector.PropertySpec (
+        type=obj_type,
+        pathSet=list ( properties ),
+        all=False
+    )
+    return vmodl.query.PropertyCollector.FilterSpec (
+        objectSet=[ object_spec ],
+        propSet=[ property_spec ]
+    )
+
+
+def _to_records(result):
+    """
+    Converts a RetrieveResult page into plain dict records.
+
+    Each record carries the managed object ID under "moid" plus one key per collected property.
+    Properties that are unset on the object are omitted by vCenter and are left out of the record.
+
+    :param result: vmodl.query.PropertyCollector.RetrieveResult
+    :return: List of dicts
+    """
+    records = [ ]
+    for obj_content in result.objects:
+        record = { "moid": obj_content.obj._moId }
+        for prop in obj_content.propSet or [ ]:
+            record [ prop.name ] = prop.val
+        records.append ( record )
+    return records
+
+
+def retrieve_pages(service_instance, obj_type=None, properties=None, page_size=DEFAULT_PAGE_SIZE, container=None):
+    """
+    Retrieves properties for every object of a type in one batched PropertyCollector walk.
+
+    Pages are fetched with RetrievePropertiesEx and ContinueRetrievePropertiesEx, so an inventory
+    of N objects costs roughly N / page_size round trips instead of one per object and property.
+
+    :param service_instance: The connected vCenter service instance
+    :param obj_type: Managed object type to collect (defaults to vim.VirtualMachine)
+    :param properties: List of property paths to collect (defaults to DEFAULT_VM_PROPERTIES)
+    :param page_size: Maximum number of objects returned per round trip
+    :param container: Folder or datacenter to search below (defaults to the root folder)
+    :return: Generator yielding lists of dict records, one list per page
+    """
+    from pyVmomi import vim, vmodl
+
+    obj_type = obj_type or vim.VirtualMachine
+    properties = properties or DEFAULT_VM_PROPERTIES
+    content = service_instance.RetrieveContent ()
+    view = content.viewManager.CreateContainerView ( container or content.rootFolder, [ obj_type ], True )
+    collector = content.propertyCollector
+    try:
+        filter_spec = build_filter_spec ( view, obj_type, properties )
+        options = vmodl.query.PropertyCollector.RetrieveOptions ( maxObjects=page_size )
+        with timings.span ( "retrieve" ):
+            result = collector.RetrievePropertiesEx ( [ filter_spec ], options )
+        while result:
+            yield _to_records ( result )
+            if not result.token:
+                break
+            with timings.span ( "retrieve" ):
+                result = collector.ContinueRetrievePropertiesEx ( result.token )
+    finally:
+        view.Destroy ()
+
+
+def retrieve_all(service_instance, obj_type=None, properties=None, page_size=DEFAULT_PAGE_SIZE, container=None):
+    """
+    Retrieves every object of a type and returns the records as a single list.
+
+    :param service_instance: The connected vCenter service instance
+    :param obj_type: Managed object type to collect (defaults to vim.VirtualMachine)
+    :param properties: List of property paths to collect (defaults to DEFAULT_VM_PROPERTIES)
+    :param page_size: Maximum number of objects returned per round trip
+    :param container: Folder or datacenter to search below (defaults to the root folder)
+    :return: List of dict records
+    """
+    records = [ ]
+    for page in retrieve_pages ( service_instance, obj_type, properties, page_size, container ):
+        records.extend ( page )
+    return records
+
+
+def _parent_chain_specs():
+    """
+    Builds the traversal from a VM up through its vApps, resource pools, compute resources and folders.
+
+    :return: Tuple of (list of TraversalSpecs for the VM ObjectSpecs, list of PropertySpecs for the ancestors)
+    """
+    from pyVmomi import vim, vmodl
+
+    collector_type = vmodl.query.PropertyCollector
+    select_set = [
+        collector_type.TraversalSpec ( name="toParent", type=vim.ManagedEntity, path="parent", skip=False,
+                                       selectSet=[ collector_type.SelectionSpec ( name="toParent" ) ] ),
+        collector_type.TraversalSpec ( name="toVApp", type=vim.VirtualMachine, path="parentVApp", skip=False,
+                                       selectSet=[ collector_type.SelectionSpec ( name="toParent" ) ] )
+    ]
+    # VirtualApp is a ResourcePool and ClusterComputeResource a ComputeResource
+    prop_set = [ collector_type.PropertySpec ( type=ancestor_type, pathSet=[ "parent" ], all=False )
+                 for ancestor_type in ( vim.Folder, vim.ResourcePool, vim.ComputeResource ) ]
+    return select_set, prop_set
+
+
+def _find_datacenter(record, ancestors):
+    """
+    Follows parentVApp/parent references from a VM record until a datacenter is reached.
+
+    :param record: VM record with parent and/or parentVApp
+    :param ancestors: Dict mapping moid to the record of every ancestor retrieved with the VM
+    :return: Datacenter moid, or None if the chain is incomplete
+    """
+    from pyVmomi import vim
+
+    node = record
+    # Inventory trees are shallow; the bound only guards against a malformed answer
+    for _ in range ( 64 ):
+        parent = node.get ( "parentVApp" ) or node.get ( "parent" )
+        if parent is None:
+            return None
+        if isinstance ( parent, vim.Datacenter ):
+            return parent._moId
+        node = ancestors.get ( parent._moId )
+        if node is None:
+            return None
+    return None
+
+
+def retrieve_objects(service_instance, obj_type, moids, properties, page_size=DEFAULT_PAGE_SIZE, with_datacenter=False):
+    """
+    Retrieves properties of specific objects by managed object ID, page_size objects per round trip.
+
+    Objects that no longer exist are skipped. With with_datacenter, the VMs' ancestors are walked in
+    the same retrieval and every record gets the moid of its datacenter under "datacenter".
+
+    :param service_instance: The connected vCenter service instance
+    :param obj_type: Managed object type of the objects (e.g. vim.VirtualMachine)
+    :param moids: Managed object IDs to retrieve
+    :param properties: List of property paths to collect for each object
+    :param page_size: Maximum number of objects per round trip
+    :param with_datacenter: Resolve the datacenter of each VM (obj_type must be vim.VirtualMachine)
+    :return: List of dict records
+    """
+    from pyVmomi import vmodl
+
+    collector_type = vmodl.query.PropertyCollector
+    collector = service_instance.RetrieveContent ().propertyCollector
+    path_set = list ( properties )
+    select_set, prop_set = ( _parent_chain_specs () if with_datacenter else ( [ ], [ ] ) )
+    if with_datacenter:
+        path_set += [ path for path in ( "parent", "parentVApp" ) if path not in path_set ]
+    prop_set = [ collector_type.PropertySpec ( type=obj_type, pathSet=path_set, all=False ) ] + prop_set
+    options = collector_type.RetrieveOptions ( maxObjects=page_size )
+    moids = list ( moids )
+    records = [ ]
+    ancestors = { }
+    for start in range ( 0, len ( moids ), page_size ):
+        chunk = moids [ start:start + page_size ]
+        while chunk:
+            filter_spec = collector_type.FilterSpec (
+                objectSet=[ collector_type.ObjectSpec ( obj=obj_type ( moid, service_instance._stub ), skip=False, selectSet=select_set )
+                            for moid in chunk ],
+                propSet=prop_set
+            )
+            try:
+                with timings.span ( "retrieve" ):
+                    result = collector.RetrievePropertiesEx ( [ filter_spec ], options )
+            except vmodl.fault.ManagedObjectNotFound as e:
+                # One missing object fails the whole call; drop it and ask again
+                missing = getattr ( e.obj, "_moId", None )
+                if missing not in chunk:
+                    raise
+                chunk.remove ( missing )
+                continue
+            wanted = set ( chunk )
+            while result:
+                for record in _to_records ( result ):
+                    if record [ "moid" ] in wanted:
+                        records.append ( record )
+                    else:
+                        # Ancestors shared by several chunks come back with each of them
+                        ancestors [ record [ "moid" ] ] = record
+                if not result.token:
+                    break
+                with timings.span ( "retrieve" ):
+                    result = collector.ContinueRetrievePropertiesEx ( result.token )
+            break
+    if with_datacenter:
+        for record in records:
+            record [ "datacenter" ] = _find_datacenter ( record, ancestors )
+            for path in ( "parent", "parentVApp" ):
+                if path not in properties:
+                    record.pop ( path, None )
+    return records
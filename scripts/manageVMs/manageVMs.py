@@ -4,40 +4,42 @@ from scripts import credman
 import os
 import sys
 import socket
-from pyVim.connect import SmartConnect, Disconnect
-from pyVmomi import vim
-import ssl
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from scripts import timings, vcsession
+from scripts.manageVMs import inventory, output, perf, power, store, sync, tagging
 
 scriptName = "manageVMs"
-cred_path = "~/.pgvm/"
 json_output_file = "./json/vms.json"
+stats_output_file = "./json/vmstats.json"
+tag_cache_file = "manageVMs-tagcache.json"
+sync_state_file = "manageVMs-state.json"
+DEFAULT_WORKERS = 4
+DEFAULT_TARGET_TIMEOUT = 600
+# Seconds an inventory index stays usable for --from-index power targets
+DEFAULT_INDEX_MAX_AGE = 3600
 
 
-def connect_to_vcenter(creds):
+def connect_to_vcenter(creds, timeout=None, profile="", reuse=False):
     """
     Connects to the vCenter server and returns the service instance.
 
-    :param vcenter_server: vCenter server address
-    :param username: Username for vCenter
-    :param password: Password for vCenter
+    :param creds: credman.Credentials with the vCenter server, username and password
+    :param timeout: Socket timeout in seconds for the connection (None for no timeout)
+    :param profile: Profile name used to locate the cached session
+    :param reuse: If True, reuse the profile's cached session when still valid and cache new logins
     :return: Service Instance connected to vCenter
     """
-    vcenter_server = creds["vcenter"]["VCENTER_SERVER"]
-    username = creds["vcenter"]["VCENTER_USER"]
-    password = creds["vcenter"]["VCENTER_PASSWORD"]
+    vcenter_server = creds.vcenter_server
+    username = creds.vcenter_user
+    password = creds.vcenter_password
+    from pyVmomi import vmodl
 
     try:
-        # Disable SSL warnings
-        context = ssl._create_unverified_context ()
-
-        # Connect to vCenter
-        service_instance = SmartConnect (
-            host=vcenter_server,
-            user=username,
-            pwd=password,
-            sslContext=context
-        )
-        print ( "Connected to vCenter." )
+        # Connect to vCenter, skipping the login when a cached session is still valid
+        service_instance = vcsession.connect ( profile, vcenter_server, username, password, timeout, reuse )
+        print ( f"Connected to vCenter {vcenter_server}." )
         return service_instance
     except vmodl.MethodFault as e:
         print ( f"Error connecting to vCenter: {e}" )
@@ -51,6 +53,8 @@ def disconnect_from_vcenter(service_instance):
     :param service_instance: The service instance to disconnect
     :return: None
     """
+    from pyVim.connect import Disconnect
+
     try:
         Disconnect ( service_instance )
         print ( "Disconnected from vCenter." )
@@ -58,82 +62,715 @@ def disconnect_from_vcenter(service_instance):
         print ( f"Error disconnecting from vCenter: {e}" )
 
 
-def _get_vms_with_tags(service_instance, json_output_file):
+def _check_deadline(deadline):
+    if deadline and time.monotonic () > deadline:
+        raise TimeoutError ( "Collection exceeded the per-vCenter timeout." )
+
+
+def _get_vms_with_tags(service_instance, vcenter_server, writer, properties=None, page_size=inventory.DEFAULT_PAGE_SIZE,
+                       tag_cache=None, tag_batch_size=tagging.DEFAULT_TAG_BATCH_SIZE, deadline=None):
     """
-    Retrieves VMs and their tags from vCenter and writes them to a JSON file.
+    Retrieves VMs and their tags from vCenter and streams them to an output writer.
+
+    VM properties are fetched in pages through the PropertyCollector rather than one round trip per VM,
+    the tags for each page are listed with one bulk request per batch of VMs, and each page is written
+    out as soon as it is complete.
 
     :param service_instance: The connected vCenter service instance
-    :param json_output_file: Name of the JSON output file
-    :return: None
+    :param vcenter_server: vCenter server address, recorded on every VM record
+    :param writer: output.InventoryWriter receiving the VM records
+    :param properties: List of VM property paths to collect (defaults to inventory.DEFAULT_VM_PROPERTIES)
+    :param page_size: Maximum number of VMs returned per PropertyCollector round trip
+    :param tag_cache: tagging.TagCache used to resolve tags (None skips tag collection)
+    :param tag_batch_size: Number of VMs sent per list-attached-tags-on-objects request
+    :param deadline: time.monotonic() value after which collection is abandoned (None for no limit)
+    :return: Number of VMs written
+    """
+    # The VM name is always collected so every record can be identified
+    properties = [ "name" ] + [ p for p in properties or [ ] if p != "name" ]
+
+    count = 0
+    for page in inventory.retrieve_pages ( service_instance, None, properties, page_size ):
+        _check_deadline ( deadline )
+        vm_tags = { }
+        if tag_cache:
+            try:
+                vm_tags = tag_cache.tags_for_vms ( [ record [ "moid" ] for record in page ], tag_batch_size )
+            except Exception as e:
+                print ( f"Error fetching tags for {len ( page )} VMs: {e}" )
+
+        for record in page:
+            record [ "vcenter" ] = vcenter_server
+            record [ "tags" ] = vm_tags.get ( record [ "moid" ], [ ] )
+        writer.write_records ( page )
+        count += len ( page )
+    return count
+
+
+def profile_file(profile, file_name):
+    """
+    Builds the path of a per-profile file under ~/.pgvm/.
+
+    :param profile: Profile name ("" for the default profile)
+    :param file_name: File name inside the profile directory
+    :return: Expanded file path
+    """
+    return os.path.join ( credman.profile_dir ( profile ), file_name )
+
+
+def open_tag_cache(creds, profile, ttl=tagging.DEFAULT_TAG_CACHE_TTL, reuse=False):
+    """
+    Opens a tagging REST session and wraps it in a tag/category cache for the profile.
+
+    :param creds: credman.Credentials for the profile
+    :param profile: Profile name, used to locate the on-disk tag cache and cached session
+    :param ttl: Seconds the on-disk tag cache stays valid (0 keeps it in memory only)
+    :param reuse: If True, reuse the profile's cached REST session when still valid and cache new logins
+    :return: tagging.TagCache, or None if tagging is unavailable
     """
+    vcenter_server = creds.vcenter_server
+    cached = vcsession.load_session ( profile ) if reuse else { }
+    session_id = cached.get ( "rest" ) if cached.get ( "vcenter" ) == vcenter_server else None
     try:
-        # Retrieve all VMs from vCenter
-        content = service_instance.RetrieveContent ()
-        container = content.viewManager.CreateContainerView ( content.rootFolder, [ vim.VirtualMachine ], True )
-        vms = container.view
+        session = tagging.open_rest_session ( vcenter_server, creds.vcenter_user, creds.vcenter_password,
+                                              session_id )
+    except Exception as e:
+        print ( f"Unable to retrieve tags. Ensure vCenter supports tagging (vSphere 6.5+): {e}" )
+        return None
+    if reuse and session.headers [ "vmware-api-session-id" ] != session_id:
+        vcsession.set_rest_session ( profile, vcenter_server, session.headers [ "vmware-api-session-id" ] )
+    return tagging.TagCache ( session, vcenter_server, profile_file ( profile, tag_cache_file ), ttl )
+
+
+def _sync_vms_with_tags(service_instance, vcenter_server, writer, previous_records, state_path, properties=None,
+                        page_size=inventory.DEFAULT_PAGE_SIZE, tag_cache=None, tag_batch_size=tagging.DEFAULT_TAG_BATCH_SIZE,
+                        deadline=None):
+    """
+    Patches the previous inventory snapshot of a vCenter with the VMs changed since the last run.
+
+    The previous run's PropertyCollector version is resumed with a zero-timeout WaitForUpdatesEx, so only
+    VMs created, modified or deleted since then are transferred. A full resync is done when there is no
+    state, the tracked properties changed, or vCenter rejects the recorded collector or version.
+
+    :param service_instance: The connected vCenter service instance
+    :param vcenter_server: vCenter server address
+    :param writer: output.InventoryWriter receiving the patched snapshot
+    :param previous_records: This vCenter's records from the previous snapshot (None if there is none)
+    :param state_path: Path of the per-profile sync state file
+    :param properties: List of VM property paths to collect (defaults to inventory.DEFAULT_VM_PROPERTIES)
+    :param page_size: Maximum number of VMs returned per PropertyCollector round trip
+    :param tag_cache: tagging.TagCache used to resolve tags (None skips tag collection)
+    :param tag_batch_size: Number of VMs sent per list-attached-tags-on-objects request
+    :param deadline: time.monotonic() value after which collection is abandoned (None for no limit)
+    :return: Number of VMs written
+    """
+    from pyVmomi import vmodl
 
-        # Fetch VM tags (requires vSphere 6.5+)
+    properties = [ "name" ] + [ p for p in properties or [ ] if p != "name" ]
+
+    state = sync.load_state ( state_path )
+    records = None
+    updates = None
+    if state and state.get ( "vcenter" ) == vcenter_server and state.get ( "properties" ) == properties \
+            and previous_records is not None:
         try:
-            tag_manager = content.tagging.Tag
-            category_manager = content.tagging.Category
-        except Exception:
-            print ( "Unable to retrieve tags. Ensure vCenter supports tagging (vSphere 6.5+)." )
-            tag_manager = None
-            category_manager = None
-
-        # Gather VM details
-        vm_list = [ ]
-        for vm in vms:
-            # VM Name
-            vm_info = {
-                "name": vm.name,
-                "tags": [ ]
-            }
-
-            # Get VM Tags
-            if tag_manager and category_manager:
-                try:
-                    tag_ids = tag_manager.ListAttachedTags ( vm )
-                    for tag_id in tag_ids:
-                        tag = tag_manager.Get ( tag_id )
-                        vm_info [ "tags" ].append ( tag.name )
-                except Exception as e:
-                    print ( f"Error fetching tags for VM '{vm.name}': {e}" )
-
-            vm_list.append ( vm_info )
-
-        # Write to JSON file
-        with open ( json_output_file, "w" ) as json_file:
-            json.dump ( vm_list, json_file, indent=4 )
-        print ( f"VM data saved to {json_output_file}." )
+            updates, state [ "version" ] = sync.resume_sync ( service_instance, state, page_size )
+            records = { record [ "moid" ]: record for record in previous_records }
+        except (vmodl.fault.ManagedObjectNotFound, vmodl.query.InvalidCollectorVersion) as e:
+            print ( f"Previous sync state for {vcenter_server} is no longer valid ({type ( e ).__name__}). Running a full resync." )
+            records = None
+
+    if records is None:
+        updates, state = sync.start_sync ( service_instance, vcenter_server, properties, page_size, previous_state=state )
+        records = { }
+    _check_deadline ( deadline )
+
+    changed, removed = sync.apply_updates ( records, updates )
+    print ( f"{vcenter_server}: {len ( changed )} VMs added or modified, {len ( removed )} removed." )
+
+    # Only VMs that changed need their tags looked up again
+    if tag_cache and changed:
+        try:
+            vm_tags = tag_cache.tags_for_vms ( changed, tag_batch_size )
+            for moid, tags in vm_tags.items ():
+                records [ moid ] [ "tags" ] = tags
+        except Exception as e:
+            print ( f"Error fetching tags for {len ( changed )} VMs: {e}" )
+    _check_deadline ( deadline )
+
+    for record in records.values ():
+        record [ "vcenter" ] = vcenter_server
+    writer.write_records ( records.values () )
+    sync.save_state ( state_path, state )
+    return len ( records )
+
+
+def collect_target(profile, writer, args, previous_records=None, inventory_store=None, spool=True):
+    """
+    Collects the VM inventory of one vCenter into a shared output writer.
+
+    With spool, the records are buffered per target and reach the writer only once the whole vCenter is
+    collected, so a failed or timed-out target leaves no partial inventory in a merged output. Without it
+    they are written as they arrive, for readers of a non-atomic output. The inventory index is only
+    updated once the vCenter is complete either way. Collection
+    runs in its own thread and is abandoned once --timeout expires, even inside a slow vCenter or tagging
+    call. Errors are caught and reported in the returned summary so one failing vCenter does not stop the others.
+
+    :param profile: Profile name used to load the vCenter credentials
+    :param writer: output.InventoryWriter shared by all targets
+    :param args: Parsed command-line arguments
+    :param previous_records: This vCenter's records from the previous snapshot, for incremental runs
+    :param inventory_store: store.InventoryStore to update once the vCenter is fully collected (None to skip)
+    :param spool: If True, hold the records back until the vCenter is fully collected
+    :return: Summary dictionary with profile, vcenter, status, vms, seconds and error
+    """
+    start = time.monotonic ()
+    deadline = start + args.timeout if args.timeout else None
+    summary = { "profile": profile or "default", "vcenter": None, "status": "failed", "vms": 0, "seconds": 0.0, "error": None }
+    # Shared with the collection thread; "done" is set under the lock once it has committed or failed
+    state = { "done": False, "abandoned": False, "vcenter": None, "vms": 0, "error": None }
+    lock = threading.Lock ()
+    buffer = output.TargetBuffer ( writer, args.page_size, spool )
+
+    def collect():
+        service_instance = None
+        tag_cache = None
+        batch = None
+        # Cached sessions are left logged in so the next run can skip the login
+        reuse = not args.no_session_cache
+        properties = store.store_properties ( args.properties ) if inventory_store else args.properties
+        try:
+            creds = credman.get_creds ( profile, scriptName )
+            vcenter_server = creds.vcenter_server
+            state [ "vcenter" ] = vcenter_server
+            service_instance = connect_to_vcenter ( creds, args.timeout, profile, reuse )
+            if not service_instance:
+                raise ConnectionError ( f"Unable to connect to {vcenter_server}." )
+            tag_cache = open_tag_cache ( creds, profile, args.tag_cache_ttl, reuse )
+            # Pages are staged in the store as they are buffered and only replace its copy once complete
+            batch = inventory_store.batch ( buffer, vcenter_server ) if inventory_store else None
+            target_writer = batch or buffer
+            if args.incremental:
+                count = _sync_vms_with_tags ( service_instance, vcenter_server, target_writer,
+                                              ( previous_records or { } ).get ( vcenter_server ),
+                                              profile_file ( profile, sync_state_file ), properties,
+                                              args.page_size, tag_cache, args.tag_batch_size, deadline )
+            else:
+                count = _get_vms_with_tags ( service_instance, vcenter_server, target_writer, properties,
+                                             args.page_size, tag_cache, args.tag_batch_size, deadline )
+            with lock:
+                if state [ "abandoned" ]:
+                    raise TimeoutError ( "Collection exceeded the per-vCenter timeout." )
+                if batch:
+                    batch.commit ()
+                    batch = None
+                buffer.commit ()
+                state.update ( done=True, vms=count )
+        except Exception as e:
+            with lock:
+                state.update ( done=True, error=f"{type ( e ).__name__}: {e}" )
+        finally:
+            buffer.discard ()
+            if batch:
+                batch.discard ()
+            if tag_cache:
+                tag_cache.save ()
+                tagging.close_rest_session ( tag_cache.session, tag_cache.vcenter_server, logout=not reuse )
+            if service_instance and not reuse:
+                disconnect_from_vcenter ( service_instance )
+
+    thread = threading.Thread ( target=collect, name=f"collect-{profile or 'default'}", daemon=True )
+    thread.start ()
+    thread.join ( max ( 0.0, deadline - time.monotonic () ) if deadline else None )
+    with lock:
+        if not state [ "done" ]:
+            # The thread stops at its next deadline check; nothing it collects from now on is written
+            state.update ( abandoned=True, error="TimeoutError: Collection exceeded the per-vCenter timeout." )
+            buffer.discard ()
+        summary.update ( vcenter=state [ "vcenter" ], vms=state [ "vms" ], error=state [ "error" ] )
+    if summary [ "error" ] is None:
+        summary [ "status" ] = "ok"
+    else:
+        summary [ "vms" ] = 0
+        # Keep the last known inventory of a failed vCenter in incremental snapshots
+        # VMs already written through an unspooled buffer are not repeated
+        if args.incremental and previous_records and summary [ "vcenter" ] in previous_records:
+            writer.write_records ( [ record for record in previous_records [ summary [ "vcenter" ] ]
+                                     if record.get ( "moid" ) not in buffer.written ] )
+    summary [ "seconds" ] = round ( time.monotonic () - start, 2 )
+    return summary
+
+
+def format_age(seconds):
+    """
+    :param seconds: Age in seconds
+    :return: The age rounded to seconds, minutes or hours, e.g. "12 min"
+    """
+    if seconds < 120:
+        return f"{int ( seconds )} s"
+    if seconds < 7200:
+        return f"{int ( seconds // 60 )} min"
+    return f"{seconds / 3600:.1f} h"
+
+
+def print_summary(summaries):
+    """
+    Prints a per-vCenter timing and error table.
+
+    :param summaries: List of summary dictionaries from collect_target
+    :return: None
+    """
+    print ( f"{'PROFILE':<20} {'VCENTER':<32} {'STATUS':<8} {'VMS':>7} {'SECONDS':>9}  ERROR" )
+    for summary in summaries:
+        print ( f"{summary [ 'profile' ]:<20} {summary [ 'vcenter' ] or '-':<32} {summary [ 'status' ]:<8} "
+                f"{summary [ 'vms' ]:>7} {summary [ 'seconds' ]:>9.2f}  {summary [ 'error' ] or ''}" )
 
-    except vmodl.MethodFault as e:
-        print ( f"Error retrieving VMs from vCenter: {e}" )
 
-def get_vms_with_tags(creds, json_file):
-    service_instance = connect_to_vcenter ( creds)
-    if service_instance:
+def get_vms_with_tags(profiles, args):
+    """
+    Collects the VM inventory of one or more vCenters concurrently into one merged output file.
+
+    Every record is tagged with its source vCenter. Targets run in a bounded thread pool, each with its own
+    connection, tagging session and timeout, so a failure only affects that vCenter.
+
+    :param profiles: List of profile names to collect from
+    :param args: Parsed command-line arguments
+    :return: List of summary dictionaries, one per profile
+    """
+    previous_records = None
+    atomic = not args.no_atomic
+    if args.incremental:
+        # Incremental runs read the previous snapshot back, so they always write through a temp file
+        atomic = True
+        previous_path = f"{args.output}.gz" if args.gzip and not args.output.endswith ( ".gz" ) else args.output
+        if os.path.exists ( previous_path ):
+            previous_records = { }
+            for record in output.read_records ( previous_path ):
+                previous_records.setdefault ( record.get ( "vcenter" ), [ ] ).append ( record )
+
+    summaries = [ ]
+    inventory_store = None if args.no_store else store.InventoryStore ( args.store )
+    try:
+        with output.InventoryWriter ( args.output, args.format, args.gzip, atomic ) as writer:
+            with ThreadPoolExecutor ( max_workers=max ( 1, min ( args.workers, len ( profiles ) ) ) ) as executor:
+                # Only a merged atomic file needs targets held back; otherwise records are written as they arrive
+                spool = atomic and len ( profiles ) > 1
+                futures = [ executor.submit ( collect_target, profile, writer, args, previous_records, inventory_store, spool )
+                            for profile in profiles ]
+                for future in as_completed ( futures ):
+                    summaries.append ( future.result () )
+    finally:
+        if inventory_store:
+            inventory_store.close ()
+    print ( f"{writer.count} VMs saved to {writer.path}." )
+    if inventory_store:
+        print ( f"Inventory index updated in {inventory_store.path}." )
+    return sorted ( summaries, key=lambda summary: summary [ "profile" ] )
+
+
+def power_target(profile, action, args, inventory_store=None):
+    """
+    Shuts down or powers on the tagged VMs of one vCenter, wave by wave.
+
+    With --from-index the targets are resolved from the inventory index, provided the vCenter was collected
+    within --max-age seconds, so only their live power state is read from vCenter; otherwise they are
+    selected from one batched retrieval per datacenter.
+    Every VM and task of the run is followed through a single PropertyCollector filter instead of polling
+    each task. A wave with failures stops the run for this vCenter unless --keep-going is given.
+
+    :param profile: Profile name used to load the vCenter credentials
+    :param action: "shutdown" or "poweron"
+    :param args: Parsed command-line arguments
+    :param inventory_store: store.InventoryStore to resolve targets from (None selects them live)
+    :return: Summary dictionary with profile, vcenter, status, vms, seconds, error and per-VM results
+    """
+    start = time.monotonic ()
+    summary = { "profile": profile or "default", "vcenter": None, "status": "failed", "vms": 0, "seconds": 0.0, "error": None,
+                "results": [ ] }
+    service_instance = None
+    tag_cache = None
+    tracker = None
+    reuse = not args.no_session_cache
+    try:
+        creds = credman.get_creds ( profile, scriptName )
+        summary [ "vcenter" ] = creds.vcenter_server
+        indexed = None
+        if inventory_store:
+            entry = next ( ( entry for entry in inventory_store.vcenters () if entry [ "vcenter" ] == creds.vcenter_server ), None )
+            if not entry:
+                raise LookupError ( f"{creds.vcenter_server} is not in {inventory_store.path}; collect it first or drop --from-index." )
+            age = time.time () - entry [ "collected" ]
+            if age > args.max_age:
+                raise LookupError ( f"{creds.vcenter_server} was collected {format_age ( age )} ago, more than --max-age "
+                                    f"{args.max_age}s; collect it again or drop --from-index." )
+            indexed = inventory_store.query ( [ creds.vcenter_server ], args.tag, args.name )
+            print ( f"{creds.vcenter_server}: {len ( indexed )} VMs resolved from {inventory_store.path} "
+                    f"(collected {format_age ( age )} ago)." )
+        service_instance = connect_to_vcenter ( creds, None, profile, reuse )
+        if not service_instance:
+            raise ConnectionError ( f"Unable to connect to {creds.vcenter_server}." )
+        if indexed is not None:
+            vms = power.refresh_vms ( service_instance, indexed, args.page_size )
+        else:
+            if args.tag or args.wave:
+                tag_cache = open_tag_cache ( creds, profile, args.tag_cache_ttl, reuse )
+            vms = power.select_vms ( service_instance, tag_cache, args.tag, args.name, args.page_size, with_tags=bool ( args.wave ) )
+        waves = power.plan_waves ( vms, args.wave, action )
+        summary [ "vms" ] = len ( vms )
+        for label, members in waves:
+            print ( f"{creds.vcenter_server}: wave '{label}' - {len ( members )} VMs: "
+                    f"{', '.join ( sorted ( record [ 'name' ] for record in members ) )}" )
+        if args.test:
+            print ( f"Test mode: no VMs were {'shut down' if action == 'shutdown' else 'powered on'}." )
+            summary [ "status" ] = "ok"
+            return summary
+
+        tracker = power.PowerTracker ( service_instance, [ record [ "moid" ] for record in vms ] )
+        for label, members in waves:
+            if action == "shutdown":
+                results = power.shutdown_wave ( service_instance, tracker, members, args.concurrency, args.guest_timeout,
+                                                args.power_timeout, not args.no_escalate )
+            else:
+                results = power.poweron_wave ( service_instance, tracker, members, args.concurrency, args.power_timeout )
+            summary [ "results" ] += results
+            failed = [ result for result in results if result [ "status" ] == "failed" ]
+            print ( f"{creds.vcenter_server}: wave '{label}' done, {len ( results ) - len ( failed )} ok, {len ( failed )} failed." )
+            if failed and not args.keep_going:
+                raise RuntimeError ( f"{len ( failed )} VMs failed in wave '{label}'; later waves were not started." )
+        if any ( result [ "status" ] == "failed" for result in summary [ "results" ] ):
+            raise RuntimeError ( "Some VMs failed." )
+        summary [ "status" ] = "ok"
+    except Exception as e:
+        summary [ "error" ] = f"{type ( e ).__name__}: {e}"
+    finally:
+        if tracker:
+            tracker.close ()
+        if tag_cache:
+            tag_cache.save ()
+            tagging.close_rest_session ( tag_cache.session, tag_cache.vcenter_server, logout=not reuse )
+        if service_instance and not reuse:
+            disconnect_from_vcenter ( service_instance )
+        summary [ "seconds" ] = round ( time.monotonic () - start, 2 )
+    return summary
+
+
+def power_main(action, argv):
+    """
+    Parses the shutdown/poweron arguments and runs the action against every requested profile.
+
+    :param action: "shutdown" or "poweron"
+    :param argv: Command-line arguments following the action
+    """
+    parser = argparse.ArgumentParser ( prog=f"{os.path.basename ( sys.argv [ 0 ] )} {action}",
+                                       description=f"Bulk {action} of VMs selected by tag and/or name." )
+    parser.add_argument ( "--profile", type=str, nargs="+",
+                          help="One or more profiles to use for vCenter credentials (defaults to ~/.pgvm/cred.json)." )
+    parser.add_argument ( "--all-profiles", action="store_true", help="Run against every profile under ~/.pgvm/." )
+    parser.add_argument ( "--workers", type=int, default=DEFAULT_WORKERS, help="Number of vCenters handled in parallel." )
+    parser.add_argument ( "--tag", type=str, nargs="+", help="Select VMs carrying any of these tags ('Category:Tag' or 'Tag')." )
+    parser.add_argument ( "--name", type=str, nargs="+", help="Select VMs whose name matches any of these patterns (e.g. 'web-*')." )
+    parser.add_argument ( "--wave", type=str, nargs="+",
+                          help="Tags defining the shutdown order, e.g. 'Tier:app' 'Tier:db'; power-on runs them in reverse." )
+    parser.add_argument ( "--concurrency", type=int, default=power.DEFAULT_CONCURRENCY,
+                          help="Maximum number of VMs in flight per vCenter." )
+    parser.add_argument ( "--guest-timeout", type=int, default=power.DEFAULT_GUEST_TIMEOUT,
+                          help="Seconds a guest shutdown may take before the VM is powered off." )
+    parser.add_argument ( "--power-timeout", type=int, default=power.DEFAULT_POWER_TIMEOUT,
+                          help="Seconds a power-off or power-on may take before the VM is reported as failed." )
+    parser.add_argument ( "--no-escalate", action="store_true",
+                          help="Report guests that do not shut down in time as failed instead of powering them off." )
+    parser.add_argument ( "--keep-going", action="store_true", help="Start the next wave even if VMs failed in the previous one." )
+    parser.add_argument ( "--test", action="store_true", help="Print the selected VMs and waves without changing anything." )
+    parser.add_argument ( "--page-size", type=int, default=inventory.DEFAULT_PAGE_SIZE,
+                          help="Number of VMs retrieved per PropertyCollector round trip." )
+    parser.add_argument ( "--tag-cache-ttl", type=int, default=tagging.DEFAULT_TAG_CACHE_TTL,
+                          help="Seconds the per-profile tag/category cache stays valid (0 disables the on-disk cache)." )
+    parser.add_argument ( "--from-index", action="store_true",
+                          help="Resolve the VMs from the inventory index instead of selecting them from vCenter." )
+    parser.add_argument ( "--store", type=str, default=store.DEFAULT_STORE_FILE,
+                          help=f"Inventory index used with --from-index (defaults to {store.DEFAULT_STORE_FILE})." )
+    parser.add_argument ( "--max-age", type=int, default=DEFAULT_INDEX_MAX_AGE,
+                          help=f"Seconds since collection after which --from-index rejects a vCenter's index "
+                               f"(defaults to {DEFAULT_INDEX_MAX_AGE})." )
+    parser.add_argument ( "--report", type=str, help="Write the per-VM results to this JSON file." )
+    parser.add_argument ( "--no-session-cache", action="store_true",
+                          help="Log in from scratch and log out at the end instead of reusing the cached session." )
+    timings.add_arguments ( parser )
+    args = parser.parse_args ( argv )
+    if not ( args.tag or args.name ):
+        parser.error ( "Select the VMs with --tag and/or --name." )
+    args.concurrency = max ( 1, args.concurrency )
+
+    with timings.run ( f"manageVMs {action}", args ):
+        profiles = credman.list_profiles () if args.all_profiles else args.profile or [ "" ]
+        if not profiles:
+            print ( f"No profiles found under {credman.CRED_PATH}." )
+            sys.exit ( 1 )
+
+        summaries = [ ]
+        inventory_store = None
+        if args.from_index:
+            if not os.path.exists ( args.store ):
+                print ( f"No inventory index at {args.store}; run a collection first or drop --from-index." )
+                sys.exit ( 1 )
+            inventory_store = store.InventoryStore ( args.store )
         try:
-            # Fetch VM details and save them to a JSON file
-            _get_vms_with_tags ( service_instance, json_file )
+            with ThreadPoolExecutor ( max_workers=max ( 1, min ( args.workers, len ( profiles ) ) ) ) as executor:
+                futures = [ executor.submit ( power_target, profile, action, args, inventory_store ) for profile in profiles ]
+                for future in as_completed ( futures ):
+                    summaries.append ( future.result () )
         finally:
-            # Disconnect from vCenter
+            if inventory_store:
+                inventory_store.close ()
+        summaries.sort ( key=lambda summary: summary [ "profile" ] )
+
+        print_summary ( summaries )
+        for summary in summaries:
+            for result in summary [ "results" ]:
+                if result [ "status" ] == "failed":
+                    print ( f"  {summary [ 'profile' ]}: {result [ 'name' ]} ({result [ 'moid' ]}): {result [ 'error' ]}" )
+        if args.report:
+            with open ( args.report, "w" ) as report_file:
+                json.dump ( summaries, report_file, indent=4 )
+        if any ( summary [ "status" ] != "ok" for summary in summaries ):
+            sys.exit ( 1 )
+
+
+def stats_target(profile, writer, args):
+    """
+    Collects recent performance samples of the powered-on VMs of one vCenter into a shared output writer.
+
+    :param profile: Profile name used to load the vCenter credentials
+    :param writer: output.InventoryWriter shared by all targets
+    :param args: Parsed command-line arguments
+    :return: Summary dictionary with profile, vcenter, status, vms, seconds, error and ranked (average, VM name) tuples
+    """
+    start = time.monotonic ()
+    deadline = start + args.timeout if args.timeout else None
+    summary = { "profile": profile or "default", "vcenter": None, "status": "failed", "vms": 0, "seconds": 0.0, "error": None,
+                "ranked": [ ] }
+    service_instance = None
+    reuse = not args.no_session_cache
+    try:
+        creds = credman.get_creds ( profile, scriptName )
+        summary [ "vcenter" ] = creds.vcenter_server
+        service_instance = connect_to_vcenter ( creds, args.timeout, profile, reuse )
+        if not service_instance:
+            raise ConnectionError ( f"Unable to connect to {creds.vcenter_server}." )
+        summary [ "vms" ], missing, summary [ "ranked" ] = perf.collect_stats (
+            service_instance, creds.vcenter_server, writer, args.metrics, args.samples, args.batch_size, args.query_workers,
+            args.page_size, args.name, args.top_metric if args.top else None, deadline )
+        if missing:
+            print ( f"{creds.vcenter_server} has no counters for {', '.join ( missing )}; they were skipped." )
+        summary [ "status" ] = "ok"
+    except Exception as e:
+        summary [ "error" ] = f"{type ( e ).__name__}: {e}"
+    finally:
+        if service_instance and not reuse:
             disconnect_from_vcenter ( service_instance )
+        summary [ "seconds" ] = round ( time.monotonic () - start, 2 )
+    return summary
+
+
+def stats_main(argv):
+    """
+    Collects recent CPU, memory, disk and network samples of every powered-on VM through the PerformanceManager.
+
+    :param argv: Command-line arguments following "stats"
+    """
+    parser = argparse.ArgumentParser ( prog=f"{os.path.basename ( sys.argv [ 0 ] )} stats",
+                                       description="Collect recent VM performance samples from one or more vCenters." )
+    parser.add_argument ( "--profile", type=str, nargs="+",
+                          help="One or more profiles to use for vCenter credentials (defaults to ~/.pgvm/cred.json)." )
+    parser.add_argument ( "--all-profiles", action="store_true", help="Collect from every profile under ~/.pgvm/." )
+    parser.add_argument ( "--workers", type=int, default=DEFAULT_WORKERS, help="Number of vCenters collected in parallel." )
+    parser.add_argument ( "--timeout", type=int, default=DEFAULT_TARGET_TIMEOUT,
+                          help="Seconds allowed per vCenter before it is reported as failed (0 for no limit)." )
+    parser.add_argument ( "--metrics", type=str, nargs="+", default=perf.DEFAULT_METRICS,
+                          help="Counters to collect as group.counter.rollup (defaults to CPU usage and ready, memory, disk and network usage)." )
+    parser.add_argument ( "--samples", type=int, default=perf.DEFAULT_SAMPLES,
+                          help=f"Most recent {perf.REALTIME_INTERVAL}-second realtime samples per VM." )
+    parser.add_argument ( "--name", type=str, nargs="+", help="Only VMs whose name matches any of these patterns (e.g. 'web-*')." )
+    parser.add_argument ( "--batch-size", type=int, default=perf.DEFAULT_QUERY_BATCH_SIZE, help="VMs per QueryPerf call." )
+    parser.add_argument ( "--query-workers", type=int, default=perf.DEFAULT_QUERY_WORKERS,
+                          help="QueryPerf calls in flight at once per vCenter." )
+    parser.add_argument ( "--page-size", type=int, default=inventory.DEFAULT_PAGE_SIZE,
+                          help="Number of VMs retrieved per PropertyCollector round trip." )
+    parser.add_argument ( "--output", type=str, default=stats_output_file, help=f"Samples output file (defaults to {stats_output_file})." )
+    parser.add_argument ( "--format", type=str, choices=output.OUTPUT_FORMATS, default="ndjson",
+                          help="Write newline-delimited JSON (one VM per line) or a JSON array." )
+    parser.add_argument ( "--gzip", action="store_true", help="Gzip the output file." )
+    parser.add_argument ( "--top", type=int, default=0, help="Print the VMs with the highest average of --top-metric." )
+    parser.add_argument ( "--top-metric", type=str, default=perf.DEFAULT_METRICS [ 0 ], help="Metric ranked by --top." )
+    parser.add_argument ( "--no-session-cache", action="store_true",
+                          help="Log in from scratch and log out at the end instead of reusing the cached session." )
+    timings.add_arguments ( parser )
+    args = parser.parse_args ( argv )
+    if args.top and args.top_metric not in args.metrics:
+        parser.error ( f"--top-metric {args.top_metric} is not one of the collected --metrics." )
+    args.batch_size = max ( 1, args.batch_size )
+
+    with timings.run ( "manageVMs stats", args ):
+        profiles = credman.list_profiles () if args.all_profiles else args.profile or [ "" ]
+        if not profiles:
+            print ( f"No profiles found under {credman.CRED_PATH}." )
+            sys.exit ( 1 )
+
+        summaries = [ ]
+        with output.InventoryWriter ( args.output, args.format, args.gzip ) as writer:
+            with ThreadPoolExecutor ( max_workers=max ( 1, min ( args.workers, len ( profiles ) ) ) ) as executor:
+                futures = [ executor.submit ( stats_target, profile, writer, args ) for profile in profiles ]
+                for future in as_completed ( futures ):
+                    summaries.append ( future.result () )
+        summaries.sort ( key=lambda summary: summary [ "profile" ] )
+        print ( f"Samples of {writer.count} VMs saved to {writer.path}." )
+
+        print_summary ( summaries )
+        slow = [ summary [ "vcenter" ] for summary in summaries if summary [ "seconds" ] > perf.REALTIME_INTERVAL ]
+        if slow:
+            print ( f"Collection took longer than one {perf.REALTIME_INTERVAL}-second sample interval for {', '.join ( slow )}; "
+                    f"consider a larger --batch-size or more --query-workers." )
+        if args.top:
+            ranked = sorted ( ( entry for summary in summaries for entry in summary [ "ranked" ] ), reverse=True ) [ :args.top ]
+            print ( f"Top {len ( ranked )} VMs by {args.top_metric}:" )
+            for average, name in ranked:
+                print ( f"  {average:>12.1f}  {name}" )
+        if any ( summary [ "status" ] != "ok" for summary in summaries ):
+            sys.exit ( 1 )
 
 
-def main():
+def query_main(argv):
+    """
+    Answers VM filters from the inventory index, without connecting to vCenter.
+
+    :param argv: Command-line arguments following "query"
+    """
+    parser = argparse.ArgumentParser ( prog=f"{os.path.basename ( sys.argv [ 0 ] )} query",
+                                       description="Query the local inventory index written by VM collection runs." )
+    parser.add_argument ( "--store", type=str, default=store.DEFAULT_STORE_FILE,
+                          help=f"Inventory index to query (defaults to {store.DEFAULT_STORE_FILE})." )
+    parser.add_argument ( "--vcenter", type=str, nargs="+", help="Only VMs of these vCenters." )
+    parser.add_argument ( "--tag", type=str, nargs="+", help="VMs carrying any of these tags ('Category:Tag' or 'Tag')." )
+    parser.add_argument ( "--name", type=str, nargs="+", help="VMs whose name matches any of these patterns (e.g. 'web-*')." )
+    parser.add_argument ( "--power-state", type=str, nargs="+", choices=( "poweredOn", "poweredOff", "suspended" ),
+                          help="VMs in any of these power states." )
+    parser.add_argument ( "--limit", type=int, help="Return at most this many VMs." )
+    parser.add_argument ( "--format", type=str, choices=( "table", ) + output.OUTPUT_FORMATS, default="table",
+                          help="Print a table, a JSON array or one JSON document per VM." )
+    parser.add_argument ( "--count", action="store_true", help="Only print the number of matching VMs." )
+    parser.add_argument ( "--vcenters", action="store_true", help="List the indexed vCenters and when they were collected." )
+    args = parser.parse_args ( argv )
+
+    if not os.path.exists ( args.store ):
+        print ( f"No inventory index at {args.store}. Collect the VMs first." )
+        sys.exit ( 1 )
+    with store.InventoryStore ( args.store ) as inventory_store:
+        if args.vcenters:
+            print ( f"{'VCENTER':<32} {'VMS':>7}  COLLECTED" )
+            for entry in inventory_store.vcenters ():
+                print ( f"{entry [ 'vcenter' ]:<32} {entry [ 'vms' ]:>7}  "
+                        f"{time.strftime ( '%Y-%m-%d %H:%M:%S', time.localtime ( entry [ 'collected' ] ) )}" )
+            return
+        if args.count:
+            print ( inventory_store.count ( args.vcenter, args.tag, args.name, args.power_state ) )
+            return
+        records = inventory_store.query ( args.vcenter, args.tag, args.name, args.power_state, args.limit )
+
+    if args.format == "json":
+        print ( json.dumps ( records, indent=4 ) )
+    elif args.format == "ndjson":
+        for record in records:
+            print ( json.dumps ( record ) )
+    else:
+        print ( f"{'NAME':<40} {'VCENTER':<32} {'POWER':<11}  TAGS" )
+        for record in records:
+            tags = ", ".join ( f"{tag [ 'category' ]}:{tag [ 'name' ]}" for tag in record.get ( "tags" ) or [ ] )
+            print ( f"{record.get ( 'name' ) or record [ 'moid' ]:<40} {record.get ( 'vcenter' ) or '-':<32} "
+                    f"{record.get ( 'runtime.powerState' ) or '-':<11}  {tags}" )
+        print ( f"{len ( records )} VMs." )
+
+
+def main(argv=None):
     """
     Main function to parse arguments and execute tasks.
-    Supports getVMs, shutdownVMs, and combined mode.
+    Collects the VM inventory by default; "shutdown" and "poweron" as the first argument
+    run a bulk power operation instead (see power_main), "query" searches the local
+    inventory index (see query_main) and "stats" collects performance samples (see stats_main).
+
+    :param argv: Command-line arguments (defaults to sys.argv[1:])
     """
+    argv = sys.argv [ 1: ] if argv is None else list ( argv )
+    if argv and argv [ 0 ] in power.ACTIONS:
+        return power_main ( argv [ 0 ], argv [ 1: ] )
+    if argv and argv [ 0 ] == "query":
+        return query_main ( argv [ 1: ] )
+    if argv and argv [ 0 ] == "stats":
+        return stats_main ( argv [ 1: ] )
+
     parser = argparse.ArgumentParser ( description="VMWare vSphere VM management script." )
-    parser.add_argument ( "--profile", type=str, help="Profile to use for vCenter credentials (defaults to ~/.pgvm/cred.json)." )
+    parser.add_argument ( "--profile", type=str, nargs="+",
+                          help="One or more profiles to use for vCenter credentials (defaults to ~/.pgvm/cred.json)." )
+    parser.add_argument ( "--all-profiles", action="store_true", help="Collect from every profile under ~/.pgvm/." )
+    parser.add_argument ( "--workers", type=int, default=DEFAULT_WORKERS, help="Number of vCenters collected in parallel." )
+    parser.add_argument ( "--timeout", type=int, default=DEFAULT_TARGET_TIMEOUT,
+                          help="Seconds allowed per vCenter before it is reported as failed (0 for no limit)." )
+    parser.add_argument ( "--properties", type=str, nargs="+", default=None,
+                          help="VM property paths to collect (defaults to 'name'), e.g. runtime.powerState config.uuid." )
+    parser.add_argument ( "--page-size", type=int, default=inventory.DEFAULT_PAGE_SIZE,
+                          help="Number of VMs retrieved per PropertyCollector round trip." )
+    parser.add_argument ( "--tag-batch-size", type=int, default=tagging.DEFAULT_TAG_BATCH_SIZE,
+                          help="Number of VMs sent per bulk tag lookup." )
+    parser.add_argument ( "--tag-cache-ttl", type=int, default=tagging.DEFAULT_TAG_CACHE_TTL,
+                          help="Seconds the per-profile tag/category cache stays valid (0 disables the on-disk cache)." )
+    parser.add_argument ( "--output", type=str, default=json_output_file, help=f"Inventory output file (defaults to {json_output_file})." )
+    parser.add_argument ( "--format", type=str, choices=output.OUTPUT_FORMATS, default="json",
+                          help="Write a JSON array or newline-delimited JSON (one VM per line)." )
+    parser.add_argument ( "--gzip", action="store_true", help="Gzip the output file." )
+    parser.add_argument ( "--no-atomic", action="store_true",
+                          help="Write directly to the output file so it can be read while collection runs." )
+    parser.add_argument ( "--incremental", action="store_true",
+                          help="Patch the existing output with only the VMs changed since the last run." )
+    parser.add_argument ( "--summary", type=str, help="Write the per-vCenter timing and error summary to this JSON file." )
+    parser.add_argument ( "--store", type=str, default=store.DEFAULT_STORE_FILE,
+                          help=f"SQLite inventory index updated by each collected vCenter (defaults to {store.DEFAULT_STORE_FILE})." )
+    parser.add_argument ( "--no-store", action="store_true", help="Do not update the inventory index." )
+    parser.add_argument ( "--no-session-cache", action="store_true",
+                          help="Log in from scratch and log out at the end instead of reusing the cached session." )
+    parser.add_argument ( "--logout", action="store_true", help="End and remove the cached vCenter sessions for the profiles, then exit." )
+
+    timings.add_arguments ( parser )
+    args = parser.parse_args ( argv )
+    with timings.run ( "manageVMs", args ):
+        return run ( args )
+
+
+def run(args):
+    """
+    Collects the VMs of the requested profiles, or logs out their cached sessions.
+
+    :param args: Parsed command-line arguments
+    """
+    profiles = credman.list_profiles () if args.all_profiles else args.profile or [ "" ]
+    if not profiles:
+        print ( f"No profiles found under {credman.CRED_PATH}." )
+        sys.exit ( 1 )
+
+    if args.logout:
+        for profile in profiles:
+            if vcsession.logout ( profile ):
+                print ( f"Logged out cached session for profile '{profile or 'default'}'." )
+            else:
+                print ( f"No cached session for profile '{profile or 'default'}'." )
+        return
 
+    summaries = get_vms_with_tags ( profiles, args )
+    print_summary ( summaries )
+    if args.summary:
+        with open ( args.summary, "w" ) as summary_file:
+            json.dump ( summaries, summary_file, indent=4 )
+    if any ( summary [ "status" ] != "ok" for summary in summaries ):
+        sys.exit ( 1 )
 
-    args = parser.parse_args ()
-    profile = args.profile or ""
-    creds = credman.get_creds ( profile, scriptName )
-    get_vms_with_tags(creds, json_output_file)
 
 if __name__ == "__main__":
-    main ()
\ No newline at end of file
+    main ()
@@ -0,0 +1,217 @@
+import gzip
+import json
+import os
+import tempfile
+import threading
+from scripts import timings
+
+# Supported output formats: a single JSON array, or one JSON document per line
+OUTPUT_FORMATS = ( "json", "ndjson" )
+
+
+def read_records(path):
+    """
+    Reads back an inventory file written by InventoryWriter.
+
+    The format is detected from the content, and files ending in ".gz" are decompressed.
+
+    :param path: Inventory file path
+    :return: List of dict records
+    """
+    opener = gzip.open if path.endswith ( ".gz" ) else open
+    with opener ( path, "rt", encoding="utf-8" ) as inventory_file:
+        text = inventory_file.read ()
+    if text.lstrip ().startswith ( "[" ):
+        return json.loads ( text )
+    return [ json.loads ( line ) for line in text.splitlines () if line.strip () ]
+
+
+class InventoryWriter:
+    """
+    Streams inventory records to a JSON array or NDJSON file as they are collected.
+
+    Records are written and flushed page by page, so memory use stays flat regardless of inventory size.
+    In atomic mode the data goes to a temporary file in the same directory which replaces the target only
+    once the writer is closed cleanly; otherwise records are written straight to the target so downstream
+    tools can start reading it while collection is still running.
+    """
+
+    def __init__(self, path, fmt="json", compress=False, atomic=True):
+        """
+        :param path: Output file path (".gz" is appended when compressing)
+        :param fmt: Output format, "json" or "ndjson"
+        :param compress: If True, gzip the output
+        :param atomic: If True, write through a temp file and rename it into place on close
+        """
+        if fmt not in OUTPUT_FORMATS:
+            raise ValueError ( f"Unsupported output format '{fmt}'. Expected one of {', '.join ( OUTPUT_FORMATS )}." )
+        if compress and not path.endswith ( ".gz" ):
+            path = f"{path}.gz"
+        self.path = path
+        self.fmt = fmt
+        self.compress = compress
+        self.atomic = atomic
+        self.count = 0
+        self._file = None
+        self._write_path = None
+        self._lock = threading.Lock ()
+
+    def open(self):
+        directory = os.path.dirname ( self.path ) or "."
+        os.makedirs ( directory, exist_ok=True )
+        if self.atomic:
+            fd, self._write_path = tempfile.mkstemp ( prefix=f".{os.path.basename ( self.path )}.", dir=directory )
+            raw = os.fdopen ( fd, "wb" )
+        else:
+            self._write_path = self.path
+            raw = open ( self.path, "wb" )
+        self._file = gzip.GzipFile ( fileobj=raw, mode="wb" ) if self.compress else raw
+        self._raw = raw
+        if self.fmt == "json":
+            self._write ( "[" )
+        return self
+
+    def _write(self, text):
+        self._file.write ( text.encode ( "utf-8" ) )
+
+    @timings.timed ( "serialize" )
+    def write_records(self, records):
+        """
+        Appends a page of records and flushes it to disk.
+
+        Safe to call from several threads; each page is written as one contiguous block.
+
+        :param records: Iterable of JSON-serialisable dicts
+        :return: None
+        """
+        self.write_encoded ( [ json.dumps ( record, default=str ) for record in records ] )
+
+    def write_encoded(self, lines):
+        """
+        Appends a page of records already encoded as JSON, one document per string, and flushes it to disk.
+
+        :param lines: List of JSON documents
+        :return: None
+        """
+        with self._lock:
+            for line in lines:
+                if self.fmt == "ndjson":
+                    self._write ( f"{line}\n" )
+                else:
+                    self._write ( f"{',' if self.count else ''}\n    {line}" )
+                self.count += 1
+            self._file.flush ()
+
+    def close(self):
+        """
+        Finishes the document and, in atomic mode, moves it into place.
+
+        :return: None
+        """
+        if self.fmt == "json":
+            self._write ( "\n]\n" )
+        self._file.close ()
+        self._raw.close ()
+        if self.atomic:
+            os.replace ( self._write_path, self.path )
+
+    def abort(self):
+        """
+        Closes the writer after a failure, discarding the temp file in atomic mode.
+
+        :return: None
+        """
+        self._file.close ()
+        self._raw.close ()
+        if self.atomic and os.path.exists ( self._write_path ):
+            os.remove ( self._write_path )
+
+    def __enter__(self):
+        return self.open ()
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close ()
+        else:
+            self.abort ()
+        return False
+
+
+class TargetBuffer:
+    """
+    Holds one target's records until the target completes, in front of a shared InventoryWriter.
+
+    Records are spooled to an anonymous temp file as they are collected and only copied to the shared
+    writer by commit(), so a target that fails or times out part-way leaves nothing in the output.
+    Memory use stays flat regardless of the target's size.
+
+    Without spooling the records go straight to the shared writer, so readers of a non-atomic output see
+    them as they arrive; the moids written are remembered so a failed target's fallback can skip them.
+    Once committed or discarded, the buffer refuses further records in either mode.
+    """
+
+    def __init__(self, writer, page_size=1000, spool=True):
+        """
+        :param writer: Shared InventoryWriter the records go to
+        :param page_size: Number of records copied to the writer per write on commit
+        :param spool: If False, write through to the writer instead of holding the records back
+        """
+        self.writer = writer
+        self.page_size = page_size
+        self.spool = spool
+        self.count = 0
+        self.written = set ()
+        self._closed = False
+        self._lock = threading.Lock ()
+        self._file = tempfile.TemporaryFile ( mode="w+", encoding="utf-8" ) if spool else None
+
+    def write_records(self, records):
+        records = list ( records )
+        with self._lock:
+            if self._closed:
+                raise RuntimeError ( "The target's records were already committed or discarded." )
+            if not self.spool:
+                self.writer.write_records ( records )
+                self.written.update ( record [ "moid" ] for record in records )
+                self.count += len ( records )
+                return
+            with timings.span ( "serialize" ):
+                for record in records:
+                    self._file.write ( json.dumps ( record, default=str ) )
+                    self._file.write ( "\n" )
+                    self.count += 1
+
+    def commit(self):
+        """
+        Copies the spooled records to the shared writer and releases the temp file.
+
+        :return: Number of records of the target
+        """
+        with self._lock:
+            if self.spool:
+                self._file.seek ( 0 )
+                page = [ ]
+                for line in self._file:
+                    page.append ( line.rstrip ( "\n" ) )
+                    if len ( page ) >= self.page_size:
+                        self.writer.write_encoded ( page )
+                        page = [ ]
+                if page:
+                    self.writer.write_encoded ( page )
+            self._close ()
+        return self.count
+
+    def discard(self):
+        """
+        Drops the spooled records; without spooling, only stops further writes.
+
+        :return: None
+        """
+        with self._lock:
+            self._close ()
+
+    def _close(self):
+        self._closed = True
+        if self._file is not None:
+            self._file.close ()
+            self._file = None
@@ -0,0 +1,206 @@
+import time
+from array import array
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from scripts import timings
+from scripts.manageVMs import inventory, power
+
+# Counters collected unless others are requested, as "group.counter.rollup".
+# CPU and memory usage are in hundredths of a percent, cpu.ready in milliseconds per sample, disk and net in KBps.
+DEFAULT_METRICS = [ "cpu.usage.average", "cpu.ready.summation", "mem.usage.average", "disk.usage.average", "net.usage.average" ]
+# vCenter keeps realtime samples every 20 seconds for about an hour
+REALTIME_INTERVAL = 20
+# Realtime samples returned per VM (3 covers the last minute)
+DEFAULT_SAMPLES = 3
+# PerfQuerySpecs sent per QueryPerf call
+DEFAULT_QUERY_BATCH_SIZE = 250
+# QueryPerf calls in flight at once per vCenter
+DEFAULT_QUERY_WORKERS = 8
+
+
+def resolve_counters(perf_manager, metrics):
+    """
+    Looks up the counter IDs of the requested metrics with a single read of PerformanceManager.perfCounter.
+
+    :param perf_manager: vim.PerformanceManager of the vCenter
+    :param metrics: Metric names as "group.counter.rollup", e.g. "cpu.usage.average"
+    :return: Tuple of (dict mapping counter ID to metric name, list of metric names the vCenter does not have)
+    """
+    with timings.span ( "counters" ):
+        available = { f"{counter.groupInfo.key}.{counter.nameInfo.key}.{counter.rollupType}": counter.key
+                      for counter in perf_manager.perfCounter }
+    counters = { available [ metric ]: metric for metric in metrics if metric in available }
+    return counters, [ metric for metric in metrics if metric not in available ]
+
+
+class VmSeries:
+    """
+    Samples of one VM, one typed array per metric sharing a single array of timestamps.
+    """
+    __slots__ = ( "moid", "timestamps", "values" )
+
+    def __init__(self, moid):
+        self.moid = moid
+        self.timestamps = array ( "q" )
+        self.values = { }
+
+    def summary(self, metric):
+        """
+        :param metric: Metric name
+        :return: Dict with avg, max and last over the valid samples (vCenter reports gaps as -1), or None
+        """
+        samples = [ value for value in self.values.get ( metric, ( ) ) if value >= 0 ]
+        if not samples:
+            return None
+        return { "avg": round ( sum ( samples ) / len ( samples ), 1 ), "max": max ( samples ), "last": samples [ -1 ] }
+
+    def to_record(self, name, vcenter):
+        """
+        :return: JSON-ready record with moid, name, vcenter, interval, timestamps, per-metric samples and summaries
+        """
+        return {
+            "moid": self.moid,
+            "name": name,
+            "vcenter": vcenter,
+            "interval": REALTIME_INTERVAL,
+            "timestamps": self.timestamps.tolist (),
+            "metrics": { metric: values.tolist () for metric, values in self.values.items () },
+            "summary": { metric: self.summary ( metric ) for metric in self.values }
+        }
+
+
+def build_specs(service_instance, moids, counter_ids, samples=DEFAULT_SAMPLES):
+    """
+    Builds one PerfQuerySpec per VM for the aggregate ("" instance) of every counter.
+
+    :param service_instance: The connected vCenter service instance
+    :param moids: Managed object IDs of the VMs
+    :param counter_ids: Counter IDs to query
+    :param samples: Number of most recent realtime samples to return
+    :return: List of vim.PerformanceManager.QuerySpec
+    """
+    from pyVmomi import vim
+
+    metric_ids = [ vim.PerformanceManager.MetricId ( counterId=counter_id, instance="" ) for counter_id in counter_ids ]
+    return [ vim.PerformanceManager.QuerySpec ( entity=vim.VirtualMachine ( moid, service_instance._stub ), metricId=metric_ids,
+                                                intervalId=REALTIME_INTERVAL, maxSample=samples, format="normal" )
+             for moid in moids ]
+
+
+def query_batch(perf_manager, specs, counters):
+    """
+    Sends a batch of PerfQuerySpecs in one QueryPerf call and converts the answer to VmSeries.
+
+    A VM that disappeared since the inventory was read fails the whole call, so it is dropped and the rest
+    of the batch is asked again. Any other fault splits the batch in halves until the failing VM is
+    isolated and skipped.
+
+    :param perf_manager: vim.PerformanceManager of the vCenter
+    :param specs: PerfQuerySpecs built by build_specs
+    :param counters: Dict mapping counter ID to metric name
+    :return: List of VmSeries, one per VM that returned samples
+    """
+    from pyVmomi import vmodl
+
+    specs = list ( specs )
+    while specs:
+        try:
+            with timings.span ( "perf" ):
+                entity_metrics = perf_manager.QueryPerf ( querySpec=specs ) or [ ]
+            break
+        except vmodl.fault.ManagedObjectNotFound as e:
+            missing = getattr ( e.obj, "_moId", None )
+            remaining = [ spec for spec in specs if spec.entity._moId != missing ]
+            if len ( remaining ) == len ( specs ):
+                return _split_batch ( perf_manager, specs, counters, e )
+            specs = remaining
+        except vmodl.MethodFault as e:
+            return _split_batch ( perf_manager, specs, counters, e )
+    else:
+        return [ ]
+    result = [ ]
+    for entity_metric in entity_metrics:
+        series = VmSeries ( entity_metric.entity._moId )
+        series.timestamps.extend ( int ( info.timestamp.timestamp () ) for info in entity_metric.sampleInfo or [ ] )
+        for metric_series in entity_metric.value or [ ]:
+            metric = counters.get ( metric_series.id.counterId )
+            if metric:
+                series.values [ metric ] = array ( "q", metric_series.value or [ ] )
+        result.append ( series )
+    return result
+
+
+def _split_batch(perf_manager, specs, counters, fault):
+    if len ( specs ) == 1:
+        print ( f"Skipping the samples of {specs [ 0 ].entity._moId}: {getattr ( fault, 'msg', None ) or type ( fault ).__name__}" )
+        return [ ]
+    middle = len ( specs ) // 2
+    return query_batch ( perf_manager, specs [ :middle ], counters ) + query_batch ( perf_manager, specs [ middle: ], counters )
+
+
+def collect_stats(service_instance, vcenter_server, writer, metrics=None, samples=DEFAULT_SAMPLES, batch_size=DEFAULT_QUERY_BATCH_SIZE,
+                  workers=DEFAULT_QUERY_WORKERS, page_size=inventory.DEFAULT_PAGE_SIZE, names=None, rank_by=None, deadline=None):
+    """
+    Collects recent realtime performance samples of every powered-on VM and streams them to an output writer.
+
+    Counter IDs are resolved once, then each inventory page is turned into PerfQuerySpecs that are sent
+    batch_size at a time to QueryPerf from a pool of workers while the next page is retrieved. Finished
+    batches are written as they arrive, and at most two batches per worker are held in memory.
+
+    :param service_instance: The connected vCenter service instance
+    :param vcenter_server: vCenter server address, recorded on every record
+    :param writer: output.InventoryWriter receiving one record per VM
+    :param metrics: Metric names as "group.counter.rollup" (defaults to DEFAULT_METRICS)
+    :param samples: Number of most recent realtime samples per VM
+    :param batch_size: PerfQuerySpecs per QueryPerf call
+    :param workers: QueryPerf calls in flight at once
+    :param page_size: Maximum number of VMs returned per PropertyCollector round trip
+    :param names: fnmatch name patterns selecting the VMs (None for all)
+    :param rank_by: Metric whose average is returned per VM for ranking (None to skip)
+    :param deadline: time.monotonic() value after which collection is abandoned (None for no limit)
+    :return: Tuple of (number of VMs written, list of metrics the vCenter does not have,
+             list of (average, VM name) tuples for rank_by)
+    """
+    from pyVmomi import vim
+
+    perf_manager = service_instance.RetrieveContent ().perfManager
+    counters, missing = resolve_counters ( perf_manager, metrics or DEFAULT_METRICS )
+    if not counters:
+        raise RuntimeError ( f"None of the requested metrics exist on {vcenter_server}: {', '.join ( missing )}." )
+
+    vm_names = { }
+    ranked = [ ]
+    written = 0
+    pending = set ()
+
+    def drain(futures):
+        nonlocal written
+        for future in futures:
+            pending.discard ( future )
+            records = [ series.to_record ( vm_names.pop ( series.moid, None ), vcenter_server ) for series in future.result () ]
+            if rank_by:
+                ranked.extend ( ( record [ "summary" ] [ rank_by ] [ "avg" ], record [ "name" ] ) for record in records
+                                if record [ "summary" ].get ( rank_by ) )
+            writer.write_records ( records )
+            written += len ( records )
+
+    with ThreadPoolExecutor ( max_workers=max ( 1, workers ) ) as executor:
+        for page in inventory.retrieve_pages ( service_instance, vim.VirtualMachine, [ "name", "runtime.powerState" ], page_size ):
+            # Only running VMs have realtime samples
+            running = [ record for record in page if record.get ( "runtime.powerState" ) == "poweredOn"
+                        and power.name_matches ( record.get ( "name", "" ), names ) ]
+            for record in running:
+                vm_names [ record [ "moid" ] ] = record.get ( "name" )
+            moids = [ record [ "moid" ] for record in running ]
+            for start in range ( 0, len ( moids ), batch_size ):
+                if deadline and time.monotonic () > deadline:
+                    raise TimeoutError ( "Collection exceeded the per-vCenter timeout." )
+                specs = build_specs ( service_instance, moids [ start:start + batch_size ], list ( counters ), samples )
+                pending.add ( executor.submit ( query_batch, perf_manager, specs, counters ) )
+                while len ( pending ) >= 2 * max ( 1, workers ):
+                    done, _ = wait ( pending, return_when=FIRST_COMPLETED )
+                    drain ( done )
+            drain ( [ future for future in list ( pending ) if future.done () ] )
+        while pending:
+            done, _ = wait ( pending, return_when=FIRST_COMPLETED )
+            drain ( done )
+    return written, missing, ranked
@@ -0,0 +1,383 @@
+import fnmatch
+import time
+from scripts import timings
+from scripts.manageVMs import inventory
+
+ACTIONS = ( "shutdown", "poweron" )
+# VM properties needed to select targets and choose between a guest shutdown and a hard power-off
+SELECT_PROPERTIES = [ "name", "runtime.powerState", "guest.toolsRunningStatus" ]
+# Operations in flight at once per vCenter
+DEFAULT_CONCURRENCY = 20
+# Seconds a guest OS gets to shut down before it is powered off
+DEFAULT_GUEST_TIMEOUT = 300
+# Seconds a power-off or power-on may take before the VM is reported as failed
+DEFAULT_POWER_TIMEOUT = 600
+# Longest single WaitForUpdatesEx call; it returns early as soon as something changes
+WAIT_SECONDS = 5
+
+
+def _tag_matches(selector, tag):
+    """
+    Matches a "Category:Tag" or bare "Tag" selector against a {"name", "category"} tag.
+    """
+    if ":" in selector:
+        category, name = selector.split ( ":", 1 )
+        return tag [ "category" ] == category and tag [ "name" ] == name
+    return tag [ "name" ] == selector
+
+
+def has_tag(record, selectors):
+    """
+    :param record: VM record with a "tags" list
+    :param selectors: "Category:Tag" or "Tag" selectors
+    :return: True if the VM carries a tag matching any selector
+    """
+    return any ( _tag_matches ( selector, tag ) for selector in selectors for tag in record.get ( "tags", [ ] ) )
+
+
+def name_matches(name, patterns):
+    """
+    :param name: VM name
+    :param patterns: fnmatch patterns (e.g. "web-*"); None or empty matches every name
+    :return: True if the name matches any pattern
+    """
+    return not patterns or any ( fnmatch.fnmatchcase ( name, pattern ) for pattern in patterns )
+
+
+def select_vms(service_instance, tag_cache=None, tags=None, names=None, page_size=inventory.DEFAULT_PAGE_SIZE, with_tags=False):
+    """
+    Selects VMs by tag and/or name pattern from one batched PropertyCollector retrieval per datacenter.
+
+    Names are filtered first, so tags are only looked up for VMs that can still match.
+
+    :param service_instance: The connected vCenter service instance
+    :param tag_cache: tagging.TagCache used to resolve tags (required when tags or with_tags is set)
+    :param tags: "Category:Tag" or "Tag" selectors; a VM must carry at least one (None selects by name only)
+    :param names: fnmatch name patterns; a VM must match at least one (None selects by tag only)
+    :param page_size: Maximum number of VMs returned per PropertyCollector round trip
+    :param with_tags: If True, look up tags even when not selecting by tag (e.g. to order waves)
+    :return: List of VM records with moid, datacenter, name, power state, tools status and tags
+    """
+    from pyVmomi import vim
+
+    if ( tags or with_tags ) and not tag_cache:
+        raise RuntimeError ( "Tags are needed to select or order VMs, but the tagging service is unavailable." )
+
+    selected = [ ]
+    for datacenter in inventory.retrieve_all ( service_instance, vim.Datacenter, [ "name" ] ):
+        container = vim.Datacenter ( datacenter [ "moid" ], service_instance._stub )
+        for page in inventory.retrieve_pages ( service_instance, vim.VirtualMachine, SELECT_PROPERTIES, page_size, container ):
+            page = [ record for record in page if name_matches ( record.get ( "name", "" ), names ) ]
+            vm_tags = { }
+            if page and ( tags or with_tags ):
+                vm_tags = tag_cache.tags_for_vms ( [ record [ "moid" ] for record in page ] )
+            for record in page:
+                record [ "datacenter" ] = datacenter [ "moid" ]
+                record [ "tags" ] = vm_tags.get ( record [ "moid" ], [ ] )
+                if not tags or has_tag ( record, tags ):
+                    selected.append ( record )
+    return selected
+
+
+def refresh_vms(service_instance, records, page_size=inventory.DEFAULT_PAGE_SIZE):
+    """
+    Reads the live power and tools state of VMs resolved from the inventory store.
+
+    Only the given VMs and their ancestors are retrieved, page_size per round trip, to read their state
+    and datacenter; no tags are looked up and the tags recorded in the store are kept.
+
+    :param service_instance: The connected vCenter service instance
+    :param records: VM records from store.InventoryStore.query
+    :return: List of VM records with their datacenter for the VMs that still exist
+    """
+    from pyVmomi import vim
+
+    live = { record [ "moid" ]: record for record in
+             inventory.retrieve_objects ( service_instance, vim.VirtualMachine, [ record [ "moid" ] for record in records ],
+                                          SELECT_PROPERTIES, page_size, with_datacenter=True ) }
+    refreshed = [ ]
+    for record in records:
+        if record [ "moid" ] not in live:
+            print ( f"{record.get ( 'name' )} ({record [ 'moid' ]}) no longer exists; skipping it." )
+            continue
+        refreshed.append ( dict ( record, **live [ record [ "moid" ] ] ) )
+    return refreshed
+
+
+def plan_waves(vms, waves=None, action="shutdown"):
+    """
+    Splits the selected VMs into ordered waves by tag.
+
+    Each VM joins the first wave whose selector it matches; VMs matching none form a last wave.
+    Waves are given in shutdown order (e.g. apps before databases) and run in reverse for power-on.
+
+    :param vms: Selected VM records
+    :param waves: Ordered "Category:Tag" or "Tag" selectors (None runs everything as one wave)
+    :param action: "shutdown" or "poweron"
+    :return: List of (label, VM records) tuples in execution order, without empty waves
+    """
+    waves = waves or [ ]
+    planned = [ ( selector, [ ] ) for selector in waves ] + [ ( "*", [ ] ) ]
+    for record in vms:
+        for selector, members in planned:
+            if selector == "*" or has_tag ( record, [ selector ] ):
+                members.append ( record )
+                break
+    planned = [ wave for wave in planned if wave [ 1 ] ]
+    return list ( reversed ( planned ) ) if action == "poweron" else planned
+
+
+class PowerTracker:
+    """
+    Follows VM power states and power task states through a single PropertyCollector filter.
+
+    The filter watches runtime.powerState of every target VM and, through TaskManager.recentTask,
+    the state of every task, so one WaitForUpdatesEx loop replaces polling each task.
+    """
+
+    def __init__(self, service_instance, moids):
+        """
+        :param service_instance: The connected vCenter service instance
+        :param moids: Managed object IDs of the VMs to watch
+        """
+        from pyVmomi import vim, vmodl
+
+        self.service_instance = service_instance
+        self.power = { }
+        self.tasks = { }
+        self.version = ""
+        collector_type = vmodl.query.PropertyCollector
+        content = service_instance.RetrieveContent ()
+        object_set = [ collector_type.ObjectSpec ( obj=vim.VirtualMachine ( moid, service_instance._stub ), skip=False )
+                       for moid in moids ]
+        object_set.append ( collector_type.ObjectSpec (
+            obj=content.taskManager,
+            skip=True,
+            selectSet=[ collector_type.TraversalSpec ( name="recentTasks", type=vim.TaskManager, path="recentTask", skip=False ) ]
+        ) )
+        filter_spec = collector_type.FilterSpec (
+            objectSet=object_set,
+            propSet=[
+                collector_type.PropertySpec ( type=vim.VirtualMachine, pathSet=[ "runtime.powerState" ], all=False ),
+                collector_type.PropertySpec ( type=vim.Task, pathSet=[ "info.state", "info.error", "info.result" ], all=False )
+            ]
+        )
+        self.collector = content.propertyCollector.CreatePropertyCollector ()
+        self.collector.CreateFilter ( filter_spec, partialUpdates=True )
+        self.wait ( 0 )
+
+    def wait(self, seconds=WAIT_SECONDS):
+        """
+        Applies pending updates, waiting up to the given time for the first one.
+
+        :param seconds: Maximum seconds to wait (0 returns immediately)
+        :return: None
+        """
+        from pyVmomi import vim, vmodl
+
+        options = vmodl.query.PropertyCollector.WaitOptions ( maxWaitSeconds=int ( seconds ) )
+        while True:
+            with timings.span ( "wait" ):
+                result = self.collector.WaitForUpdatesEx ( self.version, options )
+            if result is None:
+                return
+            self.version = result.version
+            for filter_update in result.filterSet or [ ]:
+                for object_update in filter_update.objectSet or [ ]:
+                    moid = object_update.obj._moId
+                    changes = { change.name: change.val for change in object_update.changeSet or [ ] }
+                    if isinstance ( object_update.obj, vim.VirtualMachine ):
+                        if "runtime.powerState" in changes:
+                            self.power [ moid ] = changes [ "runtime.powerState" ]
+                    elif object_update.kind != "leave":
+                        self.tasks.setdefault ( moid, { } ).update ( changes )
+            if not result.truncated:
+                return
+            # The rest of a truncated update set is already waiting
+            options.maxWaitSeconds = 0
+
+    def task(self, task_moid):
+        """
+        :param task_moid: Managed object ID of a task
+        :return: Dict with the task's info.state, info.error and info.result seen so far
+        """
+        return self.tasks.get ( task_moid, { } )
+
+    def close(self):
+        try:
+            self.collector.DestroyPropertyCollector ()
+        except Exception:
+            pass
+
+
+def _fault_message(fault):
+    return getattr ( fault, "msg", None ) or getattr ( fault, "localizedMessage", None ) or str ( fault )
+
+
+def vm_result(record, action, status, mode=None, seconds=0.0, error=None):
+    return {
+        "name": record.get ( "name" ),
+        "moid": record [ "moid" ],
+        "action": action,
+        "status": status,
+        "mode": mode,
+        "seconds": round ( seconds, 2 ),
+        "error": error
+    }
+
+
+def shutdown_wave(service_instance, tracker, vms, concurrency=DEFAULT_CONCURRENCY, guest_timeout=DEFAULT_GUEST_TIMEOUT,
+                  power_timeout=DEFAULT_POWER_TIMEOUT, escalate=True):
+    """
+    Shuts down a wave of VMs with at most `concurrency` operations in flight.
+
+    VMs with running VMware Tools get a guest shutdown; the rest, and guests still running after
+    guest_timeout, are powered off with PowerOffVM_Task unless escalation is disabled.
+
+    :param service_instance: The connected vCenter service instance
+    :param tracker: PowerTracker watching the VMs
+    :param vms: VM records of the wave
+    :param concurrency: Maximum number of VMs being shut down at once
+    :param guest_timeout: Seconds allowed for a guest shutdown before escalating
+    :param power_timeout: Seconds allowed for a power-off task
+    :param escalate: If False, a guest that does not stop in time is reported as failed
+    :return: List of per-VM result dictionaries
+    """
+    from pyVmomi import vim
+
+    results = [ ]
+    pending = [ ]
+    for record in vms:
+        if tracker.power.get ( record [ "moid" ], record.get ( "runtime.powerState" ) ) == "poweredOff":
+            results.append ( vm_result ( record, "shutdown", "skipped", error="Already powered off." ) )
+        else:
+            pending.append ( record )
+
+    in_flight = { }
+
+    def power_off(record, mode, started):
+        task = vim.VirtualMachine ( record [ "moid" ], service_instance._stub ).PowerOffVM_Task ()
+        in_flight [ record [ "moid" ] ] = { "record": record, "mode": mode, "task": task._moId, "since": time.monotonic (),
+                                            "started": started }
+
+    while pending or in_flight:
+        while pending and len ( in_flight ) < concurrency:
+            record = pending.pop ( 0 )
+            now = time.monotonic ()
+            try:
+                if record.get ( "guest.toolsRunningStatus" ) == "guestToolsRunning":
+                    vim.VirtualMachine ( record [ "moid" ], service_instance._stub ).ShutdownGuest ()
+                    in_flight [ record [ "moid" ] ] = { "record": record, "mode": "guest", "task": None, "since": now, "started": now }
+                elif escalate:
+                    power_off ( record, "poweroff", now )
+                else:
+                    results.append ( vm_result ( record, "shutdown", "failed", error="VMware Tools not running." ) )
+            except Exception as e:
+                error = f"{type ( e ).__name__}: {_fault_message ( e )}"
+                if escalate:
+                    try:
+                        power_off ( record, "escalated", now )
+                        continue
+                    except Exception as power_error:
+                        error = f"{type ( power_error ).__name__}: {_fault_message ( power_error )}"
+                results.append ( vm_result ( record, "shutdown", "failed", error=error ) )
+
+        tracker.wait ()
+        now = time.monotonic ()
+        for moid, op in list ( in_flight.items () ):
+            record = op [ "record" ]
+            task = tracker.task ( op [ "task" ] ) if op [ "task" ] else { }
+            error = None
+            if tracker.power.get ( moid ) == "poweredOff":
+                results.append ( vm_result ( record, "shutdown", "ok", op [ "mode" ], now - op [ "started" ] ) )
+            elif task.get ( "info.state" ) == "error":
+                error = _fault_message ( task.get ( "info.error" ) )
+            elif op [ "mode" ] == "guest" and now - op [ "since" ] > guest_timeout:
+                if not escalate:
+                    error = f"Guest did not shut down within {guest_timeout}s."
+                else:
+                    try:
+                        power_off ( record, "escalated", op [ "started" ] )
+                    except Exception as e:
+                        error = f"{type ( e ).__name__}: {_fault_message ( e )}"
+                    else:
+                        continue
+            elif op [ "mode" ] != "guest" and now - op [ "since" ] > power_timeout:
+                error = f"Power-off did not complete within {power_timeout}s."
+            else:
+                continue
+            if error:
+                results.append ( vm_result ( record, "shutdown", "failed", op [ "mode" ], now - op [ "started" ], error ) )
+            del in_flight [ moid ]
+    return results
+
+
+def poweron_wave(service_instance, tracker, vms, concurrency=DEFAULT_CONCURRENCY, power_timeout=DEFAULT_POWER_TIMEOUT):
+    """
+    Powers on a wave of VMs with PowerOnMultiVM_Task, one task per datacenter and batch.
+    VMs whose datacenter is not known are powered on with PowerOnVM_Task.
+
+    :param service_instance: The connected vCenter service instance
+    :param tracker: PowerTracker watching the VMs
+    :param vms: VM records of the wave
+    :param concurrency: Maximum number of VMs being powered on at once
+    :param power_timeout: Seconds allowed for a VM to reach poweredOn
+    :return: List of per-VM result dictionaries
+    """
+    from pyVmomi import vim
+
+    results = [ ]
+    pending = [ ]
+    for record in vms:
+        if tracker.power.get ( record [ "moid" ], record.get ( "runtime.powerState" ) ) == "poweredOn":
+            results.append ( vm_result ( record, "poweron", "skipped", error="Already powered on." ) )
+        else:
+            pending.append ( record )
+
+    in_flight = { }
+    while pending or in_flight:
+        if pending and len ( in_flight ) < concurrency:
+            batch = pending [ :concurrency - len ( in_flight ) ]
+            pending = pending [ len ( batch ): ]
+            by_datacenter = { }
+            for record in batch:
+                by_datacenter.setdefault ( record.get ( "datacenter" ), [ ] ).append ( record )
+            # VMs whose datacenter could not be resolved are powered on one task each
+            groups = [ ( datacenter, records ) for datacenter, records in by_datacenter.items () if datacenter ]
+            groups += [ ( None, [ record ] ) for record in by_datacenter.get ( None, [ ] ) ]
+            for datacenter, records in groups:
+                now = time.monotonic ()
+                try:
+                    if datacenter:
+                        task = vim.Datacenter ( datacenter, service_instance._stub ).PowerOnMultiVM_Task (
+                            vm=[ vim.VirtualMachine ( record [ "moid" ], service_instance._stub ) for record in records ] )
+                    else:
+                        task = vim.VirtualMachine ( records [ 0 ] [ "moid" ], service_instance._stub ).PowerOnVM_Task ()
+                except Exception as e:
+                    results += [ vm_result ( record, "poweron", "failed", "poweron", 0.0, f"{type ( e ).__name__}: {_fault_message ( e )}" )
+                                 for record in records ]
+                    continue
+                for record in records:
+                    in_flight [ record [ "moid" ] ] = { "record": record, "task": task._moId, "started": now }
+
+        tracker.wait ()
+        now = time.monotonic ()
+        for moid, op in list ( in_flight.items () ):
+            record = op [ "record" ]
+            task = tracker.task ( op [ "task" ] )
+            not_attempted = { info.vm._moId: info.fault for info in getattr ( task.get ( "info.result" ), "notAttempted", None ) or [ ] }
+            error = None
+            if tracker.power.get ( moid ) == "poweredOn":
+                results.append ( vm_result ( record, "poweron", "ok", "poweron", now - op [ "started" ] ) )
+            elif moid in not_attempted:
+                error = _fault_message ( not_attempted [ moid ] )
+            elif task.get ( "info.state" ) == "error":
+                error = _fault_message ( task.get ( "info.error" ) )
+            elif now - op [ "started" ] > power_timeout:
+                error = f"Power-on did not complete within {power_timeout}s."
+            else:
+                continue
+            if error:
+                results.append ( vm_result ( record, "poweron", "failed", "poweron", now - op [ "started" ], error ) )
+            del in_flight [ moid ]
+    return results
@@ -0,0 +1,260 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from scripts import timings
+
+DEFAULT_STORE_FILE = "./json/inventory.db"
+# Properties the store indexes on top of the ones requested for the output file
+STORE_PROPERTIES = [ "runtime.powerState" ]
+SCHEMA_VERSION = 2
+
+# vms holds the current records of every indexed vCenter, vm_tags is the tag -> VM inverted index.
+# Collection runs stage their pages in the staged_* tables and swap them in with one short transaction.
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS vcenters (
+    vcenter TEXT PRIMARY KEY,
+    collected REAL NOT NULL,
+    vms INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS vms (
+    vcenter TEXT NOT NULL,
+    moid TEXT NOT NULL,
+    name TEXT,
+    power_state TEXT,
+    record TEXT NOT NULL,
+    PRIMARY KEY ( vcenter, moid )
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS vms_name ON vms ( name );
+CREATE INDEX IF NOT EXISTS vms_power_state ON vms ( power_state );
+CREATE TABLE IF NOT EXISTS vm_tags (
+    tag TEXT NOT NULL,
+    category TEXT NOT NULL,
+    vcenter TEXT NOT NULL,
+    moid TEXT NOT NULL,
+    PRIMARY KEY ( tag, category, vcenter, moid )
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS vm_tags_vm ON vm_tags ( vcenter, moid );
+CREATE TABLE IF NOT EXISTS staged_vms (
+    run TEXT NOT NULL,
+    moid TEXT NOT NULL,
+    name TEXT,
+    power_state TEXT,
+    record TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS staged_vms_run ON staged_vms ( run );
+CREATE TABLE IF NOT EXISTS staged_tags (
+    run TEXT NOT NULL,
+    moid TEXT NOT NULL,
+    tag TEXT NOT NULL,
+    category TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS staged_tags_run ON staged_tags ( run );
+"""
+
+
+def store_properties(properties):
+    """
+    :param properties: VM property paths requested for the output file (None for the default)
+    :return: The same paths plus the ones the store indexes
+    """
+    properties = list ( properties or [ "name" ] )
+    return properties + [ p for p in STORE_PROPERTIES if p not in properties ]
+
+
+def _glob(pattern):
+    # fnmatch negates a set with "[!...]", SQLite GLOB with "[^...]"
+    return pattern.replace ( "[!", "[^" )
+
+
+class InventoryStore:
+    """
+    SQLite inventory database holding the last collected VMs of every vCenter.
+
+    VMs are keyed by vCenter and moid and indexed by name and power state, and every attached tag
+    has a row in an inverted index, so tag and name filters are answered locally in milliseconds.
+    A vCenter's rows are only replaced once its collection run completes, so a failed run keeps the
+    last known inventory.
+    """
+
+    def __init__(self, path=DEFAULT_STORE_FILE):
+        """
+        :param path: Database file (created with its directory when missing)
+        """
+        self.path = path
+        os.makedirs ( os.path.dirname ( path ) or ".", exist_ok=True )
+        # One connection shared by the collection threads; the lock serializes its use
+        self._conn = sqlite3.connect ( path, timeout=30, check_same_thread=False )
+        self._lock = threading.Lock ()
+        with self._lock:
+            # WAL lets queries read while a collection run writes
+            self._conn.execute ( "PRAGMA journal_mode=WAL" )
+            self._conn.execute ( "PRAGMA synchronous=NORMAL" )
+            version = self._conn.execute ( "PRAGMA user_version" ).fetchone () [ 0 ]
+            if version not in ( 0, SCHEMA_VERSION ):
+                # The index only caches collected inventory, so an older layout is dropped and refilled by the next collection
+                with self._conn:
+                    for table in ( "vcenters", "vms", "vm_tags", "staged_vms", "staged_tags" ):
+                        self._conn.execute ( f"DROP TABLE IF EXISTS {table}" )
+            self._conn.executescript ( SCHEMA )
+            self._conn.execute ( f"PRAGMA user_version={SCHEMA_VERSION}" )
+
+    def close(self):
+        with self._lock:
+            self._conn.close ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close ()
+
+    def batch(self, writer, vcenter):
+        """
+        Starts a collection run for one vCenter.
+
+        :param writer: output.InventoryWriter the records are also written to
+        :param vcenter: vCenter server address
+        :return: StoreBatch usable in place of the writer
+        """
+        return StoreBatch ( self, writer, vcenter )
+
+    def stage(self, run, records):
+        """
+        Adds a page of records to a collection run without touching the indexed inventory.
+
+        :param run: Run ID from StoreBatch
+        :param records: VM records with moid, name, runtime.powerState and tags
+        """
+        vm_rows = [ ]
+        tag_rows = [ ]
+        for record in records:
+            vm_rows.append ( ( run, record [ "moid" ], record.get ( "name" ), record.get ( "runtime.powerState" ),
+                               json.dumps ( record, default=str ) ) )
+            tag_rows += [ ( run, record [ "moid" ], tag [ "name" ], tag [ "category" ] ) for tag in record.get ( "tags" ) or [ ] ]
+        with self._lock, self._conn:
+            self._conn.executemany ( "INSERT INTO staged_vms VALUES ( ?, ?, ?, ?, ? )", vm_rows )
+            self._conn.executemany ( "INSERT INTO staged_tags VALUES ( ?, ?, ?, ? )", tag_rows )
+
+    def commit(self, run, vcenter):
+        """
+        Replaces a vCenter's indexed inventory with the records staged by a run, in one transaction.
+
+        :param run: Run ID from StoreBatch
+        :param vcenter: vCenter server address
+        :return: Number of VMs now indexed for the vCenter
+        """
+        with timings.span ( "store" ), self._lock, self._conn:
+            self._conn.execute ( "DELETE FROM vms WHERE vcenter = ?", ( vcenter, ) )
+            self._conn.execute ( "DELETE FROM vm_tags WHERE vcenter = ?", ( vcenter, ) )
+            count = self._conn.execute (
+                "INSERT OR REPLACE INTO vms SELECT ?, moid, name, power_state, record FROM staged_vms WHERE run = ?",
+                ( vcenter, run ) ).rowcount
+            self._conn.execute ( "INSERT OR IGNORE INTO vm_tags SELECT tag, category, ?, moid FROM staged_tags WHERE run = ?",
+                                 ( vcenter, run ) )
+            self._conn.execute ( "INSERT OR REPLACE INTO vcenters VALUES ( ?, ?, ? )", ( vcenter, time.time (), count ) )
+            self._discard ( run )
+        return count
+
+    def discard(self, run):
+        """
+        Drops the records staged by a run, leaving the indexed inventory as it was.
+
+        :param run: Run ID from StoreBatch
+        """
+        with self._lock, self._conn:
+            self._discard ( run )
+
+    def _discard(self, run):
+        self._conn.execute ( "DELETE FROM staged_vms WHERE run = ?", ( run, ) )
+        self._conn.execute ( "DELETE FROM staged_tags WHERE run = ?", ( run, ) )
+
+    def vcenters(self):
+        """
+        :return: List of dicts with vcenter, collected (epoch seconds) and vms, one per indexed vCenter
+        """
+        with self._lock:
+            rows = self._conn.execute ( "SELECT vcenter, collected, vms FROM vcenters ORDER BY vcenter" ).fetchall ()
+        return [ { "vcenter": vcenter, "collected": collected, "vms": vms } for vcenter, collected, vms in rows ]
+
+    def _where(self, vcenters=None, tags=None, names=None, power_states=None):
+        clauses = [ ]
+        params = [ ]
+        if vcenters:
+            clauses.append ( f"vcenter IN ( {', '.join ( '?' * len ( vcenters ) )} )" )
+            params += vcenters
+        if power_states:
+            clauses.append ( f"power_state IN ( {', '.join ( '?' * len ( power_states ) )} )" )
+            params += power_states
+        if names:
+            clauses.append ( "( " + " OR ".join ( "name GLOB ?" for _ in names ) + " )" )
+            params += [ _glob ( pattern ) for pattern in names ]
+        if tags:
+            # Driven from the inverted index: only VMs carrying a matching tag are looked up
+            lookups = [ ]
+            for selector in tags:
+                if ":" in selector:
+                    category, name = selector.split ( ":", 1 )
+                    lookups.append ( "SELECT vcenter, moid FROM vm_tags WHERE tag = ? AND category = ?" )
+                    params += [ name, category ]
+                else:
+                    lookups.append ( "SELECT vcenter, moid FROM vm_tags WHERE tag = ?" )
+                    params.append ( selector )
+            clauses.append ( f"( vcenter, moid ) IN ( {' UNION '.join ( lookups )} )" )
+        return ( " WHERE " + " AND ".join ( clauses ) if clauses else "" ), params
+
+    def query(self, vcenters=None, tags=None, names=None, power_states=None, limit=None):
+        """
+        Selects indexed VMs. Every given filter must match; within a filter any value may match.
+
+        :param vcenters: vCenter server addresses (None for all)
+        :param tags: "Category:Tag" or "Tag" selectors
+        :param names: fnmatch name patterns (e.g. "web-*")
+        :param power_states: Power states, e.g. "poweredOn"
+        :param limit: Maximum number of records (None for no limit)
+        :return: List of VM records as collected, ordered by vCenter and name
+        """
+        where, params = self._where ( vcenters, tags, names, power_states )
+        sql = f"SELECT record FROM vms{where} ORDER BY vcenter, name"
+        if limit:
+            sql += " LIMIT ?"
+            params.append ( limit )
+        with self._lock:
+            rows = self._conn.execute ( sql, params ).fetchall ()
+        return [ json.loads ( row [ 0 ] ) for row in rows ]
+
+    def count(self, vcenters=None, tags=None, names=None, power_states=None):
+        """
+        :return: Number of indexed VMs matching the filters (see query)
+        """
+        where, params = self._where ( vcenters, tags, names, power_states )
+        with self._lock:
+            return self._conn.execute ( f"SELECT COUNT(*) FROM vms{where}", params ).fetchone () [ 0 ]
+
+
+class StoreBatch:
+    """
+    Writer wrapper for one vCenter's collection run.
+
+    Pages go to the output writer and are staged in the store; commit() swaps them in as the vCenter's
+    inventory and discard() drops them, so the indexed inventory is never left half written.
+    """
+
+    def __init__(self, store, writer, vcenter):
+        self.store = store
+        self.writer = writer
+        self.vcenter = vcenter
+        self.run = uuid.uuid4 ().hex
+
+    def write_records(self, records):
+        records = list ( records )
+        self.writer.write_records ( records )
+        self.store.stage ( self.run, records )
+
+    def commit(self):
+        return self.store.commit ( self.run, self.vcenter )
+
+    def discard(self):
+        self.store.discard ( self.run )
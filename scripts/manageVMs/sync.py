@@ -0,0 +1,166 @@
+import json
+import os
+from scripts import timings
+from scripts.manageVMs import inventory
+
+
+def load_state(state_path):
+    """
+    Loads the incremental sync state for a profile.
+
+    :param state_path: Path of the state file
+    :return: State dictionary, or None if there is no usable state
+    """
+    if not os.path.exists ( state_path ):
+        return None
+    try:
+        with open ( state_path, "r" ) as state_file:
+            return json.load ( state_file )
+    except (OSError, ValueError) as e:
+        print ( f"Ignoring unreadable sync state {state_path}: {e}" )
+        return None
+
+
+def save_state(state_path, state):
+    """
+    Saves the incremental sync state for a profile.
+
+    :param state_path: Path of the state file
+    :param state: State dictionary (vcenter, collector, version, properties)
+    :return: None
+    """
+    os.makedirs ( os.path.dirname ( state_path ), exist_ok=True )
+    tmp_path = f"{state_path}.tmp"
+    with open ( tmp_path, "w" ) as state_file:
+        json.dump ( state, state_file, indent=4 )
+    os.replace ( tmp_path, state_path )
+
+
+def _collect_updates(collector, version, page_size):
+    """
+    Drains all pending updates from a property collector without waiting.
+
+    :param collector: PropertyCollector holding the VM filter
+    :param version: Collector version to resume from ("" for the initial full set)
+    :param page_size: Maximum number of object updates returned per round trip
+    :return: Tuple of (list of ObjectUpdate, new version)
+    """
+    from pyVmomi import vmodl
+
+    options = vmodl.query.PropertyCollector.WaitOptions ( maxWaitSeconds=0, maxObjectUpdates=page_size )
+    updates = [ ]
+    while True:
+        with timings.span ( "retrieve" ):
+            result = collector.WaitForUpdatesEx ( version, options )
+        if result is None:
+            break
+        version = result.version
+        for filter_update in result.filterSet or [ ]:
+            updates.extend ( filter_update.objectSet or [ ] )
+        if not result.truncated:
+            break
+    return updates, version
+
+
+def stop_sync(service_instance, state):
+    """
+    Destroys the property collector and container view left in place by a previous start_sync.
+
+    Objects that are already gone (e.g. with the session that created them) are skipped.
+
+    :param service_instance: The connected vCenter service instance
+    :param state: State dictionary saved by a previous run
+    :return: None
+    """
+    from pyVmomi import vim, vmodl
+
+    if state.get ( "collector" ):
+        try:
+            vmodl.query.PropertyCollector ( state [ "collector" ], service_instance._stub ).DestroyPropertyCollector ()
+        except vmodl.fault.ManagedObjectNotFound:
+            pass
+    if state.get ( "view" ):
+        try:
+            vim.view.ContainerView ( state [ "view" ], service_instance._stub ).DestroyView ()
+        except vmodl.fault.ManagedObjectNotFound:
+            pass
+
+
+def start_sync(service_instance, vcenter_server, properties, page_size=inventory.DEFAULT_PAGE_SIZE, previous_state=None):
+    """
+    Creates a dedicated property collector and filter for VMs and returns the full initial set.
+
+    The collector, its filter and the container view are left in place so later runs can resume
+    from the returned version while the session stays alive. Those of a previous sync of the same
+    vCenter are destroyed first so resyncs do not pile them up on the server.
+
+    :param service_instance: The connected vCenter service instance
+    :param vcenter_server: vCenter server address, recorded in the state
+    :param properties: List of VM property paths to track
+    :param page_size: Maximum number of object updates returned per round trip
+    :param previous_state: State dictionary of the sync being replaced (None if there is none)
+    :return: Tuple of (list of ObjectUpdate, state dictionary)
+    """
+    from pyVmomi import vim
+
+    if previous_state and previous_state.get ( "vcenter" ) == vcenter_server:
+        stop_sync ( service_instance, previous_state )
+    content = service_instance.RetrieveContent ()
+    view = content.viewManager.CreateContainerView ( content.rootFolder, [ vim.VirtualMachine ], True )
+    collector = content.propertyCollector.CreatePropertyCollector ()
+    filter_spec = inventory.build_filter_spec ( view, vim.VirtualMachine, properties )
+    collector.CreateFilter ( filter_spec, partialUpdates=True )
+    updates, version = _collect_updates ( collector, "", page_size )
+    state = {
+        "vcenter": vcenter_server,
+        "collector": collector._moId,
+        "view": view._moId,
+        "version": version,
+        "properties": list ( properties )
+    }
+    return updates, state
+
+
+def resume_sync(service_instance, state, page_size=inventory.DEFAULT_PAGE_SIZE):
+    """
+    Fetches the VMs created, modified or deleted since the version recorded in the state.
+
+    :param service_instance: The connected vCenter service instance
+    :param state: State dictionary saved by a previous run
+    :param page_size: Maximum number of object updates returned per round trip
+    :return: Tuple of (list of ObjectUpdate, new version)
+    :raises vmodl.fault.ManagedObjectNotFound: If the collector no longer exists (e.g. the session ended)
+    :raises vmodl.query.InvalidCollectorVersion: If the recorded version is no longer valid
+    """
+    from pyVmomi import vmodl
+
+    collector = vmodl.query.PropertyCollector ( state [ "collector" ], service_instance._stub )
+    return _collect_updates ( collector, state [ "version" ], page_size )
+
+
+def apply_updates(records, updates):
+    """
+    Patches a moid-keyed record dictionary with PropertyCollector object updates.
+
+    :param records: Dict mapping VM moid to record, modified in place
+    :param updates: List of ObjectUpdate from start_sync or resume_sync
+    :return: Tuple of (set of moids entered or modified, set of moids removed)
+    """
+    changed = set ()
+    removed = set ()
+    for obj_update in updates:
+        moid = obj_update.obj._moId
+        if obj_update.kind == "leave":
+            records.pop ( moid, None )
+            changed.discard ( moid )
+            removed.add ( moid )
+            continue
+        record = records.setdefault ( moid, { "moid": moid, "tags": [ ] } )
+        for change in obj_update.changeSet or [ ]:
+            if change.op in ( "remove", "indirectRemove" ):
+                record.pop ( change.name, None )
+            else:
+                record [ change.name ] = change.val
+        changed.add ( moid )
+        removed.discard ( moid )
+    return changed, removed
@@ -0,0 +1,179 @@
+import json
+import os
+import time
+from scripts import timings
+
+# Number of VM IDs sent in one list-attached-tags-on-objects request
+DEFAULT_TAG_BATCH_SIZE = 500
+# Seconds a tag/category cache file on disk stays valid (0 disables the disk cache)
+DEFAULT_TAG_CACHE_TTL = 3600
+# Connect/read timeout in seconds for vSphere Automation REST calls
+REST_TIMEOUT = (10, 60)
+
+
+def open_rest_session(vcenter_server, username, password, session_id=None):
+    """
+    Logs in to the vSphere Automation REST API used for tagging.
+
+    :param vcenter_server: vCenter server address
+    :param username: Username for vCenter
+    :param password: Password for vCenter
+    :param session_id: Previously cached session ID to reuse if vCenter still accepts it
+    :return: requests.Session carrying the vmware-api-session-id header
+    """
+    import requests
+    import urllib3
+
+    urllib3.disable_warnings ( urllib3.exceptions.InsecureRequestWarning )
+    session = timings.instrument_session ( requests.Session (), "rest" )
+    session.verify = False
+    if session_id:
+        session.headers [ "vmware-api-session-id" ] = session_id
+        try:
+            if session.get ( f"https://{vcenter_server}/api/session", timeout=REST_TIMEOUT ).status_code == 200:
+                return session
+        except requests.exceptions.RequestException:
+            pass
+        del session.headers [ "vmware-api-session-id" ]
+    response = session.post ( f"https://{vcenter_server}/api/session", auth=(username, password), timeout=REST_TIMEOUT )
+    response.raise_for_status ()
+    session.headers [ "vmware-api-session-id" ] = response.json ()
+    return session
+
+
+def close_rest_session(session, vcenter_server, logout=True):
+    """
+    Closes a tagging REST session.
+
+    :param session: Session returned by open_rest_session
+    :param vcenter_server: vCenter server address
+    :param logout: If False, keep the session alive on vCenter so it can be reused later
+    :return: None
+    """
+    import requests
+
+    try:
+        if logout:
+            session.delete ( f"https://{vcenter_server}/api/session", timeout=REST_TIMEOUT )
+    except requests.exceptions.RequestException as e:
+        print ( f"Error closing tagging session: {e}" )
+    finally:
+        session.close ()
+
+
+def list_attached_tags(session, vcenter_server, moids, batch_size=DEFAULT_TAG_BATCH_SIZE):
+    """
+    Lists the tag IDs attached to many VMs using batched list-attached-tags-on-objects calls.
+
+    :param session: Session returned by open_rest_session
+    :param vcenter_server: vCenter server address
+    :param moids: Iterable of VM managed object IDs (e.g. "vm-42")
+    :param batch_size: Number of VM IDs sent per request
+    :return: Dict mapping VM moid to a list of tag IDs
+    """
+    url = f"https://{vcenter_server}/api/cis/tagging/tag-association?action=list-attached-tags-on-objects"
+    moids = list ( moids )
+    attached = { moid: [ ] for moid in moids }
+    for start in range ( 0, len ( moids ), batch_size ):
+        batch = moids [ start:start + batch_size ]
+        body = { "object_ids": [ { "type": "VirtualMachine", "id": moid } for moid in batch ] }
+        response = session.post ( url, json=body, timeout=REST_TIMEOUT )
+        response.raise_for_status ()
+        for entry in response.json ():
+            attached [ entry [ "object_id" ] [ "id" ] ] = entry.get ( "tag_ids", [ ] )
+    return attached
+
+
+class TagCache:
+    """
+    Resolves tag IDs to tag and category names, fetching each distinct tag and category only once.
+
+    The cache lives in memory for the run and can optionally be persisted to a JSON file per profile
+    so later runs skip the lookups until the TTL expires.
+    """
+
+    def __init__(self, session, vcenter_server, cache_path=None, ttl=DEFAULT_TAG_CACHE_TTL):
+        """
+        :param session: Session returned by open_rest_session
+        :param vcenter_server: vCenter server address
+        :param cache_path: Path of the on-disk cache file (None keeps the cache in memory only)
+        :param ttl: Seconds the on-disk cache stays valid
+        """
+        self.session = session
+        self.vcenter_server = vcenter_server
+        self.cache_path = cache_path if ttl > 0 else None
+        self.ttl = ttl
+        self.tags = { }
+        self.categories = { }
+        self.dirty = False
+        self._load ()
+
+    def _load(self):
+        if not self.cache_path or not os.path.exists ( self.cache_path ):
+            return
+        try:
+            with open ( self.cache_path, "r" ) as cache_file:
+                data = json.load ( cache_file )
+        except (OSError, ValueError) as e:
+            print ( f"Ignoring unreadable tag cache {self.cache_path}: {e}" )
+            return
+        if data.get ( "vcenter" ) != self.vcenter_server or time.time () - data.get ( "saved", 0 ) > self.ttl:
+            return
+        self.tags = data.get ( "tags", { } )
+        self.categories = data.get ( "categories", { } )
+
+    def save(self):
+        """
+        Writes the cache to disk if anything new was resolved during the run.
+
+        :return: None
+        """
+        if not self.cache_path or not self.dirty:
+            return
+        os.makedirs ( os.path.dirname ( self.cache_path ), exist_ok=True )
+        data = {
+            "vcenter": self.vcenter_server,
+            "saved": time.time (),
+            "tags": self.tags,
+            "categories": self.categories
+        }
+        with open ( self.cache_path, "w" ) as cache_file:
+            json.dump ( data, cache_file )
+        self.dirty = False
+
+    def _get(self, kind, object_id):
+        response = self.session.get ( f"https://{self.vcenter_server}/api/cis/tagging/{kind}/{object_id}", timeout=REST_TIMEOUT )
+        response.raise_for_status ()
+        return response.json ()
+
+    def _category_name(self, category_id):
+        if category_id not in self.categories:
+            self.categories [ category_id ] = self._get ( "category", category_id ) [ "name" ]
+            self.dirty = True
+        return self.categories [ category_id ]
+
+    def resolve(self, tag_id):
+        """
+        Resolves a tag ID to its tag and category name.
+
+        :param tag_id: Tag ID (e.g. "urn:vmomi:InventoryServiceTag:...:GLOBAL")
+        :return: Dict with "name" and "category" keys
+        """
+        if tag_id not in self.tags:
+            tag = self._get ( "tag", tag_id )
+            self.tags [ tag_id ] = { "name": tag [ "name" ], "category_id": tag [ "category_id" ] }
+            self.dirty = True
+        tag = self.tags [ tag_id ]
+        return { "name": tag [ "name" ], "category": self._category_name ( tag [ "category_id" ] ) }
+
+    @timings.timed ( "tags" )
+    def tags_for_vms(self, moids, batch_size=DEFAULT_TAG_BATCH_SIZE):
+        """
+        Lists and resolves the tags attached to many VMs.
+
+        :param moids: Iterable of VM managed object IDs
+        :param batch_size: Number of VM IDs sent per list-attached-tags-on-objects request
+        :return: Dict mapping VM moid to a list of {"name", "category"} dicts
+        """
+        attached = list_attached_tags ( self.session, self.vcenter_server, moids, batch_size )
+        return { moid: [ self.resolve ( tag_id ) for tag_id in tag_ids ] for moid, tag_ids in attached.items () }
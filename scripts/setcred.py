@@ -1,31 +1,224 @@
+import glob
+import gzip
+import hashlib
 import json
 import os
-import shutil
+import re
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
 from colorama import Fore, Style
+from scripts import timings
 
 # Configuration Parameters
 BACKUP_LIMIT = 5  # Number of backups to retain
+BACKUP_INDEX = "index.json"  # Backup index file (timestamp -> content hash) inside the backup directory
 DEFAULT_DIRECTORY = "./"  # Default directory to store backups
+ANSWER_ENV_PREFIX = "SETCRED_"  # Environment variables answering placeholders, e.g. SETCRED_VCENTER_VCENTER_SERVER
+BATCH_WORKERS = 8  # Number of cred.json files merged in parallel in batch mode
 
 
+def atomic_write(path, data):
+    """
+    Write bytes to a file through a temp file in the same directory and rename it into place.
+
+    The file is readable only by the current user, since cred.json and its snapshots hold passwords.
+
+    :param path: Destination path.
+    :param data: Bytes to write.
+    """
+    tmp_path = f"{path}.tmp"
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    # A leftover temp file keeps its old mode through O_CREAT, so set it explicitly
+    os.fchmod(fd, 0o600)
+    with os.fdopen(fd, "wb") as tmp_file:
+        tmp_file.write(data)
+    os.replace(tmp_path, path)
+
+
+def load_backup_index(backup_dir):
+    """
+    Load the backup index (oldest first) for a profile.
+
+    :param backup_dir: Backup directory of the profile.
+    :return: List of {"timestamp", "hash"} entries.
+    """
+    index_path = os.path.join(backup_dir, BACKUP_INDEX)
+    if not os.path.exists(index_path):
+        return []
+    with open(index_path, "r") as index_file:
+        return json.load(index_file).get("entries", [])
+
+
+def save_backup_index(backup_dir, entries):
+    atomic_write(os.path.join(backup_dir, BACKUP_INDEX), json.dumps({"entries": entries}, indent=4).encode())
+
+
+def snapshot_path(backup_dir, content_hash):
+    return os.path.join(backup_dir, f"{content_hash}.json.gz")
+
+
+@timings.timed("backup")
 def create_backup(base_cred_path, backup_dir):
-    # Create the directory if it does not exist
-    if not os.path.exists(backup_dir):
-        os.makedirs(backup_dir)
+    """
+    Snapshot a cred.json into the content-addressed backup store.
 
-    backup_files = sorted(
-        [f for f in os.listdir(backup_dir) if f.startswith("backup_")],
-        key=lambda x: os.path.getmtime(os.path.join(backup_dir, x))
-    )
+    Snapshots are gzip files named by the SHA-256 of the content and listed in an index file,
+    so nothing is written when the content matches the latest snapshot and pruning never scans the directory.
+
+    :param base_cred_path: Path to the cred.json file.
+    :param backup_dir: Backup directory of the profile.
+    :return: Hash of the snapshot.
+    """
+    os.makedirs(backup_dir, mode=0o700, exist_ok=True)
+    with open(base_cred_path, "rb") as base_file:
+        content = base_file.read()
+    content_hash = hashlib.sha256(content).hexdigest()
+
+    entries = load_backup_index(backup_dir)
+    if entries and entries[-1]["hash"] == content_hash:
+        print(Fore.GREEN + "[INFO] Backup skipped, content matches the latest snapshot." + Style.RESET_ALL)
+        return content_hash
+
+    # Identical content seen earlier is already stored under the same name
+    if not os.path.exists(snapshot_path(backup_dir, content_hash)):
+        atomic_write(snapshot_path(backup_dir, content_hash), gzip.compress(content))
+    entries.append({"timestamp": datetime.now().isoformat(timespec="seconds"), "hash": content_hash})
 
     # Remove oldest backups if exceeding the limit
-    while len(backup_files) >= BACKUP_LIMIT:
-        os.remove(os.path.join(backup_dir, backup_files.pop(0)))
+    while len(entries) > BACKUP_LIMIT:
+        removed = entries.pop(0)
+        if all(entry["hash"] != removed["hash"] for entry in entries):
+            try:
+                os.remove(snapshot_path(backup_dir, removed["hash"]))
+            except FileNotFoundError:
+                pass
+    save_backup_index(backup_dir, entries)
+    print(Fore.GREEN + f"[INFO] Backup created at: {snapshot_path(backup_dir, content_hash)}" + Style.RESET_ALL)
+    return content_hash
 
-    # Create a new backup
-    backup_file = os.path.join(backup_dir, f"backup_{len(backup_files) + 1}.json")
-    shutil.copy2(base_cred_path, backup_file)
-    print(Fore.GREEN + f"[INFO] Backup created at: {backup_file}" + Style.RESET_ALL)
+
+def show_history(base_cred_path):
+    """
+    Print the backup history of a cred.json from the index, newest first.
+
+    :param base_cred_path: Path to the cred.json file.
+    """
+    entries = load_backup_index(os.path.join(os.path.dirname(base_cred_path), "backup"))
+    if not entries:
+        print(Fore.YELLOW + f"[INFO] No backups recorded for {base_cred_path}." + Style.RESET_ALL)
+        return
+    for number, entry in reversed(list(enumerate(entries, start=1))):
+        print(f"{'@' + str(number):>4}  {entry['timestamp']}  {entry['hash'][:12]}")
+
+
+def restore_backup(base_cred_path, ref):
+    """
+    Restore a cred.json from the backup store. The current content is snapshotted first.
+
+    :param base_cred_path: Path to the cred.json file.
+    :param ref: History number prefixed with "@" (as shown by --history), timestamp, or hash prefix.
+    :return: True if a snapshot was restored.
+    """
+    backup_dir = os.path.join(os.path.dirname(base_cred_path), "backup")
+    entries = load_backup_index(backup_dir)
+    # "@" keeps history numbers apart from all-digit hash prefixes
+    if ref.startswith("@"):
+        number = ref[1:]
+        hashes = {entries[int(number) - 1]["hash"]} if number.isdigit() and 1 <= int(number) <= len(entries) else set()
+    else:
+        hashes = {entry["hash"] for entry in entries if ref == entry["timestamp"] or entry["hash"].startswith(ref)}
+    if len(hashes) != 1:
+        print(Fore.RED + f"[ERROR] '{ref}' matches {len(hashes)} backups. Use --history to pick one." + Style.RESET_ALL)
+        return False
+    content_hash = hashes.pop()
+
+    with gzip.open(snapshot_path(backup_dir, content_hash), "rb") as snapshot:
+        content = snapshot.read()
+    if os.path.exists(base_cred_path):
+        create_backup(base_cred_path, backup_dir)
+    atomic_write(base_cred_path, content)
+    print(Fore.GREEN + f"[INFO] Restored {base_cred_path} from backup {content_hash[:12]}." + Style.RESET_ALL)
+    return True
+
+
+def interactive_answer(full_path, value):
+    """
+    Ask the user for the value of a missing key.
+
+    :param full_path: Dotted path of the key in the template.
+    :param value: Template value (a placeholder or an empty list).
+    :return: The value to store.
+    """
+    if isinstance(value, list):
+        # Prompt user to define list values
+        print(
+            Fore.GREEN + f"[PROMPT] Key '{full_path}' is an empty list. Add items now? (yes/no): " + Style.RESET_ALL)
+        add_items = input().lower()
+        items = []
+        if add_items == "yes":
+            item_count = int(input(Fore.GREEN + "How many items? " + Style.RESET_ALL))
+            for i in range(item_count):
+                item_key = input(Fore.GREEN + f"Item {i + 1} key: " + Style.RESET_ALL)
+                item_value = input(Fore.GREEN + f"Item {i + 1} value: " + Style.RESET_ALL)
+                items.append({item_key: item_value})
+        return items
+    # Placeholder value, prompt the user
+    print(
+        Fore.GREEN + f"[PROMPT] Key '{full_path}' has a placeholder value ({value}). Enter a new value or press Enter to keep it: " + Style.RESET_ALL)
+    new_value = input()
+    return value if new_value == "" else new_value
+
+
+def merge_template(template, base, changes, answer, path="", verbose=True):
+    """
+    Recursively merge a credential template into base credentials.
+
+    Missing dictionaries are added empty, missing scalars are copied from the template, and
+    placeholders ("", 0, False) and lists are filled in by the `answer` callback.
+
+    :param template: Template dictionary.
+    :param base: Base credentials dictionary, modified in place.
+    :param changes: Dictionary collecting the added keys (dotted path -> template value).
+    :param answer: Callable (full_path, template_value) -> value for placeholders and lists.
+    :param path: Dotted path of the current level.
+    :param verbose: If False, only errors are printed.
+    """
+    for key, value in template.items():
+        full_path = f"{path}.{key}" if path else key
+
+        if key not in base:
+            # Handle new keys
+            if isinstance(value, dict):
+                # Add empty object for missing dictionary, then fill it from the template
+                base[key] = {}
+                if not value:
+                    changes[full_path] = value
+                if verbose:
+                    print(Fore.GREEN + f"[INFO] Added new dictionary key: '{full_path}' with value: {{}} " + Style.RESET_ALL)
+                merge_template(value, base[key], changes, answer, full_path, verbose)
+                continue
+            if isinstance(value, list):
+                base[key] = answer(full_path, value)
+                message = f"[INFO] Added new list key: '{full_path}' with value: {base[key]}"
+            elif value in ("", 0, False):
+                base[key] = answer(full_path, value)
+                message = f"[INFO] Added new key: '{full_path}' with value: {base[key]}"
+            else:
+                # Add scalar values directly
+                base[key] = value
+                message = f"[INFO] Added new key: '{full_path}' with value: {base[key]}"
+            if verbose:
+                print(Fore.GREEN + message + Style.RESET_ALL)
+            changes[full_path] = value
+        elif isinstance(value, dict) and isinstance(base[key], dict):
+            merge_template(value, base[key], changes, answer, full_path, verbose)
+        elif isinstance(value, list) and isinstance(base[key], list):
+            # Merge lists if needed (optional logic for your use case)
+            pass
+        elif verbose:
+            # Highlight existing value in yellow
+            print(
+                Fore.YELLOW + f"[INFO] Key '{full_path}' already exists in base-cred with value: {base[key]}" + Style.RESET_ALL)
 
 
 def merge_json(json_template_path, base_cred_path, is_test=False):
@@ -39,8 +232,7 @@ def merge_json(json_template_path, base_cred_path, is_test=False):
         if create_new != "yes":
             return
         os.makedirs(os.path.dirname(base_cred_path), exist_ok=True)
-        with open(base_cred_path, "w") as new_file:
-            new_file.write("{}")  # Create an empty JSON file
+        atomic_write(base_cred_path, b"{}")  # Create an empty JSON file
         print(Fore.GREEN + f"[INFO] Created file: {base_cred_path}" + Style.RESET_ALL)
 
     # Load the `base-cred` JSON data
@@ -61,58 +253,7 @@ def merge_json(json_template_path, base_cred_path, is_test=False):
             return
 
     changes = {}
-
-    # Compare and merge JSON structures
-    def recursive_merge(template, base, path=""):
-        for key, value in template.items():
-            full_path = f"{path}.{key}" if path else key
-
-            if key not in base:
-                # Handle new keys
-                if isinstance(value, dict):
-                    # Add empty object for missing dictionary
-                    base[key] = {}
-                    print(
-                        Fore.GREEN + f"[INFO] Added new dictionary key: '{full_path}' with value: {{}} " + Style.RESET_ALL)
-                elif isinstance(value, list):
-                    # Prompt user to define list values
-                    print(
-                        Fore.GREEN + f"[PROMPT] Key '{full_path}' is an empty list. Add items now? (yes/no): " + Style.RESET_ALL)
-                    add_items = input().lower()
-                    if add_items == "yes":
-                        base[key] = []
-                        item_count = int(input(Fore.GREEN + "How many items? " + Style.RESET_ALL))
-                        for i in range(item_count):
-                            item_key = input(Fore.GREEN + f"Item {i + 1} key: " + Style.RESET_ALL)
-                            item_value = input(Fore.GREEN + f"Item {i + 1} value: " + Style.RESET_ALL)
-                            base[key].append({item_key: item_value})
-                    else:
-                        base[key] = []
-                    print(
-                        Fore.GREEN + f"[INFO] Added new list key: '{full_path}' with value: {base[key]}" + Style.RESET_ALL)
-                elif value in ("", 0, False):
-                    # Placeholder value, prompt the user
-                    print(
-                        Fore.GREEN + f"[PROMPT] Key '{full_path}' has a placeholder value ({value}). Enter a new value or press Enter to keep it: " + Style.RESET_ALL)
-                    new_value = input()
-                    base[key] = value if new_value == "" else new_value
-                    print(Fore.GREEN + f"[INFO] Added new key: '{full_path}' with value: {base[key]}" + Style.RESET_ALL)
-                else:
-                    # Add scalar values directly
-                    base[key] = value
-                    print(Fore.GREEN + f"[INFO] Added new key: '{full_path}' with value: {base[key]}" + Style.RESET_ALL)
-                changes[full_path] = value
-            elif isinstance(value, dict) and isinstance(base[key], dict):
-                recursive_merge(value, base[key], full_path)
-            elif isinstance(value, list) and isinstance(base[key], list):
-                # Merge lists if needed (optional logic for your use case)
-                pass
-            else:
-                # Highlight existing value in yellow
-                print(
-                    Fore.YELLOW + f"[INFO] Key '{full_path}' already exists in base-cred with value: {base[key]}" + Style.RESET_ALL)
-
-    recursive_merge(template_data, base_data)
+    merge_template(template_data, base_data, changes, interactive_answer)
 
     # Print differences in `test` mode
     if is_test:
@@ -121,19 +262,219 @@ def merge_json(json_template_path, base_cred_path, is_test=False):
     else:
         # Create a backup and write the merged data
         create_backup(base_cred_path, backup_dir)
-        with open(base_cred_path, "w") as base_file:
-            json.dump(base_data, base_file, indent=4)
+        atomic_write(base_cred_path, json.dumps(base_data, indent=4).encode())
         print(Fore.GREEN + f"[INFO] Updated base-cred successfully at {base_cred_path}" + Style.RESET_ALL)
 
 
-# CLI Entry point
-if __name__ == "__main__":
+def profile_name(base_cred_path):
+    """
+    Derive the profile name from a cred.json path (~/.pgvm/<profile>/cred.json).
+
+    :param base_cred_path: Path to the cred.json file.
+    :return: Profile name, or "default" for ~/.pgvm/cred.json.
+    """
+    parent = os.path.basename(os.path.dirname(os.path.abspath(base_cred_path)))
+    return "default" if parent in ("", ".pgvm") else parent
+
+
+class BatchAnswers:
+    """
+    Non-interactive answers for placeholders and lists, used by batch mode.
+
+    Answers are looked up by dotted key path in this order: the profile's section of the answers file,
+    a SETCRED_<PROFILE>_<PATH> or SETCRED_<PATH> environment variable, the answers file defaults,
+    and finally the template value itself.
+    The answers file is JSON, either flat ({"vcenter.VCENTER_USER": "..."}) or
+    {"defaults": {...}, "profiles": {"<profile>": {...}}}.
+    """
+
+    def __init__(self, answers_path=None, environ=None):
+        self.defaults = {}
+        self.profiles = {}
+        self.environ = os.environ if environ is None else environ
+        if answers_path:
+            with open(answers_path, "r") as answers_file:
+                data = json.load(answers_file)
+            if "defaults" in data or "profiles" in data:
+                self.defaults = data.get("defaults", {})
+                self.profiles = data.get("profiles", {})
+            else:
+                self.defaults = data
+
+    @staticmethod
+    def env_name(*parts):
+        return ANSWER_ENV_PREFIX + re.sub(r"[^A-Za-z0-9]", "_", "_".join(parts)).upper()
+
+    def _from_env(self, name, value):
+        raw = self.environ.get(name)
+        if raw is None:
+            return None
+        if isinstance(value, list):
+            return json.loads(raw)
+        return raw
+
+    def for_profile(self, profile):
+        """
+        Build the answer callback for one profile.
+
+        :param profile: Profile name.
+        :return: Callable (full_path, template_value) -> value, as used by merge_template.
+        """
+        overrides = self.profiles.get(profile, {})
+
+        def answer(full_path, value):
+            if full_path in overrides:
+                return overrides[full_path]
+            for name in (self.env_name(profile, full_path), self.env_name(full_path)):
+                env_value = self._from_env(name, value)
+                if env_value is not None:
+                    return env_value
+            if full_path in self.defaults:
+                return self.defaults[full_path]
+            return [] if isinstance(value, list) else value
+
+        return answer
+
+
+def expand_cred_paths(patterns):
+    """
+    Expand a list of cred.json paths and glob patterns (e.g. "~/.pgvm/*/cred.json").
+
+    :param patterns: Paths or glob patterns.
+    :return: Sorted list of unique paths; patterns without matches are kept as new files.
+    """
+    paths = set()
+    for pattern in patterns:
+        pattern = os.path.expanduser(pattern)
+        matches = glob.glob(pattern)
+        if matches:
+            paths.update(matches)
+        elif not glob.has_magic(pattern):
+            paths.add(pattern)
+    return sorted(paths)
+
+
+@timings.timed("merge")
+def merge_profile(template_datas, base_cred_path, answer, is_test=False):
+    """
+    Merge one or more templates into a single cred.json without prompting.
+
+    Missing files are created. A file is only backed up and rewritten when something changed.
+
+    :param template_datas: List of loaded template dictionaries.
+    :param base_cred_path: Path to the cred.json file.
+    :param answer: Answer callback for placeholders and lists.
+    :param is_test: If True, compute the changes without writing anything.
+    :return: Tuple of (base_cred_path, changes dictionary, error message or None).
+    """
+    base_data = {}
+    try:
+        if os.path.exists(base_cred_path):
+            with open(base_cred_path, "r") as base_file:
+                base_data = json.load(base_file)
+
+        changes = {}
+        for template_data in template_datas:
+            merge_template(template_data, base_data, changes, answer, verbose=False)
+
+        if changes and not is_test:
+            if os.path.exists(base_cred_path):
+                create_backup(base_cred_path, os.path.join(os.path.dirname(base_cred_path), "backup"))
+            else:
+                os.makedirs(os.path.dirname(os.path.abspath(base_cred_path)), exist_ok=True)
+            atomic_write(base_cred_path, json.dumps(base_data, indent=4).encode())
+        return base_cred_path, changes, None
+    except (OSError, ValueError) as e:
+        return base_cred_path, {}, str(e)
+
+
+def batch_merge(json_template_paths, cred_patterns, answers_path=None, is_test=False, workers=BATCH_WORKERS):
+    """
+    Merge templates into many profile cred.json files in one process, without prompts.
+
+    Templates are loaded once, the files are merged in a thread pool, and a consolidated
+    diff of every profile's changes is printed.
+
+    :param json_template_paths: List of template file paths.
+    :param cred_patterns: List of cred.json paths or glob patterns.
+    :param answers_path: Optional answers JSON file.
+    :param is_test: If True, only print the consolidated diff.
+    :param workers: Number of files processed in parallel.
+    :return: Dictionary mapping each cred.json path to its changes.
+    """
+    template_datas = []
+    for json_template_path in json_template_paths:
+        with open(json_template_path, "r") as template_file:
+            template_datas.append(json.load(template_file))
+
+    answers = BatchAnswers(answers_path)
+    cred_paths = expand_cred_paths(cred_patterns)
+    if not cred_paths:
+        print(Fore.RED + "[ERROR] No cred.json files matched." + Style.RESET_ALL)
+        return {}
+
+    all_changes = {}
+    errors = {}
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(cred_paths)))) as executor:
+        jobs = [executor.submit(merge_profile, template_datas, path, answers.for_profile(profile_name(path)), is_test)
+                for path in cred_paths]
+        for job in jobs:
+            path, changes, error = job.result()
+            if error:
+                errors[path] = error
+            elif changes:
+                all_changes[path] = changes
+
+    if is_test:
+        print(Fore.GREEN + "[INFO] The following changes would be made:" + Style.RESET_ALL)
+    else:
+        print(Fore.GREEN + f"[INFO] Updated {len(all_changes)} of {len(cred_paths)} cred.json files." + Style.RESET_ALL)
+    print(json.dumps(all_changes, indent=4))
+    for path, error in errors.items():
+        print(Fore.RED + f"[ERROR] {path}: {error}" + Style.RESET_ALL)
+    return all_changes
+
+
+def main(argv=None):
+    """
+    Parses the command line and runs the requested merge, history or restore.
+
+    :param argv: Command-line arguments (defaults to sys.argv[1:]).
+    """
     import argparse
 
     parser = argparse.ArgumentParser(description="Compare and merge JSON files.")
-    parser.add_argument("--json-template", required=True, help="Path to the JSON template file.")
-    parser.add_argument("--base-cred", required=True, help="Path to the base credentials JSON file.")
+    parser.add_argument("--json-template", nargs="+", help="Path to the JSON template file(s).")
+    parser.add_argument("--base-cred", required=True, nargs="+",
+                        help="Path to the base credentials JSON file (in batch mode, several paths or globs).")
     parser.add_argument("--test", action="store_true", help="Show the differences without making changes.")
-    args = parser.parse_args()
+    parser.add_argument("--batch", action="store_true", help="Merge without prompting, answering from --answers and the environment.")
+    parser.add_argument("--answers", help="JSON file with answers for placeholders in batch mode.")
+    parser.add_argument("--workers", type=int, default=BATCH_WORKERS, help="Number of files merged in parallel in batch mode.")
+    parser.add_argument("--history", action="store_true", help="List the backups of the base credentials file.")
+    parser.add_argument("--restore", metavar="REF", help="Restore a backup by history number (@N), timestamp or hash prefix.")
+    timings.add_arguments(parser)
+    args = parser.parse_args(argv)
 
-    merge_json(args.json_template, args.base_cred, is_test=args.test)
+    if args.history or args.restore:
+        if len(args.base_cred) > 1:
+            parser.error("--history and --restore take a single --base-cred.")
+    elif not args.json_template:
+        parser.error("--json-template is required.")
+    elif not args.batch and (len(args.json_template) > 1 or len(args.base_cred) > 1):
+        parser.error("Several templates or cred files need --batch.")
+
+    with timings.run("setcred", args):
+        if args.history:
+            show_history(args.base_cred[0])
+        elif args.restore:
+            restore_backup(args.base_cred[0], args.restore)
+        elif args.batch:
+            batch_merge(args.json_template, args.base_cred, args.answers, is_test=args.test, workers=args.workers)
+        else:
+            merge_json(args.json_template[0], args.base_cred[0], is_test=args.test)
+
+
+# CLI Entry point
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,299 @@
+import contextlib
+import functools
+import json
+import sys
+import threading
+import time
+
+# Output formats for --timings
+FORMATS = ("json", "openmetrics")
+METRIC_PREFIX = "vmlab"
+
+# Tracing is off unless a script enables it; every helper below is then a cheap no-op
+_enabled = False
+_lock = threading.Lock()
+_spans = {}
+_counters = {}
+_started = None
+_NOOP = contextlib.nullcontext()
+
+
+def enabled():
+    return _enabled
+
+
+def enable():
+    """
+    Turns tracing on and clears anything recorded so far.
+    """
+    global _enabled, _started
+    with _lock:
+        _spans.clear()
+        _counters.clear()
+        _started = time.time()
+        _enabled = True
+
+
+def disable():
+    global _enabled
+    _enabled = False
+
+
+@contextlib.contextmanager
+def _timed(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        with _lock:
+            stats = _spans.setdefault(name, [0, 0.0, 0.0])
+            stats[0] += 1
+            stats[1] += elapsed
+            stats[2] = max(stats[2], elapsed)
+
+
+def span(name):
+    """
+    Times a phase of a run. Repeated and concurrent spans of the same name are aggregated.
+
+    :param name: Phase name, e.g. "connect", "retrieve", "tags", "serialize", "backup", "fetch", "upload"
+    :return: Context manager
+    """
+    return _timed(name) if _enabled else _NOOP
+
+
+def timed(name):
+    """
+    Decorator recording every call of a function as a span.
+
+    :param name: Phase name
+    :return: Decorator
+    """
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return func(*args, **kwargs)
+            with _timed(name):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorate
+
+
+def count(metric, kind, value=1):
+    """
+    Adds to a counter, e.g. count("round_trips", "soap") or count("bytes_received", "rest", 512).
+
+    :param metric: Counter name
+    :param kind: Counter label
+    :param value: Amount to add
+    """
+    if not _enabled:
+        return
+    with _lock:
+        kinds = _counters.setdefault(metric, {})
+        kinds[kind] = kinds.get(kind, 0) + value
+
+
+def _body_size(body):
+    if isinstance(body, str):
+        return len(body.encode("utf-8"))
+    return len(body) if isinstance(body, (bytes, bytearray)) else 0
+
+
+def _count_reads(response, kind):
+    # Wraps one http.client response so every body read is counted as it is consumed
+    read = response.read
+
+    def counted_read(*args, **kwargs):
+        data = read(*args, **kwargs)
+        count("bytes_received", kind, len(data))
+        return data
+
+    response.read = counted_read
+    return response
+
+
+def instrument_stub(stub):
+    """
+    Counts SOAP round trips and request/response body bytes made through a pyVmomi stub.
+
+    Request bodies are measured as serialized; response bodies as read off the connection, so
+    compressed responses count their compressed size.
+
+    :param stub: SoapStubAdapter of a service instance
+    :return: The same stub
+    """
+    if not _enabled or getattr(stub, "_timings_wrapped", False):
+        return stub
+    invoke = stub.InvokeMethod
+
+    def counted_invoke(mo, info, args, *rest, **kwargs):
+        count("round_trips", "soap")
+        return invoke(mo, info, args, *rest, **kwargs)
+
+    stub.InvokeMethod = counted_invoke
+    if hasattr(stub, "requestModifierList") and hasattr(stub, "GetConnection"):
+        def counted_request(request):
+            count("bytes_sent", "soap", _body_size(request))
+            return request
+
+        get_connection = stub.GetConnection
+
+        def counted_connection():
+            connection = get_connection()
+            # Pooled connections come back here and are wrapped once
+            if not getattr(connection, "_timings_wrapped", False):
+                getresponse = connection.getresponse
+                connection.getresponse = lambda *args, **kwargs: _count_reads(getresponse(*args, **kwargs), "soap")
+                connection._timings_wrapped = True
+            return connection
+
+        stub.requestModifierList.append(counted_request)
+        stub.GetConnection = counted_connection
+    stub._timings_wrapped = True
+    return stub
+
+
+def instrument_session(session, kind):
+    """
+    Counts round trips and request/response body bytes made through a requests session.
+
+    Response bodies are counted as they are consumed, streamed or not: bytes read off the connection
+    where urllib3 tracks them, otherwise (chunked transfers) the decoded body.
+
+    :param session: requests.Session
+    :param kind: Counter label, e.g. "rest" or "http"
+    :return: The same session
+    """
+    if _enabled:
+        def counted_response(response, *args, **kwargs):
+            count("round_trips", kind)
+            count("bytes_sent", kind, _body_size(response.request.body))
+            raw = response.raw
+            stream = getattr(raw, "stream", None)
+            if stream is None:
+                return
+
+            def counted_stream(*stream_args, **stream_kwargs):
+                # urllib3 tracks the bytes read off the connection except for chunked transfers
+                position = raw.tell()
+                for chunk in stream(*stream_args, **stream_kwargs):
+                    if raw.chunked:
+                        count("bytes_received", kind, len(chunk))
+                    else:
+                        count("bytes_received", kind, raw.tell() - position)
+                        position = raw.tell()
+                    yield chunk
+
+            raw.stream = counted_stream
+
+        session.hooks["response"].append(counted_response)
+    return session
+
+
+def summary(script_name):
+    """
+    Returns everything recorded since tracing was enabled.
+
+    :param script_name: Name of the script the run belongs to
+    :return: Dictionary with script, started, seconds, spans and counters
+    """
+    with _lock:
+        spans = {name: {"count": stats[0], "seconds": round(stats[1], 4), "max_seconds": round(stats[2], 4)}
+                 for name, stats in sorted(_spans.items())}
+        counters = {metric: dict(sorted(kinds.items())) for metric, kinds in sorted(_counters.items())}
+    result = {"script": script_name, "started": _started, "seconds": round(time.time() - _started, 4), "spans": spans}
+    result.update(counters)
+    return result
+
+
+def to_openmetrics(data):
+    """
+    Renders a summary in the OpenMetrics text format.
+
+    :param data: Dictionary returned by summary()
+    :return: Text ending with "# EOF"
+    """
+    script = data["script"]
+    lines = [f"# TYPE {METRIC_PREFIX}_run_seconds gauge",
+             f'{METRIC_PREFIX}_run_seconds{{script="{script}"}} {data["seconds"]}']
+    for field, metric, metric_type in (("seconds", "span_seconds", "counter"), ("count", "span", "counter"),
+                                       ("max_seconds", "span_max_seconds", "gauge")):
+        lines.append(f"# TYPE {METRIC_PREFIX}_{metric} {metric_type}")
+        suffix = "_total" if metric_type == "counter" else ""
+        for name, stats in data["spans"].items():
+            lines.append(f'{METRIC_PREFIX}_{metric}{suffix}{{script="{script}",span="{name}"}} {stats[field]}')
+    for metric, kinds in data.items():
+        if not isinstance(kinds, dict) or metric == "spans":
+            continue
+        lines.append(f"# TYPE {METRIC_PREFIX}_{metric} counter")
+        for kind, value in kinds.items():
+            lines.append(f'{METRIC_PREFIX}_{metric}_total{{script="{script}",kind="{kind}"}} {value}')
+    lines.append("# EOF")
+    return "\n".join(lines) + "\n"
+
+
+def write(script_name, path, fmt="json"):
+    """
+    Writes the run summary.
+
+    :param script_name: Name of the script the run belongs to
+    :param path: Output file, or "-" for stderr (stdout is left to the script's own output)
+    :param fmt: "json" or "openmetrics"
+    """
+    data = summary(script_name)
+    text = to_openmetrics(data) if fmt == "openmetrics" else json.dumps(data, indent=4) + "\n"
+    if path == "-":
+        sys.stderr.write(text)
+    else:
+        with open(path, "w") as output_file:
+            output_file.write(text)
+
+
+def add_arguments(parser):
+    """
+    Adds --timings, --timings-format and --cprofile to a script's argument parser.
+
+    :param parser: argparse.ArgumentParser
+    """
+    parser.add_argument("--timings", nargs="?", const="-", metavar="PATH",
+                        help="Write phase durations, round trips and bytes at the end of the run (to stderr without PATH).")
+    parser.add_argument("--timings-format", choices=FORMATS, default="json", help="Format of the --timings output.")
+    parser.add_argument("--cprofile", metavar="PATH", help="Profile the main thread with cProfile and dump the stats to PATH.")
+
+
+@contextlib.contextmanager
+def run(script_name, args):
+    """
+    Wraps a script's run, enabling tracing and profiling as requested by add_arguments' options.
+
+    The summary and profile are written even if the run exits early or fails.
+
+    :param script_name: Name of the script, recorded in the output
+    :param args: Parsed arguments carrying timings, timings_format and cprofile
+    """
+    if not (args.timings or args.cprofile):
+        yield
+        return
+    profiler = None
+    if args.cprofile:
+        import cProfile
+
+        profiler = cProfile.Profile()
+    if args.timings:
+        enable()
+    if profiler:
+        profiler.enable()
+    try:
+        yield
+    finally:
+        if profiler:
+            profiler.disable()
+            profiler.dump_stats(args.cprofile)
+        if args.timings:
+            write(script_name, args.timings, args.timings_format)
+            disable()
@@ -0,0 +1,185 @@
+import json
+import os
+import ssl
+from scripts import credman, timings
+
+# Configuration Parameters
+SESSION_FILE = "session.json"  # Cached session file name inside each profile directory
+
+
+def session_path(profile):
+    """
+    Returns the path of the cached session file for a profile.
+
+    :param profile: Profile name ("" for the default profile)
+    :return: Expanded file path
+    """
+    return os.path.join(credman.profile_dir(profile), SESSION_FILE)
+
+
+def load_session(profile):
+    """
+    Loads the cached session details for a profile.
+
+    :param profile: Profile name
+    :return: Session dictionary, or an empty dictionary if nothing is cached
+    """
+    path = session_path(profile)
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, "r") as session_file:
+            return json.load(session_file)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_session(profile, session):
+    """
+    Saves session details for a profile, readable only by the current user.
+
+    :param profile: Profile name
+    :param session: Session dictionary (vcenter, soap cookie and version, rest session id)
+    """
+    path = session_path(profile)
+    os.makedirs(os.path.dirname(path), mode=0o700, exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    # A leftover temp file keeps its old mode through O_CREAT, so set it explicitly
+    os.fchmod(fd, 0o600)
+    with os.fdopen(fd, "w") as session_file:
+        json.dump(session, session_file, indent=4)
+    os.replace(tmp_path, path)
+
+
+def clear_session(profile):
+    """
+    Removes the cached session file for a profile.
+
+    :param profile: Profile name
+    """
+    path = session_path(profile)
+    if os.path.exists(path):
+        os.remove(path)
+
+
+def _resume_soap_session(vcenter_server, cookie, version, timeout=None):
+    """
+    Rebuilds a service instance from a cached SOAP session cookie.
+
+    :return: Service instance if the session is still authenticated, otherwise None
+    """
+    from pyVmomi import SoapStubAdapter, vim
+
+    stub = SoapStubAdapter(host=vcenter_server, port=443, version=version,
+                           sslContext=ssl._create_unverified_context(), httpConnectionTimeout=timeout)
+    stub.cookie = cookie
+    service_instance = vim.ServiceInstance("ServiceInstance", timings.instrument_stub(stub))
+    try:
+        if service_instance.content.sessionManager.currentSession:
+            return service_instance
+    except vim.fault.NotAuthenticated:
+        pass
+    return None
+
+
+@timings.timed("connect")
+def connect(profile, vcenter_server, username, password, timeout=None, reuse=True):
+    """
+    Returns a vCenter service instance, reusing the profile's cached session when it is still valid.
+
+    The cheap validity check (SessionManager.currentSession) replaces a full SSO login on repeated runs.
+    A fresh login is cached for the next run unless reuse is disabled.
+
+    :param profile: Profile name used to locate the session cache
+    :param vcenter_server: vCenter server address
+    :param username: Username for vCenter
+    :param password: Password for vCenter
+    :param timeout: Socket timeout in seconds (None for no timeout)
+    :param reuse: If False, always log in and do not cache the session
+    :return: Service instance connected to vCenter
+    """
+    from pyVim.connect import SmartConnect
+
+    session = load_session(profile) if reuse else {}
+    soap = session.get("soap")
+    if soap and session.get("vcenter") == vcenter_server:
+        try:
+            service_instance = _resume_soap_session(vcenter_server, soap["cookie"], soap["version"], timeout)
+            if service_instance:
+                return service_instance
+        except Exception:
+            pass
+
+    service_instance = SmartConnect(
+        host=vcenter_server,
+        user=username,
+        pwd=password,
+        sslContext=ssl._create_unverified_context(),
+        httpConnectionTimeout=timeout
+    )
+    timings.instrument_stub(service_instance._stub)
+    if reuse:
+        if session.get("vcenter") != vcenter_server:
+            session = {"vcenter": vcenter_server}
+        session["soap"] = {"cookie": service_instance._stub.cookie, "version": service_instance._stub.version}
+        save_session(profile, session)
+    return service_instance
+
+
+def session_id(service_instance):
+    """
+    Extracts the SOAP session ID from a service instance, e.g. for Connect-VIServer -Session.
+
+    :param service_instance: Connected service instance
+    :return: Session ID string
+    """
+    cookie = service_instance._stub.cookie
+    return cookie.split("=", 1)[1].split(";", 1)[0].strip('"')
+
+
+def set_rest_session(profile, vcenter_server, rest_session_id):
+    """
+    Records the vSphere Automation REST session ID alongside the cached SOAP session.
+
+    :param profile: Profile name
+    :param vcenter_server: vCenter server address
+    :param rest_session_id: Value of the vmware-api-session-id header
+    """
+    session = load_session(profile)
+    if session.get("vcenter") != vcenter_server:
+        session = {"vcenter": vcenter_server}
+    session["rest"] = rest_session_id
+    save_session(profile, session)
+
+
+def logout(profile):
+    """
+    Ends the cached sessions for a profile on vCenter and removes the cache file.
+
+    :param profile: Profile name
+    :return: True if a cached session was found
+    """
+    session = load_session(profile)
+    if not session:
+        return False
+    vcenter_server = session.get("vcenter")
+    soap = session.get("soap")
+    if soap:
+        try:
+            service_instance = _resume_soap_session(vcenter_server, soap["cookie"], soap["version"])
+            if service_instance:
+                service_instance.content.sessionManager.Logout()
+        except Exception as e:
+            print(f"[INFO] SOAP session for {vcenter_server} could not be ended: {e}")
+    if session.get("rest"):
+        import requests
+
+        try:
+            requests.delete(f"https://{vcenter_server}/api/session", verify=False, timeout=(10, 30),
+                            headers={"vmware-api-session-id": session["rest"]})
+        except requests.exceptions.RequestException as e:
+            print(f"[INFO] REST session for {vcenter_server} could not be ended: {e}")
+    clear_session(profile)
+    return True
+
@@ -0,0 +1,162 @@
+import argparse
+import importlib
+import os
+import re
+import sys
+
+# Subcommands as (group, command) -> (module implementing it with main(argv), leading arguments passed to main, help text).
+# Modules are only imported once their subcommand is chosen, so --help never loads pyVmomi or requests.
+COMMANDS = {
+    ("hcl", "update"): ("scripts.hclupdate.hclupdate", [], "Refresh customhcl.json and push it to vCenter."),
+    ("hcl", "check"): ("scripts.hclupdate.hclupdate", ["check"], "Check customhcl.json entries against the official vSAN HCL."),
+    ("vms", "list"): ("scripts.manageVMs.manageVMs", [], "Collect VMs and their tags from one or more vCenters."),
+    ("vms", "shutdown"): ("scripts.manageVMs.manageVMs", ["shutdown"], "Shut down VMs selected by tag, wave by wave."),
+    ("vms", "poweron"): ("scripts.manageVMs.manageVMs", ["poweron"], "Power on VMs selected by tag, waves in reverse."),
+    ("vms", "query"): ("scripts.manageVMs.manageVMs", ["query"], "Filter VMs from the local inventory index."),
+    ("vms", "stats"): ("scripts.manageVMs.manageVMs", ["stats"], "Collect recent CPU, memory, disk and network samples per VM."),
+    ("cred", "merge"): ("scripts.setcred", [], "Merge credential templates into profile cred.json files."),
+    ("bench", "run"): ("scripts.bench.bench", [], "Run the offline benchmarks against a synthetic vCenter and HCL server."),
+}
+
+# Cold-start budget and the invocations measured by `vmlab selfcheck`.
+# "{store}" is replaced by a small inventory index selfcheck writes first, so the cached read path is probed too.
+IMPORT_BUDGET_MS = 150
+IMPORT_PROBES = [
+    ["--help"],
+    ["hcl", "update", "--help"],
+    ["vms", "list", "--help"],
+    ["vms", "shutdown", "--help"],
+    ["cred", "merge", "--help"],
+    ["vms", "query", "--store", "{store}", "--tag", "Tier:web"],
+]
+# Modules that must not be imported by a --help probe. The scripts import them inside the functions
+# that talk to vCenter or the web, never at module level, so start-up and --help stay fast.
+HEAVY_MODULES = ("pyVmomi", "pyVim", "requests", "urllib3")
+# Commands answered from local files only, held to the same rule as --help
+OFFLINE_COMMANDS = {("vms", "query")}
+
+_IMPORT_LINE = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)")
+
+
+def import_profile(probe):
+    """
+    Runs vmlab in a fresh interpreter under -X importtime.
+
+    :param probe: vmlab arguments to run, e.g. ["hcl", "update", "--help"]
+    :return: Tuple of (total import time in milliseconds, set of imported top-level packages, exit code)
+    """
+    import subprocess
+
+    repo_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    result = subprocess.run([sys.executable, "-X", "importtime", "-m", "scripts.vmlab"] + probe,
+                            cwd=repo_root, capture_output=True, text=True)
+    total_us = 0
+    packages = set()
+    for line in result.stderr.splitlines():
+        match = _IMPORT_LINE.match(line)
+        if not match:
+            continue
+        cumulative, indent, name = int(match.group(2)), match.group(3), match.group(4)
+        packages.add(name.split(".")[0])
+        # Only top-level imports are summed; nested ones are already in their parent's cumulative time
+        if len(indent) <= 1:
+            total_us += cumulative
+    return total_us / 1000, packages, result.returncode
+
+
+def write_probe_store(path):
+    """
+    Writes the inventory index the "{store}" probes read: one vCenter with a few tagged VMs.
+
+    :param path: Database file to create
+    """
+    from scripts.manageVMs import store
+
+    vcenter = "vcenter.selfcheck.local"
+    records = [{"moid": f"vm-{index}", "name": f"web-{index}", "vcenter": vcenter, "runtime.powerState": "poweredOn",
+                "tags": [{"category": "Tier", "name": "web"}]} for index in range(10)]
+    with store.InventoryStore(path) as inventory_store:
+        inventory_store.stage("selfcheck", records)
+        inventory_store.commit("selfcheck", vcenter)
+
+
+def selfcheck(argv):
+    """
+    Checks that vmlab cold start stays within its import-time budget.
+
+    Each probe is run several times and the fastest run counts, so a busy machine does not cause false failures.
+
+    :param argv: Command-line arguments after "selfcheck"
+    :return: Exit code, 0 if every probe succeeds within budget and --help and offline probes load no heavy modules
+    """
+    parser = argparse.ArgumentParser(prog="vmlab selfcheck", description="Check vmlab start-up import time.")
+    parser.add_argument("--budget-ms", type=float, default=IMPORT_BUDGET_MS, help="Import-time budget per probe in milliseconds.")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per probe; the fastest run is compared to the budget.")
+    parser.add_argument("--probe", action="append",
+                        help="vmlab arguments to measure, e.g. \"hcl update --test\" (repeatable, defaults to IMPORT_PROBES).")
+    args = parser.parse_args(argv)
+    probes = [probe.split() for probe in args.probe] if args.probe else IMPORT_PROBES
+
+    import tempfile
+
+    failed = False
+    print(f"{'PROBE':<44} {'IMPORT MS':>10}  STATUS")
+    with tempfile.TemporaryDirectory() as temp_dir:
+        store_path = os.path.join(temp_dir, "inventory.db")
+        if any("{store}" in probe for probe in probes):
+            write_probe_store(store_path)
+        for probe in probes:
+            command = [store_path if arg == "{store}" else arg for arg in probe]
+            runs = [import_profile(command) for _ in range(max(1, args.repeat))]
+            import_ms, packages, returncode = min(runs, key=lambda run: run[0])
+            heavy = sorted(name for name in HEAVY_MODULES if name in packages)
+            status = "ok"
+            if returncode:
+                status = f"exited with {returncode}"
+            elif import_ms > args.budget_ms:
+                status = f"over budget ({args.budget_ms:g} ms)"
+            elif heavy and ("--help" in probe or tuple(probe[:2]) in OFFLINE_COMMANDS):
+                status = f"imports {', '.join(heavy)}"
+            failed = failed or status != "ok"
+            print(f"{' '.join(probe):<44} {import_ms:>10.1f}  {status}")
+    return 1 if failed else 0
+
+
+def build_parser():
+    """
+    Builds the top-level vmlab parser. Each subcommand's own options are parsed by its module.
+
+    :return: argparse.ArgumentParser
+    """
+    parser = argparse.ArgumentParser(prog="vmlab", description="VMware lab tooling.")
+    groups = parser.add_subparsers(dest="group", metavar="{" + ",".join(sorted({g for g, _ in COMMANDS} | {"selfcheck"})) + "}")
+    group_parsers = {}
+    for (group, command), (_, _, help_text) in COMMANDS.items():
+        if group not in group_parsers:
+            group_parsers[group] = groups.add_parser(group, help=f"{group} commands.").add_subparsers(dest="command")
+        group_parsers[group].add_parser(command, help=help_text, add_help=False)
+    groups.add_parser("selfcheck", help="Check start-up import time against the budget.", add_help=False)
+    return parser
+
+
+def main(argv=None):
+    """
+    Dispatches to the module implementing the chosen subcommand.
+
+    :param argv: Command-line arguments (defaults to sys.argv[1:])
+    :return: Exit code
+    """
+    parser = build_parser()
+    args, rest = parser.parse_known_args(argv)
+    if args.group == "selfcheck":
+        return selfcheck(rest)
+    if not args.group or not getattr(args, "command", None):
+        parser.parse_args([args.group, "--help"] if args.group else ["--help"])
+    module_name, leading, _ = COMMANDS[(args.group, args.command)]
+    # Modules taking the command as a leading argument add it to their usage line themselves
+    sys.argv[0] = f"vmlab {args.group}" if leading else f"vmlab {args.group} {args.command}"
+    return importlib.import_module(module_name).main(leading + rest)
+
+
+if __name__ == "__main__":
+    sys.exit(main())